@@ -2,9 +2,10 @@ from django.contrib import admin
 from django.contrib.contenttypes.admin import GenericStackedInline
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+from core.autocomplete import PrefixSearchMixin
 from core.models import User
-from store.admin import ProductAdmin
-from store.models import Product
+from store.admin import CustomerAdmin, ProductAdmin
+from store.models import Customer, Product
 from tags.models import TaggedItem
 
 
@@ -34,7 +35,14 @@ class TagInline(GenericStackedInline):
 admin.site.unregister(Product)
     
 @admin.register(Product)
-class CustomProductAdmin(ProductAdmin):
+class CustomProductAdmin(PrefixSearchMixin, ProductAdmin):
     inlines = [TagInline]
+
+
+admin.site.unregister(Customer)
+
+@admin.register(Customer)
+class CustomCustomerAdmin(PrefixSearchMixin, CustomerAdmin):
+    pass
     
     
\ No newline at end of file
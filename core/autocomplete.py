@@ -0,0 +1,165 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.db.models.signals import post_delete, post_save
+
+from core.models import User
+from store.models import Customer, Product
+
+
+# In-memory prefix index for the admin's istartswith searches, which
+# autocomplete widgets run on every keystroke, so they don't cost a LIKE query.
+# Every process keeps its own copy: signals keep the local one current and
+# max_age bounds how long writes from other processes (or queryset.update(),
+# which sends no signals) can go unnoticed.
+class PrefixIndex:
+    max_age = 600
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.lock = threading.RLock()
+        self.built_at = None
+        self.keys = [] # sorted (key, pk)
+        self.objects = {} # pk -> keys
+
+    @staticmethod
+    def normalize(value) -> str:
+        return str(value).casefold()
+
+    def rows(self, queryset):
+        for row in queryset.values("pk", *self.fields):
+            yield row["pk"], tuple({self.normalize(row[field]) for field in self.fields if row[field]})
+
+    def build(self):
+        objects = dict(self.rows(self.model._default_manager.all()))
+        keys = sorted((key, pk) for pk, object_keys in objects.items() for key in object_keys)
+        with self.lock:
+            self.objects, self.keys = objects, keys
+            self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.built_at is None or time.monotonic() - self.built_at > self.max_age:
+            self.build()
+
+    def _add(self, pk, keys):
+        self.objects[pk] = keys
+        for key in keys:
+            insort(self.keys, (key, pk))
+
+    def _remove(self, pk):
+        keys = self.objects.pop(pk, ())
+        for key in keys:
+            index = bisect_left(self.keys, (key, pk))
+            if index < len(self.keys) and self.keys[index] == (key, pk):
+                del self.keys[index]
+
+    def reload(self, pks):
+        if self.built_at is None:
+            return # built from scratch on the first search
+        rows = list(self.rows(self.model._default_manager.filter(pk__in=pks)))
+        with self.lock:
+            for pk in pks:
+                self._remove(pk)
+            for (pk, keys) in rows:
+                self._add(pk, keys)
+
+    def discard(self, pk):
+        with self.lock:
+            self._remove(pk)
+
+    def iter_prefix(self, prefix):
+        index = bisect_left(self.keys, (prefix,))
+        while index < len(self.keys) and self.keys[index][0].startswith(prefix):
+            yield self.keys[index][1]
+            index += 1
+
+    def iter_matches(self, term):
+        # Like the admin's search: every word has to prefix one of the fields
+        words = [self.normalize(word) for word in term.split()]
+        if words:
+            candidates = self.iter_prefix(words[0])
+            others = [set(self.iter_prefix(word)) for word in words[1:]]
+        else:
+            candidates = (pk for (_, pk) in self.keys)
+            others = []
+
+        seen = set()
+        for pk in candidates:
+            if pk in seen or any(pk not in matches for matches in others):
+                continue
+            seen.add(pk)
+            yield pk
+
+    def matching_pks(self, term, limit):
+        # None when there are too many matches for a pk__in filter
+        self.ensure_built()
+        with self.lock:
+            pks = []
+            for pk in self.iter_matches(term):
+                pks.append(pk)
+                if len(pks) > limit:
+                    return None
+            return pks
+
+
+indexes = {}
+
+
+def register(model, fields, related=None):
+    # related maps another model to the lookup from `model` to it,
+    # for indexed fields that live on that model
+    index = indexes[model] = PrefixIndex(model, fields)
+
+    def reload(sender, instance, **kwargs):
+        index.reload([instance.pk])
+
+    def discard(sender, instance, **kwargs):
+        index.discard(instance.pk)
+
+    post_save.connect(reload, sender=model, weak=False)
+    post_delete.connect(discard, sender=model, weak=False)
+
+    for (related_model, lookup) in (related or {}).items():
+        def reload_related(sender, instance, lookup=lookup, **kwargs):
+            if index.built_at is not None:
+                index.reload(list(model._default_manager.filter(**{lookup: instance}).values_list("pk", flat=True)))
+        post_save.connect(reload_related, sender=related_model, weak=False)
+
+    return index
+
+
+# Only models whose admin searches are all istartswith: the index answers
+# exactly those. icontains searches (Collection, Tag, User) stay in SQL.
+register(Product, ["title"])
+register(
+    Customer,
+    ["user__first_name", "user__last_name"],
+    related={User: "user"},
+)
+
+
+def is_prefix_search(search_fields):
+    return bool(search_fields) and all(
+        field.startswith("^") or field.endswith("__istartswith")
+        for field in search_fields
+    )
+
+
+class PrefixSearchMixin:
+    # Changelist and autocomplete_fields search through the prefix index, a
+    # short pk__in list instead of LIKE 'term%' on every search field. The
+    # stock AutocompleteJsonView calls get_search_results() on the queryset
+    # from get_queryset(), so permissions and limit_choices_to still apply
+    prefix_search_max_ids = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        index = indexes.get(self.model)
+        if index is None or not search_term \
+            or not is_prefix_search(self.get_search_fields(request)):
+            return super().get_search_results(request, queryset, search_term)
+        pks = index.matching_pks(search_term, self.prefix_search_max_ids)
+        if pks is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=pks), False
@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+DEFAULTS = {
+    # Open connections per process, idle and in use
+    "max_size": 10,
+    # Seconds to wait for a connection when all are in use
+    "timeout": 10,
+    # Connections are closed after this many seconds...
+    "max_lifetime": 1800,
+    # ...or this many seconds unused, below the server's wait_timeout
+    "max_idle": 300,
+    # Ping a connection that has been idle longer than this before reuse
+    "check_interval": 30,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Hands out raw DB-API connections. One pool per database alias and
+    # process, shared by every thread (WSGI workers, ASGI's thread-sensitive
+    # threads) so connections outlive the thread that opened them
+    def __init__(self, alias, max_size, timeout, max_lifetime, max_idle, check_interval):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        self.idle = deque() # (connection, returned_at), most recent last
+        self.created_at = {} # connection -> when it was opened
+        self.size = 0
+        self.stats = Counter()
+        self.wait_seconds = 0.0
+
+    def getconn(self, connect, check):
+        # connect() opens a new connection, check(connection) raises if it's dead
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection, returned_at = self.take(deadline)
+            if connection is None:
+                # A free slot, open outside the lock
+                try:
+                    connection = connect()
+                except Exception:
+                    self.release_slot()
+                    raise
+                with self.condition:
+                    self.created_at[connection] = time.monotonic()
+                    self.stats["created"] += 1
+                return connection
+
+            if time.monotonic() - returned_at > self.check_interval:
+                try:
+                    check(connection)
+                except Exception:
+                    self.discard(connection, "failed_checks")
+                    continue
+            with self.condition:
+                self.stats["reused"] += 1
+            return connection
+
+    def take(self, deadline):
+        # An idle connection, or (None, None) when a new one may be opened
+        with self.condition:
+            waited = False
+            start = time.monotonic()
+            while True:
+                while self.idle:
+                    connection, returned_at = self.idle.pop()
+                    if self.expired(connection, returned_at):
+                        self.stats["expired"] += 1
+                        self._close(connection)
+                        continue
+                    self.record_wait(waited, start)
+                    return connection, returned_at
+                if self.size < self.max_size:
+                    self.size += 1
+                    self.record_wait(waited, start)
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No connection to '{self.alias}' available within {self.timeout}s, "
+                        f"all {self.max_size} are in use"
+                    )
+                waited = True
+                self.condition.wait(remaining)
+
+    def record_wait(self, waited, start):
+        if waited:
+            self.stats["waits"] += 1
+            self.wait_seconds += time.monotonic() - start
+
+    def putconn(self, connection):
+        with self.condition:
+            if self.expired(connection, time.monotonic()):
+                self.stats["expired"] += 1
+                self._close(connection)
+            else:
+                self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection, reason="discarded"):
+        with self.condition:
+            self.stats[reason] += 1
+            self._close(connection)
+            self.condition.notify()
+
+    def release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def expired(self, connection, returned_at):
+        now = time.monotonic()
+        return now - self.created_at.get(connection, now) > self.max_lifetime \
+            or now - returned_at > self.max_idle
+
+    def _close(self, connection):
+        # Called with the lock held
+        self.size -= 1
+        self.created_at.pop(connection, None)
+        self.stats["closed"] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.pop()
+                self._close(connection)
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "pid": os.getpid(),
+                "max_size": self.max_size,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "created": self.stats["created"],
+                "reused": self.stats["reused"],
+                "closed": self.stats["closed"],
+                "expired": self.stats["expired"],
+                "failed_checks": self.stats["failed_checks"],
+                "discarded": self.stats["discarded"],
+                "waits": self.stats["waits"],
+                "wait_seconds": round(self.wait_seconds, 3),
+                "timeouts": self.stats["timeouts"],
+            }
+
+
+pools = {}
+pools_lock = threading.Lock()
+pools_pid = os.getpid()
+
+
+def get_pool(alias, options):
+    global pools_pid
+    with pools_lock:
+        if pools_pid != os.getpid():
+            # Forked (e.g. gunicorn --preload), the parent's sockets aren't ours
+            pools.clear()
+            pools_pid = os.getpid()
+        pool = pools.get(alias)
+        if pool is None:
+            pool = pools[alias] = ConnectionPool(alias, **get_options(options))
+        return pool
+
+
+def get_options(options):
+    if options is True:
+        options = {}
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise ImproperlyConfigured(f"Unknown pool options: {', '.join(sorted(unknown))}")
+    return {**DEFAULTS, **options}
+
+
+def snapshot():
+    with pools_lock:
+        return {alias: pool.snapshot() for (alias, pool) in pools.items()}
+
+
+class PooledDatabaseWrapperMixin:
+    # Enabled with DATABASES[alias]["OPTIONS"]["pool"] = True or a dict of
+    # DEFAULTS overrides, like Django's PostgreSQL pool. Django still
+    # "closes" the connection at the end of every request (CONN_MAX_AGE = 0),
+    # which hands it back to the pool instead
+    @property
+    def pool_options(self):
+        return self.settings_dict["OPTIONS"].get("pool")
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.pool_options) if self.pool_options else None
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        if self.pool_options and self.settings_dict["CONN_MAX_AGE"] != 0:
+            raise ImproperlyConfigured("Pooled connections require CONN_MAX_AGE = 0")
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            return pool.getconn(
+                lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params),
+                self.check_pooled_connection,
+            )
+        except PoolTimeout as exc:
+            raise self.Database.OperationalError(str(exc)) from exc
+
+    def check_pooled_connection(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        if self.in_atomic_block or (self.errors_occurred and not self.is_usable()):
+            # Closed mid-transaction Django keeps self.connection around
+            # (closed_in_transaction), so it can't go to another request
+            pool.discard(self.connection)
+            return
+        try:
+            if not self.autocommit:
+                # Don't leak an open transaction to the next request
+                self.connection.rollback()
+        except self.Database.Error:
+            pool.discard(self.connection)
+            return
+        pool.putconn(self.connection)
@@ -0,0 +1,232 @@
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+DEFAULTS = {
+    # Aliases in DATABASES holding a copy of the default database
+    "ALIASES": [],
+    # "round_robin" or "least_lag"
+    "SELECTION": "round_robin",
+    # Replicas further behind than this many seconds aren't used
+    "MAX_LAG": 10,
+    # Seconds a measured lag is trusted for
+    "LAG_CHECK_INTERVAL": 5,
+    # After a write the client reads from the primary for this long
+    "PIN_SECONDS": 10,
+    "PIN_COOKIE": "primary_pin",
+    # Authenticated users are pinned by id as well, for API clients that
+    # don't keep cookies (JWT). Share this cache between workers
+    "PIN_CACHE": "default",
+}
+
+
+def get_setting(name):
+    return getattr(settings, "DATABASE_REPLICAS", {}).get(name, DEFAULTS[name])
+
+
+class RoutingState:
+    # Mutable so that writes made in a sync_to_async thread (which runs
+    # in a copy of the context) are seen by the middleware
+    def __init__(self, pinned=False):
+        self.replica_reads = False
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+state_var = ContextVar("replica_routing", default=None)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    # Reads in the block may go to a replica
+    state = state_var.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = state_var.set(state)
+    previous = state.replica_reads
+    state.replica_reads = enabled
+    try:
+        yield state
+    finally:
+        state.replica_reads = previous
+        if token is not None:
+            state_var.reset(token)
+
+
+def user_pin_key(user_id):
+    return f"replicas:pin:{user_id}"
+
+
+def pin_user(user):
+    caches[get_setting("PIN_CACHE")].set(user_pin_key(user.pk), 1, timeout=get_setting("PIN_SECONDS"))
+
+
+def check_user_pin(user):
+    # Once the request's user is known (JWT is decoded by the view, after
+    # the middleware ran): a user who just wrote reads from the primary
+    state = state_var.get()
+    if state is None or state.pinned or not user.is_authenticated:
+        return
+    state.pinned = caches[get_setting("PIN_CACHE")].get(user_pin_key(user.pk)) is not None
+
+
+class ReplicaLag:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.measured = {} # alias -> (seconds, measured_at)
+
+    def get(self, alias):
+        with self.lock:
+            lag, measured_at = self.measured.get(alias, (None, -math.inf))
+        if time.monotonic() - measured_at < get_setting("LAG_CHECK_INTERVAL"):
+            return lag
+        lag = self.measure(alias)
+        with self.lock:
+            self.measured[alias] = (lag, time.monotonic())
+        return lag
+
+    @staticmethod
+    def measure(alias):
+        connection = connections[alias]
+        if connection.vendor != "mysql":
+            return 0 # nothing to ask, e.g. SQLite copies for local testing
+        try:
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except DatabaseError:
+                    cursor.execute("SHOW SLAVE STATUS") # before MySQL 8.0.22
+                row = cursor.fetchone()
+                if row is None:
+                    return math.inf # not replicating
+                status = dict(zip([column[0] for column in cursor.description], row))
+        except DatabaseError:
+            return math.inf # unreachable
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        # NULL when replication is stopped
+        return math.inf if lag is None else lag
+
+
+lag = ReplicaLag()
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        state = state_var.get()
+        if state is None or not state.replica_reads or state.pinned or state.wrote:
+            return None
+        # Reads inside a transaction must see its writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if state.replica is None:
+            # One replica per request, so a page and its count agree
+            state.replica = self.choose_replica() or DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = state_var.get()
+        if state is not None:
+            state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from replication
+        if db in get_setting("ALIASES"):
+            return False
+        return None
+
+    def choose_replica(self):
+        max_lag = get_setting("MAX_LAG")
+        candidates = [
+            (alias, replica_lag)
+            for alias in get_setting("ALIASES")
+            if (replica_lag := lag.get(alias)) <= max_lag
+        ]
+        if not candidates:
+            return None
+        if get_setting("SELECTION") == "least_lag":
+            return min(candidates, key=lambda candidate: candidate[1])[0]
+        return candidates[next(self.counter) % len(candidates)][0]
+
+
+class ReplicaRoutingMiddleware:
+    # Sets up the routing state of each request and pins clients that
+    # just wrote to the primary (read-your-writes): with a short-lived
+    # cookie, and by user id when the request was authenticated. Anonymous
+    # clients without cookies may read stale rows for MAX_LAG seconds
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=get_setting("PIN_COOKIE") in request.COOKIES)
+        token = state_var.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            state_var.reset(token)
+        return self.pin(request, response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState(pinned=get_setting("PIN_COOKIE") in request.COOKIES)
+        token = state_var.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            state_var.reset(token)
+        return self.pin(request, response, state)
+
+    def pin(self, request, response, state):
+        if state.wrote and request.method not in SAFE_METHODS and response.status_code < 400:
+            # DRF sets the user it authenticated on the request too
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                pin_user(user)
+            response.set_cookie(
+                get_setting("PIN_COOKIE"),
+                "1",
+                max_age=get_setting("PIN_SECONDS"),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class ReplicaReadMixin:
+    # For viewsets: these actions read from a replica on safe methods
+    replica_actions = ("list", "retrieve")
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        enabled = request.method in SAFE_METHODS and action in self.replica_actions
+        with replica_reads(enabled):
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        check_user_pin(request.user)
@@ -1,3 +1,286 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from itertools import count
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.db.backends.sqlite3 import base as sqlite3
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core.autocomplete import indexes, is_prefix_search
+from core.db import pool as pool_module, replicas
+from core.db.pool import PooledDatabaseWrapperMixin, get_pool
+from core.db.replicas import PrimaryReplicaRouter, replica_reads
+from likes.counters import counters as like_counters
+from store.models import Collection, Customer, Product
+
+
+
+class PrefixSearchTests(TestCase):
+    def setUp(self):
+        # The indexes live as long as the process, rebuilt from this test's rows
+        for index in indexes.values():
+            index.built_at = None
+        collection = Collection.objects.create(title="Coffee")
+        for title in ["Espresso beans", "Espresso machine", "Dark roast", "Earl grey"]:
+            Product.objects.create(
+                title=title, slug=title.lower().replace(" ", "-"), unit_price=10, inventory=1, collection=collection
+            )
+        User = get_user_model()
+        for (first_name, last_name) in [("Ada", "Lovelace"), ("Alan", "Turing"), ("Grace", "Hopper")]:
+            user = User.objects.create_user(
+                first_name.lower(), email=f"{first_name.lower()}@example.com", first_name=first_name, last_name=last_name
+            )
+            Customer.objects.create(user=user)
+        self.client.force_login(User.objects.create_superuser("admin", email="admin@example.com", password="secret"))
+
+    def autocomplete(self, model_name, field_name, term):
+        response = self.client.get("/admin/autocomplete/", {
+            "app_label": "store", "model_name": model_name, "field_name": field_name, "term": term,
+        })
+        self.assertEqual(response.status_code, 200)
+        return {result["text"] for result in response.json()["results"]}
+
+    def products(self, term):
+        return self.autocomplete("orderitem", "product", term)
+
+    def test_matches_the_admin_search(self):
+        for term in ["esp", "ESPRESSO", "espresso esp", "espresso mach", "d", "roast", "tea", ""]:
+            with self.subTest(term=term):
+                # What the admin's SQL search finds: every word prefixes the title
+                products = Product.objects.all()
+                for word in term.split():
+                    products = products.filter(title__istartswith=word)
+                expected = set(products.values_list("title", flat=True))
+                self.assertEqual(self.products(term), expected)
+        self.assertEqual(self.autocomplete("order", "customer", "al"), {"Alan Turing"})
+        self.assertEqual(self.autocomplete("order", "customer", "hop"), {"Grace Hopper"})
+
+    def test_searches_without_like(self):
+        self.products("esp")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.products("esp"), {"Espresso beans", "Espresso machine"})
+        self.assertFalse([query for query in queries if "LIKE" in query["sql"]])
+
+    def test_follows_saves_and_deletes(self):
+        self.assertEqual(self.products("esp"), {"Espresso beans", "Espresso machine"})
+        product = Product.objects.get(title="Dark roast")
+        product.title = "Espresso roast"
+        product.save()
+        Product.objects.filter(title="Espresso beans").delete()
+        self.assertEqual(self.products("esp"), {"Espresso machine", "Espresso roast"})
+
+        # Customers are searched by their user's names
+        user = get_user_model().objects.get(username="grace")
+        user.last_name = "Brewster"
+        user.save()
+        self.assertEqual(self.autocomplete("order", "customer", "hop"), set())
+        self.assertEqual(self.autocomplete("order", "customer", "brew"), {"Grace Brewster"})
+
+    def test_only_prefix_searches_use_the_index(self):
+        self.assertTrue(is_prefix_search(["title__istartswith"]))
+        self.assertTrue(is_prefix_search(["^user__first_name", "user__last_name__istartswith"]))
+        self.assertFalse(is_prefix_search(["title"]))
+        self.assertFalse(is_prefix_search(["title__istartswith", "description"]))
+        self.assertFalse(is_prefix_search([]))
+
+
+class PooledDatabaseWrapper(PooledDatabaseWrapperMixin, sqlite3.DatabaseWrapper):
+    pass
+
+
+aliases = count()
+
+
+# The pool on SQLite files, what the MySQL backend adds to its wrapper
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        # Pools are per alias and process
+        self.alias = f"pooled{next(aliases)}"
+        self.options = {"max_size": 1, "timeout": 0.1}
+        self.wrappers = []
+        setup = self.connect()
+        with setup.cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id INTEGER PRIMARY KEY)")
+        setup.close()
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        connections[self.alias].close()
+        del connections[self.alias]
+        pool = pool_module.pools.pop(self.alias)
+        pool.close_all()
+
+    def connect(self):
+        # A wrapper of its own, like another thread's
+        # configure_settings() fills in the defaults, it needs a default alias
+        settings_dict = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {},
+            self.alias: {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": os.path.join(self.directory.name, "db.sqlite3"),
+                "CONN_MAX_AGE": 0,
+                "OPTIONS": {"pool": self.options},
+            }
+        })[self.alias]
+        wrapper = PooledDatabaseWrapper(settings_dict, self.alias)
+        # transaction.atomic(using=alias) finds the last one
+        connections[self.alias] = wrapper
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.options)
+
+    def test_connections_are_reused(self):
+        first = self.connect()
+        first.ensure_connection()
+        raw = first.connection
+        first.close()
+
+        second = self.connect()
+        second.ensure_connection()
+        self.assertIs(second.connection, raw)
+        self.assertEqual(self.pool.snapshot()["created"], 1)
+
+    def test_max_size_and_timeout(self):
+        first = self.connect()
+        first.ensure_connection()
+        with self.assertRaisesMessage(OperationalError, "all 1 are in use"):
+            self.connect().ensure_connection()
+        self.assertEqual(self.pool.snapshot()["timeouts"], 1)
+
+        first.close()
+        self.connect().ensure_connection()
+
+    def test_returned_connections_are_rolled_back(self):
+        first = self.connect()
+        first.set_autocommit(False)
+        first.cursor().execute("INSERT INTO item (id) VALUES (1)")
+        raw = first.connection
+        first.close()
+
+        second = self.connect()
+        with second.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM item")
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.assertIs(second.connection, raw)
+
+    def test_closed_in_atomic_block_is_discarded(self):
+        first = self.connect()
+        with transaction.atomic(using=self.alias):
+            first.cursor().execute("INSERT INTO item (id) VALUES (1)")
+            raw = first.connection
+            first.close()
+        snapshot = self.pool.snapshot()
+        self.assertEqual(snapshot["discarded"], 1)
+        self.assertEqual(snapshot["size"], 0)
+
+        second = self.connect()
+        second.ensure_connection()
+        self.assertIsNot(second.connection, raw)
+
+    @skipUnless(hasattr(os, "fork"), "needs fork()")
+    def test_forked_process_starts_with_an_empty_pool(self):
+        first = self.connect()
+        first.ensure_connection()
+        first.close()
+
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read)
+                os.write(write, json.dumps(self.pool.snapshot()).encode())
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            child = json.loads(pipe.read())
+        os.waitpid(pid, 0)
+
+        self.assertEqual((child["size"], child["idle"]), (0, 0))
+        self.assertEqual(child["pid"], pid)
+        # The parent keeps its connection
+        self.assertEqual(self.pool.snapshot()["idle"], 1)
+
+
+# The default database stands in for a replica: it's always healthy, so
+# reads that may use a replica are routed to "default" instead of None.
+# Only around requests, flush() between tests mustn't skip a "replica"
+as_replica = override_settings(DATABASE_REPLICAS={"ALIASES": [DEFAULT_DB_ALIAS]})
+
+
+# Likes are made to pin, their counts are never flushed
+@override_settings(LIKE_COUNTERS={"FLUSH_INTERVAL": 3600})
+class ReplicaRoutingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title="Coffee")
+        self.product = Product.objects.create(
+            title="Beans", slug="beans", unit_price=10, inventory=1, collection=collection
+        )
+        User = get_user_model()
+        self.writer, self.reader = [
+            User.objects.create_user(name, email=f"{name}@example.com", password="secret")
+            for name in ("writer", "reader")
+        ]
+
+    def tearDown(self):
+        like_counters.pending.clear()
+
+    @as_replica
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertIsNone(router.db_for_read(Product))
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), DEFAULT_DB_ALIAS)
+        with replica_reads(enabled=False):
+            self.assertIsNone(router.db_for_read(Product))
+        with replica_reads() as state:
+            state.pinned = True
+            self.assertIsNone(router.db_for_read(Product))
+        with replica_reads():
+            # Read your own writes in the same request
+            router.db_for_write(Product)
+            self.assertIsNone(router.db_for_read(Product))
+        with replica_reads(), transaction.atomic():
+            self.assertIsNone(router.db_for_read(Product))
+
+    def reads_replica(self, user):
+        # A fresh client, without the pin cookie
+        client = APIClient()
+        client.force_authenticate(user)
+        with as_replica, mock.patch.object(replicas.lag, "get", wraps=replicas.lag.get) as get:
+            self.assertEqual(client.get("/store/products/").status_code, 200)
+        return get.called
+
+    def test_writers_are_pinned_by_user_id(self):
+        self.assertTrue(self.reads_replica(self.writer))
+
+        client = APIClient()
+        client.force_authenticate(self.writer)
+        response = client.post(f"/store/products/{self.product.pk}/like/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("primary_pin", response.cookies)
+
+        self.assertFalse(self.reads_replica(self.writer))
+        self.assertTrue(self.reads_replica(self.reader))
+
+    def test_pin_expires(self):
+        client = APIClient()
+        client.force_authenticate(self.writer)
+        with override_settings(DATABASE_REPLICAS={"PIN_SECONDS": 0.01}):
+            client.post(f"/store/products/{self.product.pk}/like/")
+        time.sleep(0.02)
+        self.assertTrue(self.reads_replica(self.writer))
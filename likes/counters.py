@@ -0,0 +1,154 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+from likes.models import LikeCount
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Seconds between flushes of a process' pending counts, 0 writes through
+    # in the request
+    "FLUSH_INTERVAL": 2,
+    # Wake the flusher early once this many objects have pending counts
+    "MAX_PENDING": 1000,
+    # Objects per UPDATE
+    "BATCH_SIZE": 500,
+    # Keys remembered to have a LikeCount row, forgotten past this
+    "MAX_KNOWN": 100000,
+}
+
+
+def get_setting(name):
+    return getattr(settings, "LIKE_COUNTERS", {}).get(name, DEFAULTS[name])
+
+
+class LikeCounters:
+    # Write-behind counters: likes and unlikes are summed in process and
+    # applied every FLUSH_INTERVAL by a daemon thread, with one
+    # UPDATE ... count = count + CASE per batch of objects. A product liked
+    # a thousand times a minute costs its row a few locks a minute instead
+    # of a thousand, and requests never wait for the write
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = Counter() # (content_type_id, object_id) -> change
+        self.known = set() # keys whose LikeCount row exists
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def add(self, content_type_id, object_id, delta):
+        with self.lock:
+            self.pending[(content_type_id, object_id)] += delta
+            size = len(self.pending)
+        if not get_setting("FLUSH_INTERVAL"):
+            self.flush(blocking=True)
+            return
+        self.start()
+        if size >= get_setting("MAX_PENDING"):
+            self.wakeup.set()
+
+    def start(self):
+        # Lazily in every process, threads don't survive a fork()
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, name="like-counters", daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(get_setting("FLUSH_INTERVAL"))
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Like counts could not be flushed")
+            finally:
+                # Like a request's end: honours CONN_MAX_AGE, returns pooled connections
+                close_old_connections()
+
+    def get_pending(self, content_type_id, obj_ids):
+        # This process' changes that aren't in the table yet
+        with self.lock:
+            return {
+                pk: delta
+                for pk in obj_ids
+                if (delta := self.pending.get((content_type_id, pk)))
+            }
+
+    def flush(self, blocking=False):
+        # One flush at a time, requests arriving meanwhile keep adding
+        if not self.flush_lock.acquire(blocking=blocking):
+            return
+        try:
+            with self.lock:
+                pending, self.pending = self.pending, Counter()
+            try:
+                self.write(pending)
+            except DatabaseError:
+                logger.exception("Like counts could not be written, retrying with the next flush")
+                with self.lock:
+                    self.pending.update(pending)
+        finally:
+            self.flush_lock.release()
+
+    def write(self, pending):
+        deltas = defaultdict(dict) # content_type_id -> {object_id: change}
+        for ((content_type_id, object_id), delta) in sorted(pending.items()):
+            if delta:
+                deltas[content_type_id][object_id] = delta
+
+        if not deltas:
+            return
+        batch_size = get_setting("BATCH_SIZE")
+        if len(self.known) > get_setting("MAX_KNOWN"):
+            self.known.clear()
+        # All or nothing, a failed write is retried whole
+        with transaction.atomic():
+            created = self.write_deltas(deltas, batch_size)
+        self.known.update(created)
+
+    def write_deltas(self, deltas, batch_size):
+        created = []
+        for (content_type_id, changes) in deltas.items():
+            missing = [pk for pk in changes if (content_type_id, pk) not in self.known]
+            if missing:
+                # Created with 0 and incremented below like the others, a
+                # row inserted concurrently by another process is kept
+                LikeCount.objects.bulk_create(
+                    [LikeCount(content_type_id=content_type_id, object_id=pk) for pk in missing],
+                    batch_size=batch_size,
+                    ignore_conflicts=True,
+                )
+            object_ids = list(changes)
+            # Sorted batches, so concurrent flushes lock rows in the same order
+            for start in range(0, len(object_ids), batch_size):
+                LikeCount.objects.adjust(
+                    content_type_id, {pk: changes[pk] for pk in object_ids[start:start + batch_size]}
+                )
+            created.extend((content_type_id, pk) for pk in missing)
+        return created
+
+    def counts(self, content_type, obj_ids):
+        # {object_id: likes} for every id, read-your-own-likes within a process
+        obj_ids = list(obj_ids)
+        stored = LikeCount.objects.for_objects(content_type, obj_ids)
+        pending = self.get_pending(content_type.id, obj_ids)
+        return {pk: max(stored.get(pk, 0) + pending.get(pk, 0), 0) for pk in obj_ids}
+
+
+counters = LikeCounters()
+
+# What's still pending when the worker stops, waiting for a flush in
+# progress. Drift (e.g. a killed worker) is left to reconcile_like_counts
+atexit.register(counters.flush, blocking=True)
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Count, F, Q, Value, When
+
+from likes.counters import get_setting
+from likes.models import LikeCount, LikedItem
+
+
+class Command(BaseCommand):
+    help = "Recount LikeCount from the likes table. Counts still pending in the web " \
+        "processes are counted twice once they flush, run it when likes are quiet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report objects whose stored count has drifted",
+        )
+
+    def handle(self, *args, **options):
+        actual = {
+            (content_type_id, object_id): count
+            for (content_type_id, object_id, count) in LikedItem.objects\
+                .order_by()\
+                .values('content_type', 'object_id')\
+                .annotate(count=Count('pk'))\
+                .values_list('content_type', 'object_id', 'count')\
+                .iterator()
+        }
+        stored = {
+            (content_type_id, object_id): count
+            for (content_type_id, object_id, count) in LikeCount.objects\
+                .values_list('content_type', 'object_id', 'count')\
+                .iterator()
+        }
+
+        # Rows of objects nobody likes anymore are set to 0, not deleted
+        drifted = {
+            key: actual.get(key, 0)
+            for key in actual.keys() | stored.keys()
+            if stored.get(key) != actual.get(key, 0)
+        }
+        for ((content_type_id, object_id), count) in sorted(drifted.items()):
+            self.stdout.write(f"{content_type_id}:{object_id}: stored {stored.get((content_type_id, object_id))}, actual {count}")
+
+        if options["dry_run"]:
+            self.stdout.write(f"{len(drifted)} counts have drifted")
+            return
+
+        batch_size = get_setting("BATCH_SIZE")
+        LikeCount.objects.bulk_create(
+            [
+                LikeCount(content_type_id=content_type_id, object_id=object_id, count=count)
+                for ((content_type_id, object_id), count) in drifted.items()
+                if (content_type_id, object_id) not in stored
+            ],
+            batch_size=batch_size,
+            # A process may have flushed the row meanwhile, the next run fixes it
+            ignore_conflicts=True,
+        )
+        changed = sorted(key for key in drifted if key in stored)
+        for start in range(0, len(changed), batch_size):
+            batch = changed[start:start + batch_size]
+            LikeCount.objects.filter(
+                Q(*[Q(content_type_id=content_type_id, object_id=object_id) for (content_type_id, object_id) in batch], _connector=Q.OR)
+            ).update(count=Case(
+                *[
+                    When(content_type_id=content_type_id, object_id=object_id, then=Value(drifted[(content_type_id, object_id)]))
+                    for (content_type_id, object_id) in batch
+                ],
+                default=F('count'),
+            ))
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} counts were reconciled"))
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    # Keeps each user's first like of an object so the unique constraint applies
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    earlier = LikedItem.objects.filter(
+        user=models.OuterRef('user'),
+        content_type=models.OuterRef('content_type'),
+        object_id=models.OuterRef('object_id'),
+        pk__lt=models.OuterRef('pk'),
+    )
+    # Collected first, MySQL can't delete from a table its subquery reads
+    duplicates = list(LikedItem.objects.filter(models.Exists(earlier)).values_list('pk', flat=True))
+    for start in range(0, len(duplicates), 1000):
+        LikedItem.objects.filter(pk__in=duplicates[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='likeditem',
+            unique_together={('user', 'content_type', 'object_id')},
+        ),
+        migrations.AddIndex(
+            model_name='likeditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='likes_liked_content_7292dd_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_likes(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCount = apps.get_model('likes', 'LikeCount')
+    counts = LikedItem.objects.order_by()\
+        .values('content_type', 'object_id')\
+        .annotate(count=models.Count('pk'))\
+        .values_list('content_type', 'object_id', 'count')
+    LikeCount.objects.bulk_create(
+        (
+            LikeCount(content_type_id=content_type_id, object_id=object_id, count=count)
+            for (content_type_id, object_id, count) in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0002_likeditem_unique_and_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
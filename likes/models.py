@@ -1,13 +1,123 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
-  
+
+class LikedItemManager(models.Manager):
+    # Return whether anything changed, counters are kept by likes.signals
+    def like(self, user, obj):
+        try:
+            with transaction.atomic():
+                self.create(user=user, content_object=obj)
+        except IntegrityError:
+            # Liked already, by this or a concurrent request
+            return False
+        return True
+
+    def unlike(self, user, obj):
+        content_type = ContentType.objects.get_for_model(obj)
+        deleted, _ = self.filter(user=user, content_type=content_type, object_id=obj.pk).delete()
+        return deleted > 0
+    
+    # Which of obj_ids the user liked, one query on the (user, content_type,
+    # object_id) unique index whatever the number of objects
+    def liked_ids(self, user, obj_type, obj_ids):
+        if not user.is_authenticated:
+            return set()
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return set(self._liked(user, content_type, obj_ids))
+    
+    async def aliked_ids(self, user, obj_type, obj_ids):
+        if not user.is_authenticated:
+            return set()
+        # get_for_model() only queries the first time, but may
+        content_type = await sync_to_async(ContentType.objects.get_for_model)(obj_type)
+        return {pk async for pk in self._liked(user, content_type, obj_ids)}
+    
+    def _liked(self, user, content_type, obj_ids):
+        return self.filter(user=user, content_type=content_type, object_id__in=obj_ids)\
+            .values_list('object_id', flat=True)
     
+    # Sets obj.liked = True/False on a page of objects of one model
+    def prefetch_liked(self, user, objects, to_attr='liked'):
+        objects = list(objects)
+        if objects:
+            liked = self.liked_ids(user, type(objects[0]), [obj.pk for obj in objects])
+            self._attach(objects, liked, to_attr)
+        return objects
+    
+    async def aprefetch_liked(self, user, objects, to_attr='liked'):
+        objects = list(objects)
+        if objects:
+            liked = await self.aliked_ids(user, type(objects[0]), [obj.pk for obj in objects])
+            self._attach(objects, liked, to_attr)
+        return objects
+    
+    @staticmethod
+    def _attach(objects, liked, to_attr):
+        for obj in objects:
+            setattr(obj, to_attr, obj.pk in liked)
+    
+    # Changes whenever the user likes or unlikes something of obj_type,
+    # for HTTP validators of responses that show it
+    def version_for(self, user, obj_type):
+        content_type = ContentType.objects.get_for_model(obj_type)
+        state = self.filter(user=user, content_type=content_type)\
+            .aggregate(count=models.Count('pk'), last=models.Max('pk'))
+        return (state['count'], state['last'])
+
+
+
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType,on_delete=models.CASCADE) # type: ignore
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
-    
\ No newline at end of file
+
+    class Meta:
+        # One like per user and object, duplicates would inflate the counts.
+        # Also the index of "has this user liked it" lookups
+        unique_together = [['user','content_type','object_id']]
+        # Counting the likes of an object
+        indexes = [
+            models.Index(fields=['content_type','object_id']),
+        ]
+
+
+class LikeCountQuerySet(models.QuerySet):
+    def for_objects(self, content_type, obj_ids):
+        # {object_id: count}, objects without a row are left out
+        return dict(
+            self.filter(content_type=content_type, object_id__in=obj_ids)\
+                .values_list('object_id', 'count')
+        )
+
+    def adjust(self, content_type_id, deltas):
+        # deltas maps object id -> change, applied with a single UPDATE
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return 0
+        return self.filter(content_type_id=content_type_id, object_id__in=deltas).update(
+            count=models.F('count') + models.Case(
+                *[models.When(object_id=pk, then=models.Value(delta)) for pk, delta in deltas.items()],
+                default=models.Value(0),
+            )
+        )
+
+
+# Denormalized Count() of LikedItem per object. Written behind by
+# likes.counters.LikeCounters, likes counted by another process show up
+# within LIKE_COUNTERS["FLUSH_INTERVAL"], reconcile_like_counts repairs drift
+
+class LikeCount(models.Model):
+    objects = LikeCountQuerySet.as_manager()
+    content_type = models.ForeignKey(ContentType,on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    # Signed: deltas flushed by different processes may arrive out of order
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['content_type','object_id']]
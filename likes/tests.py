@@ -1,3 +1,72 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from likes.counters import counters
+from likes.models import LikeCount, LikedItem
+from store.models import Collection, Product
+
+
+# Long enough that the flusher thread never wakes up during a test
+@override_settings(LIKE_COUNTERS={"FLUSH_INTERVAL": 3600})
+class LikeCountersTests(TestCase):
+    def setUp(self):
+        counters.pending.clear()
+        counters.known.clear()
+        collection = Collection.objects.create(title="Coffee")
+        self.product = Product.objects.create(
+            title="Beans", slug="beans", unit_price=10, inventory=1, collection=collection
+        )
+        self.content_type = ContentType.objects.get_for_model(Product)
+        User = get_user_model()
+        self.users = [User.objects.create_user(f"user{i}", email=f"user{i}@example.com", password="secret") for i in range(3)]
+
+    def tearDown(self):
+        # Nothing left for the atexit flush
+        counters.pending.clear()
+
+    def stored(self):
+        return LikeCount.objects.for_objects(self.content_type, [self.product.pk]).get(self.product.pk, 0)
+
+    def counted(self):
+        return counters.counts(self.content_type, [self.product.pk])[self.product.pk]
+
+    def like(self, user):
+        # Counters are added on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return LikedItem.objects.like(user, self.product)
+
+    def unlike(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            return LikedItem.objects.unlike(user, self.product)
+
+    def test_flush_writes_pending_counts(self):
+        for user in self.users:
+            self.assertTrue(self.like(user))
+        self.assertFalse(self.like(self.users[0]))
+        self.assertEqual(self.stored(), 0)
+        # Read your own likes before the flush
+        self.assertEqual(self.counted(), 3)
+
+        counters.flush()
+        self.assertEqual(self.stored(), 3)
+        self.assertEqual(self.counted(), 3)
+        self.assertFalse(counters.pending)
+
+        self.assertTrue(self.unlike(self.users[1]))
+        self.assertFalse(self.unlike(self.users[1]))
+        counters.flush()
+        self.assertEqual(self.stored(), 2)
+
+        output = StringIO()
+        call_command("reconcile_like_counts", "--dry-run", stdout=output)
+        self.assertIn("0 counts have drifted", output.getvalue())
+
+    @override_settings(LIKE_COUNTERS={"FLUSH_INTERVAL": 0})
+    def test_no_interval_writes_through(self):
+        self.like(self.users[0])
+        self.assertEqual(self.stored(), 1)
+        self.assertFalse(counters.pending)
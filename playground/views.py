@@ -8,6 +8,7 @@ from django.db.models.functions import Concat
 from django.db.models.aggregates import Count,Avg, Max, Min, Sum
 from django.contrib.contenttypes.models import ContentType
 
+from store.analytics import revenue_report
 from store.models import Order, Product, OrderItem, Customer,Collection
 from tags.models import TaggedItem
 
@@ -172,20 +173,20 @@ def aggregate_order_items():
         )
 
 def calculate_total_revenue():
-    return OrderItem.objects.aggregate(
-        total_revenue=Sum(Reference("quantity") * Reference("unit_price")),
-        average_revenue=Avg(Reference('quantity') * Reference('unit_price'))
-        )
+    # Sum(F('quantity') * F('unit_price')) over every OrderItem is a full
+    # scan, the rollup tables (store.analytics) hold a row per day
+    report = revenue_report()
+    return {
+        "total_revenue": report["revenue"],
+        "average_revenue": report["average_item_revenue"],
+        }
 
 def aggregate_orders():
-    orders = OrderItem.objects.values('order').annotate(
-        order_revenue=Sum(Reference('quantity') * Reference('unit_price'))
-    )
-    
-    return orders.aaggregate(
-        total_revenue=Sum("order_revenue"),
-        average_revenue=Avg("order_revenue")
-    )
+    report = revenue_report()
+    return {
+        "total_revenue": report["revenue"],
+        "average_revenue": report["average_order_revenue"],
+        }
     
 def aggregate_objects():
     result = aggregate_product()
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from polls.models import Choice, ChoiceVoteShard, Vote
+
+
+class Command(BaseCommand):
+    help = "Add the votes held by ChoiceVoteShard rows to Choice.votes, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--recount",
+            action="store_true",
+            help="Set Choice.votes from the vote table instead, to repair drift (deleted votes)",
+        )
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            choice_ids = list(Choice.objects.order_by('pk').values_list('pk', flat=True))
+        else:
+            choice_ids = list(
+                ChoiceVoteShard.objects.exclude(votes=0).order_by('choice').values_list('choice', flat=True).distinct()
+            )
+
+        for choice_id in choice_ids:
+            # One choice at a time: its shards are locked, so votes arriving
+            # meanwhile wait and land in the emptied shards afterwards
+            with transaction.atomic():
+                shards = list(
+                    ChoiceVoteShard.objects.select_for_update()
+                        .filter(choice_id=choice_id)
+                        .values_list('pk', 'votes')
+                )
+                choice = Choice.objects.filter(pk=choice_id)
+                if options["recount"]:
+                    votes = Vote.objects.filter(choice=OuterRef('pk'))\
+                        .order_by()\
+                        .values('choice')\
+                        .annotate(count=Count('pk'))\
+                        .values('count')
+                    choice.update(votes=Coalesce(Subquery(votes), 0))
+                else:
+                    choice.update(votes=F('votes') + sum(votes for (_, votes) in shards))
+                ChoiceVoteShard.objects.filter(pk__in=[pk for (pk, votes) in shards if votes]).update(votes=0)
+
+        action = "recounted" if options["recount"] else "folded"
+        self.stdout.write(self.style.SUCCESS(f"{len(choice_ids)} choices were {action}"))
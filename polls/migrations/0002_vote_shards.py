@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_single_choice_votes(apps, schema_editor):
+    # Each user's first vote on a single choice question, earlier
+    # duplicates are kept but don't block the unique constraint
+    Vote = apps.get_model('polls', 'Vote')
+    votes = Vote.objects.filter(user__isnull=False, choice__question__allow_multiple_choice=False)\
+        .order_by('pk')\
+        .values_list('pk', 'user_id', 'choice__question_id')
+    first = {}
+    for (pk, user_id, question_id) in votes.iterator():
+        first.setdefault((user_id, question_id), pk)
+    by_question = {}
+    for ((user_id, question_id), pk) in first.items():
+        by_question.setdefault(question_id, []).append(pk)
+    for (question_id, pks) in by_question.items():
+        for start in range(0, len(pks), 1000):
+            Vote.objects.filter(pk__in=pks[start:start + 1000]).update(single_choice_question_id=question_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='single_choice_question',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.question'),
+        ),
+        migrations.RunPython(mark_single_choice_votes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together={('user', 'choice'), ('user', 'single_choice_question')},
+        ),
+        migrations.CreateModel(
+            name='ChoiceVoteShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_shards', to='polls.choice')),
+            ],
+            options={
+                'unique_together': {('choice', 'shard')},
+            },
+        ),
+    ]
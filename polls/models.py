@@ -1,6 +1,9 @@
 
+import random
+
 from django.conf import settings
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 
@@ -34,24 +37,73 @@ class Question(models.Model):
         return self.question_text
     
 
+class ChoiceQuerySet(models.QuerySet):
+    def with_total_votes(self):
+        # Folded votes plus what the shards hold until the next fold_vote_shards
+        shards = ChoiceVoteShard.objects.filter(choice=models.OuterRef('pk'))\
+            .order_by()\
+            .values('choice')\
+            .annotate(total=models.Sum('votes'))\
+            .values('total')
+        return self.annotate(total_votes=models.F('votes') + Coalesce(models.Subquery(shards), 0))
+
+
 class Choice(models.Model):
+    objects = ChoiceQuerySet.as_manager()
     choice_text = models.CharField(max_length=200)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    # Votes folded in from the shards, see ChoiceVoteShard
     votes = models.IntegerField(default=0)
     
     def __str__(self):
         return self.choice_text
     
 
+class ChoiceVoteShardQuerySet(models.QuerySet):
+    def add_vote(self, choice_id):
+        # A random shard, so concurrent voters rarely wait on the same row lock
+        shards = getattr(settings, 'POLL_VOTE_SHARDS', 16)
+        shard = random.randrange(shards)
+        queryset = self.filter(choice_id=choice_id, shard=shard)
+        if not queryset.update(votes=models.F('votes') + 1):
+            # First vote of the choice, its shards are created together
+            self.bulk_create(
+                [ChoiceVoteShard(choice_id=choice_id, shard=i) for i in range(shards)],
+                ignore_conflicts=True,
+            )
+            queryset.update(votes=models.F('votes') + 1)
+
+
+# Choice.votes split into rows that are summed on read (with_total_votes)
+# and folded back into Choice.votes by fold_vote_shards
+
+class ChoiceVoteShard(models.Model):
+    objects = ChoiceVoteShardQuerySet.as_manager()
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='vote_shards')
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = [['choice','shard']]
+    
+
 class Vote(models.Model):
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE, 
                              null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     voted_at = models.DateTimeField(auto_now_add=True)
+    # Set on votes of questions without allow_multiple_choice, so the
+    # database allows one per user and question (NULLs never collide)
+    single_choice_question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
     
     class Meta:
-        unique_together = ('user','choice') # Prevent duplicate votes per user
+        unique_together = [
+            ('user','choice'), # Prevent duplicate votes per user
+            ('user','single_choice_question'),
+        ]
     
     
 class Comment(models.Model):
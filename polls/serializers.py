@@ -0,0 +1,77 @@
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .models import Choice, ChoiceVoteShard, Question, Vote
+
+
+class ChoiceSerializer(serializers.ModelSerializer):
+    # Choice.objects.with_total_votes(), the shards included
+    votes = serializers.IntegerField(source='total_votes', read_only=True)
+    
+    class Meta:
+        model = Choice
+        fields = ['id','choice_text','votes']
+
+
+class QuestionSerializer(serializers.ModelSerializer):
+    choices = ChoiceSerializer(many=True, read_only=True, source='choice_set')
+    
+    class Meta:
+        model = Question
+        fields = [
+            'id',
+            'question_text',
+            'published_date',
+            'expiry_date',
+            'is_active',
+            'allow_multiple_choice',
+            'category',
+            'tag',
+            'choices',
+        ]
+
+
+class VoteSerializer(serializers.ModelSerializer):
+    choice_id = serializers.IntegerField()
+    
+    def validate_choice_id(self, choice_id):
+        # The choice and its question in one query, the checks below need nothing else
+        self.choice = Choice.objects.select_related('question')\
+            .filter(pk=choice_id, question_id=self.context['question_id'])\
+            .first()
+        if self.choice is None:
+            raise serializers.ValidationError("No choice with the given id was found in this question!")
+        return choice_id
+    
+    def validate(self, attrs):
+        question = self.choice.question
+        if not question.is_active:
+            raise serializers.ValidationError("This question is closed.")
+        if question.has_expired():
+            raise serializers.ValidationError("This question has expired.")
+        return attrs
+    
+    def save(self, **kwargs):
+        question = self.choice.question
+        try:
+            with transaction.atomic():
+                # The unique constraints reject a second vote for the choice, or
+                # for the question unless it allows multiple choices
+                self.instance = Vote.objects.create(
+                    choice=self.choice,
+                    user=self.context['user'],
+                    ip_address=self.context.get('ip_address'),
+                    single_choice_question=None if question.allow_multiple_choice else question,
+                )
+                ChoiceVoteShard.objects.add_vote(self.choice.pk)
+        except IntegrityError:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                "You have already voted for this choice." if question.allow_multiple_choice
+                else "You have already voted on this question."
+            ]})
+        return self.instance
+    
+    class Meta:
+        model = Vote
+        fields = ['id','choice_id','voted_at']
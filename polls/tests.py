@@ -1,3 +1,74 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db.models import Sum
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from polls.models import Category, Choice, ChoiceVoteShard, Question, Tag, Vote
+
+
+class VoteTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(f"voter{i}", email=f"voter{i}@example.com", password="secret")
+            for i in range(5)
+        ]
+        self.question = Question.objects.create(
+            question_text="Beans or leaves?",
+            created_by=self.users[0],
+            category=Category.objects.create(name="Drinks"),
+            tag=Tag.objects.create(name="breakfast"),
+        )
+        self.beans = Choice.objects.create(question=self.question, choice_text="Beans")
+        self.leaves = Choice.objects.create(question=self.question, choice_text="Leaves")
+        self.client = APIClient()
+
+    def vote(self, user, choice):
+        self.client.force_authenticate(user)
+        return self.client.post(f"/polls/questions/{self.question.pk}/vote/", {"choice_id": choice.pk})
+
+    def totals(self):
+        # What the API shows
+        response = self.client.get(f"/polls/questions/{self.question.pk}/")
+        return {choice["id"]: choice["votes"] for choice in response.data["choices"]}
+
+    def sharded(self, choice):
+        return ChoiceVoteShard.objects.filter(choice=choice).aggregate(votes=Sum("votes"))["votes"] or 0
+
+    def test_votes_are_sharded_then_folded(self):
+        for user in self.users[:3]:
+            self.assertEqual(self.vote(user, self.beans).status_code, 201)
+        self.assertEqual(self.vote(self.users[3], self.leaves).status_code, 201)
+
+        self.assertEqual(Choice.objects.get(pk=self.beans.pk).votes, 0)
+        self.assertEqual(self.sharded(self.beans), 3)
+        self.assertEqual(self.totals(), {self.beans.pk: 3, self.leaves.pk: 1})
+
+        call_command("fold_vote_shards", stdout=StringIO())
+        self.assertEqual(Choice.objects.get(pk=self.beans.pk).votes, 3)
+        self.assertEqual(self.sharded(self.beans), 0)
+        self.assertEqual(self.totals(), {self.beans.pk: 3, self.leaves.pk: 1})
+
+        # Votes after a fold land in the emptied shards
+        self.vote(self.users[4], self.beans)
+        self.assertEqual(self.totals(), {self.beans.pk: 4, self.leaves.pk: 1})
+
+    def test_recount_repairs_deleted_votes(self):
+        for user in self.users[:3]:
+            self.vote(user, self.beans)
+        call_command("fold_vote_shards", stdout=StringIO())
+        Vote.objects.filter(user=self.users[0]).delete()
+
+        call_command("fold_vote_shards", "--recount", stdout=StringIO())
+        self.assertEqual(self.totals(), {self.beans.pk: 2, self.leaves.pk: 0})
 
-# Create your tests here.
+    def test_one_vote_per_single_choice_question(self):
+        self.assertEqual(self.vote(self.users[0], self.beans).status_code, 201)
+        self.assertEqual(self.vote(self.users[0], self.beans).status_code, 400)
+        response = self.vote(self.users[0], self.leaves)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("non_field_errors", response.data)
+        self.assertEqual(self.totals(), {self.beans.pk: 1, self.leaves.pk: 0})
@@ -0,0 +1,11 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from . import views
+
+router = DefaultRouter()
+router.register("questions", views.QuestionViewSet)
+
+urlpatterns = [
+    path("", include(router.urls)),
+]
@@ -1,3 +1,29 @@
-from django.shortcuts import render
+from django.db.models import Prefetch
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.viewsets import ReadOnlyModelViewSet
 
-# Create your views here.
+from .models import Choice, Question
+from .serializers import QuestionSerializer, VoteSerializer
+
+
+class QuestionViewSet(ReadOnlyModelViewSet):
+    # Vote totals are summed from the shards, one query for all the choices
+    queryset = Question.objects.prefetch_related(
+        Prefetch('choice_set', queryset=Choice.objects.with_total_votes().order_by('pk'))
+    ).order_by('-published_date')
+    serializer_class = QuestionSerializer
+    
+    @action(detail=True, methods=['POST'], permission_classes=[IsAuthenticated])
+    def vote(self, request:Request, pk)->Response:
+        serializer = VoteSerializer(data=request.data, context={
+            'question_id': pk,
+            'user': request.user,
+            'ip_address': request.META.get('REMOTE_ADDR'),
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -27,12 +27,13 @@ class CollectionAdmin(admin.ModelAdmin):
     search_fields = ['title']
     list_display = [
         'title',
-        'products_count'
+        'products_count_link',
+        'tax_rate'
     ]   
     list_per_page = 10
     
-    @admin.display(ordering='products_count')
-    def products_count(self, collection):
+    @admin.display(ordering='products_count', description='products count')
+    def products_count_link(self, collection):
         # reverse("admin:app_model_page")
         url = (
             reverse("admin:store_product_changelist")
@@ -43,11 +44,6 @@ class CollectionAdmin(admin.ModelAdmin):
         ) # filtering products
         return format_html('<a href="{}">{}</a>', url, collection.products_count)
         # return collection.products_count
-    
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
 
 
 @admin.register(models.Product)
@@ -108,7 +104,7 @@ class CustomerAdmin(admin.ModelAdmin):
     list_editable = ['membership']
     list_per_page = 10
     ordering = ['user__first_name','user__last_name']
-    search_fields = ['first_name__istartswith','last_name__istartswith']
+    search_fields = ['user__first_name__istartswith','user__last_name__istartswith']
     
     @admin.display(ordering='order_made')
     def order_made(self,customer):
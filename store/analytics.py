@@ -0,0 +1,212 @@
+import time
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncMonth, TruncWeek
+
+from store.models import (
+    CollectionDailyRevenue,
+    DailyRevenue,
+    OrderItem,
+    ProductDailyRevenue,
+    RevenueRollupState,
+)
+
+
+INTERVALS = {
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+
+# Seconds an id gap below the watermark is re-scanned for. Ids are
+# allocated on insert but become visible on commit, so an item of a
+# transaction that commits late shows up below items already rolled up.
+# A gap that's still empty after this was a rollback.
+GAP_TIMEOUT = 3600
+
+
+def rollup_revenue(batch_size=10000):
+    # Adds the order items created since the last run, each batch in its
+    # own transaction together with the watermark. Items changed or
+    # deleted after being rolled up are only picked up by backfill_revenue()
+    processed = rollup_gaps()
+    while True:
+        with transaction.atomic():
+            # Locking the state row serializes concurrent runs
+            state, _ = RevenueRollupState.objects.select_for_update().get_or_create(pk=1)
+            items = list(order_items(OrderItem.objects.filter(pk__gt=state.last_order_item_id))[:batch_size])
+            if not items:
+                return processed
+            add_items(items, state.last_order_item_id)
+            state.gaps.extend(find_gaps(state.last_order_item_id, [item[0] for item in items], time.time()))
+            state.last_order_item_id = items[-1][0]
+            state.save()
+        processed += len(items)
+
+
+def rollup_gaps():
+    # Adds the items that committed into a gap since the last run
+    with transaction.atomic():
+        state, _ = RevenueRollupState.objects.select_for_update().get_or_create(pk=1)
+        now = time.time()
+        gaps = [gap for gap in state.gaps if now - gap[2] < GAP_TIMEOUT]
+        items = []
+        if gaps:
+            ranges = reduce(or_, (Q(pk__range=(first, last)) for (first, last, _) in gaps))
+            items = list(order_items(OrderItem.objects.filter(ranges)))
+        if items:
+            found = [item[0] for item in items]
+            add_items(items, state.last_order_item_id, late=found)
+            gaps = remove_ids(gaps, set(found))
+        if gaps != state.gaps:
+            state.gaps = gaps
+            state.save()
+    return len(items)
+
+
+def order_items(queryset):
+    return queryset.order_by("pk")\
+        .annotate(date=TruncDate("order__placed_at"))\
+        .values_list("pk", "order_id", "date", "product_id", "product__collection_id", "quantity", "unit_price")
+
+
+def find_gaps(last_id, pks, seen_at):
+    # pks are sorted and above last_id
+    gaps = []
+    for pk in pks:
+        if pk > last_id + 1:
+            gaps.append([last_id + 1, pk - 1, seen_at])
+        last_id = pk
+    return gaps
+
+
+def remove_ids(gaps, ids):
+    remaining = []
+    for (first, last, seen_at) in gaps:
+        start = first
+        for pk in sorted(pk for pk in ids if first <= pk <= last):
+            if pk > start:
+                remaining.append([start, pk - 1, seen_at])
+            start = pk + 1
+        if start <= last:
+            remaining.append([start, last, seen_at])
+    return remaining
+
+
+def backfill_revenue(batch_size=10000):
+    # Rebuild every rollup from the order items, in one transaction so
+    # reports never see them half rebuilt
+    with transaction.atomic():
+        for model in (DailyRevenue, CollectionDailyRevenue, ProductDailyRevenue):
+            model.objects.all().delete()
+        RevenueRollupState.objects.update_or_create(pk=1, defaults={"last_order_item_id": 0, "gaps": []})
+        return rollup_revenue(batch_size)
+
+
+def add_items(items, last_order_item_id, late=()):
+    # items are (pk, order_id, date, product_id, collection_id, quantity, unit_price),
+    # late are the ones below last_order_item_id
+    daily = defaultdict(lambda: [0, 0, 0, Decimal(0)])
+    collections = defaultdict(lambda: [0, 0, Decimal(0)])
+    products = defaultdict(lambda: [0, 0, Decimal(0)])
+
+    # An order is new unless some of its items were rolled up before
+    order_dates = {order_id: date for (_, order_id, date, *_) in items}
+    seen_orders = set(
+        OrderItem.objects.filter(order_id__in=order_dates, pk__lte=last_order_item_id)
+        .exclude(pk__in=late)
+        .values_list("order_id", flat=True)
+    )
+    for (order_id, date) in order_dates.items():
+        if order_id not in seen_orders:
+            daily[(date,)][0] += 1
+
+    for (_, order_id, date, product_id, collection_id, quantity, unit_price) in items:
+        revenue = quantity * unit_price
+        daily[(date,)][1] += 1
+        daily[(date,)][2] += quantity
+        daily[(date,)][3] += revenue
+        for totals in (collections[(date, collection_id)], products[(date, product_id)]):
+            totals[0] += 1
+            totals[1] += quantity
+            totals[2] += revenue
+
+    add_totals(DailyRevenue, ["date"], ["orders", "items", "quantity", "revenue"], daily)
+    add_totals(CollectionDailyRevenue, ["date", "collection_id"], ["items", "quantity", "revenue"], collections)
+    add_totals(ProductDailyRevenue, ["date", "product_id"], ["items", "quantity", "revenue"], products)
+
+
+def add_totals(model, key_fields, fields, totals):
+    # Read-modify-write is safe, rollup_revenue() holds the state row lock
+    lookups = {
+        f"{field}__in": {key[position] for key in totals}
+        for (position, field) in enumerate(key_fields)
+    }
+    existing = {
+        tuple(getattr(row, field) for field in key_fields): row
+        for row in model.objects.filter(**lookups)
+    }
+    created = []
+    for (key, values) in totals.items():
+        row = existing.get(key)
+        if row is None:
+            row = model(**dict(zip(key_fields, key)))
+            created.append(row)
+        for (field, value) in zip(fields, values):
+            setattr(row, field, getattr(row, field) + value)
+
+    model.objects.bulk_create(created)
+    model.objects.bulk_update(
+        [row for (key, row) in existing.items() if key in totals],
+        fields,
+    )
+
+
+def revenue_report(since=None, until=None, interval="day", collection_id=None, product_id=None):
+    if product_id is not None:
+        queryset = ProductDailyRevenue.objects.filter(product_id=product_id)
+    elif collection_id is not None:
+        queryset = CollectionDailyRevenue.objects.filter(collection_id=collection_id)
+    else:
+        queryset = DailyRevenue.objects.all()
+    if since is not None:
+        queryset = queryset.filter(date__gte=since)
+    if until is not None:
+        queryset = queryset.filter(date__lte=until)
+
+    # Order counts only exist for the whole store
+    fields = ["items", "quantity", "revenue"]
+    if queryset.model is DailyRevenue:
+        fields.insert(0, "orders")
+    sums = {field: Sum(field) for field in fields}
+
+    totals = queryset.aggregate(**sums)
+    totals = {field: totals[field] or 0 for field in fields}
+    totals["revenue"] = cents(totals["revenue"])
+    totals["average_item_revenue"] = average(totals["revenue"], totals["items"])
+    if "orders" in totals:
+        totals["average_order_revenue"] = average(totals["revenue"], totals["orders"])
+
+    series = queryset.annotate(period=INTERVALS[interval]("date"))\
+        .values("period")\
+        .annotate(**sums)\
+        .order_by("period")
+    series = [{**row, "revenue": cents(row["revenue"])} for row in series]
+    return {**totals, "interval": interval, "series": series}
+
+
+def cents(value):
+    # SQLite sums decimals as floats
+    return Decimal(value).quantize(Decimal("0.01"))
+
+
+def average(total, count):
+    if not count:
+        return None
+    return cents(total / count)
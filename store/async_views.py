@@ -0,0 +1,120 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from core.db.replicas import check_user_pin, replica_reads
+from likes.models import LikedItem
+from store.views import CartViewSet, CollectionViewSet, ProductViewSet
+from tags.models import TaggedItem
+
+
+# Read-only endpoints for the ASGI deployment. DRF views are synchronous,
+# so these reuse the viewsets' querysets, filters, pagination and
+# serializers but fetch through the async ORM, and a request waiting on the
+# database doesn't hold a thread. Serializers only read rows that were
+# already fetched (no lazy relations), so they never block the event loop.
+# Response caching and ETags stay with the sync viewsets.
+
+def render(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type="application/json")
+
+
+def async_api_view(view_function):
+    @require_GET
+    @wraps(view_function)
+    async def view(request, *args, **kwargs):
+        try:
+            return await view_function(request, *args, **kwargs)
+        except APIException as exc:
+            # Same body as DRF's exception handler
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+            return render(data, exc.status_code)
+    return view
+
+
+async def aget_view(viewset_class, request, action, **kwargs):
+    view = viewset_class(action=action, args=(), kwargs=kwargs, format_kwarg=None)
+    view.request = Request(request, authenticators=view.get_authenticators())
+    # The viewset's authentication (e.g. ?include=liked is per user), off
+    # the event loop: JWTAuthentication looks the user up synchronously
+    await sync_to_async(lambda: check_user_pin(view.request.user))()
+    view.check_permissions(view.request)
+    return view
+
+
+def use_replica(view):
+    # Same opt-in as the viewsets' ReplicaReadMixin
+    return replica_reads(view.action in getattr(view, "replica_actions", ()))
+
+
+async def alist(view):
+    with use_replica(view):
+        # DjangoFilterBackend validates ModelChoiceFilters and FullTextSearchFilter
+        # checks for its table with queries, so filtering runs off the event loop
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+        # Flat lists like the viewsets' (store.flat)
+        flat = view.get_flat_serializer() if hasattr(view, "get_flat_serializer") else None
+        if flat is not None:
+            queryset = view.get_flat_queryset(flat, queryset)
+        render = flat.render if flat is not None else lambda page: view.get_serializer(page, many=True).data
+        paginator = view.paginator
+        if paginator is None:
+            objects = [obj async for obj in queryset]
+        else:
+            objects = await paginator.apaginate_queryset(queryset, view.request, view)
+        if flat is None:
+            await aprefetch(view, objects)
+    if paginator is None:
+        return render(objects)
+    return paginator.get_paginated_response(render(objects)).data
+
+
+async def aretrieve(view):
+    queryset = view.optimize_queryset(view.get_queryset())
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    try:
+        with use_replica(view):
+            instance = await queryset.aget(**{view.lookup_field: view.kwargs[lookup_url_kwarg]})
+            await aprefetch(view, [instance])
+    except queryset.model.DoesNotExist:
+        raise NotFound(f"No {queryset.model._meta.object_name} matches the given query.")
+    return view.get_serializer(instance).data
+
+
+async def aprefetch(view, objects):
+    # What the serializers would otherwise fetch themselves, e.g. ?include=tags
+    context = view.get_serializer_context()
+    if context.get("include_tags"):
+        await TaggedItem.objects.aprefetch_tags(objects)
+    if context.get("liked_by") is not None:
+        await LikedItem.objects.aprefetch_liked(context["liked_by"], objects)
+
+
+@async_api_view
+async def product_list(request):
+    return render(await alist(await aget_view(ProductViewSet, request, "list")))
+
+
+@async_api_view
+async def product_detail(request, pk):
+    return render(await aretrieve(await aget_view(ProductViewSet, request, "retrieve", pk=pk)))
+
+
+@async_api_view
+async def collection_list(request):
+    return render(await alist(await aget_view(CollectionViewSet, request, "list")))
+
+
+@async_api_view
+async def collection_detail(request, pk):
+    return render(await aretrieve(await aget_view(CollectionViewSet, request, "retrieve", pk=pk)))
+
+
+@async_api_view
+async def cart_detail(request, pk):
+    return render(await aretrieve(await aget_view(CartViewSet, request, "retrieve", pk=pk)))
@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.db import connections, models, transaction
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+@contextmanager
+def deferred_constraints(using):
+    # Skip MySQL's per-row foreign key lookups, loads insert parents before
+    # children. Unique checks stay on: import files come from users and a
+    # repeated username or slug has to fail, not corrupt the index
+    connection = connections[using]
+    if connection.vendor != "mysql":
+        # Django creates foreign keys DEFERRABLE INITIALLY DEFERRED on
+        # PostgreSQL and SQLite, they're checked once per transaction already
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SET foreign_key_checks = 0")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SET foreign_key_checks = 1")
+
+
+class Progress:
+    def __init__(self, stream, label, total=None, interval=1.0):
+        self.stream = stream
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.started_at = self.reported_at = time.monotonic()
+
+    def add(self, count):
+        self.count += count
+        if time.monotonic() - self.reported_at >= self.interval:
+            self.report()
+
+    def report(self, ending=""):
+        self.reported_at = time.monotonic()
+        rate = self.count / max(self.reported_at - self.started_at, 1e-9)
+        total = f"/{self.total}" if self.total is not None else ""
+        self.stream.write(f"\r{self.label}: {self.count}{total} rows, {rate:.0f} rows/s", ending=ending)
+
+    def done(self):
+        self.report(ending="\n")
+
+
+def bulk_load(model, objs, batch_size, using="default", progress=None):
+    # Plain QuerySet.bulk_create: custom ones (ProductQuerySet) keep
+    # denormalized counters per batch, loaders recount once at the end.
+    # Each chunk is committed on its own so memory stays flat
+    queryset = models.QuerySet(model, using=using)
+    with deferred_constraints(using):
+        for chunk in chunked(objs, batch_size):
+            with transaction.atomic(using=using):
+                queryset.bulk_create(chunk, batch_size=batch_size)
+            if progress is not None:
+                progress.add(len(chunk))
+    if progress is not None:
+        progress.done()
+
+
+def load_data_infile(model, path, columns, using="default", progress=None):
+    # MySQL's bulk loader reads the CSV itself, by far the fastest path.
+    # Needs local_infile enabled on the server and in DATABASES OPTIONS
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    # Nothing calls pre_save(), fill auto_now columns the CSV doesn't have
+    now = [
+        field.column
+        for field in opts.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+        if field.column not in columns
+    ]
+    # csv.writer ends lines with \r\n by default
+    with open(path, "rb") as file:
+        newline = "\\r\\n" if file.readline().endswith(b"\r\n") else "\\n"
+    sql = (
+        f"LOAD DATA LOCAL INFILE %s INTO TABLE {qn(opts.db_table)} CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+        f"LINES TERMINATED BY '{newline}' IGNORE 1 LINES "
+        f"({', '.join(qn(column) for column in columns)})"
+    )
+    if now:
+        sql += f" SET {', '.join(f'{qn(column)} = NOW()' for column in now)}"
+    with deferred_constraints(using), transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [str(path)])
+            count = cursor.rowcount
+    if progress is not None:
+        progress.add(count)
+        progress.done()
+    return count
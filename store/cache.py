@@ -0,0 +1,205 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from store.optimizer import ordering_fields
+
+
+class CacheStats:
+    # Per process counters, the cache backend itself is per process too
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.hits = Counter()
+            self.misses = Counter()
+            self.invalidations = Counter()
+
+    def hit(self, namespace):
+        with self.lock:
+            self.hits[namespace] += 1
+
+    def miss(self, namespace):
+        with self.lock:
+            self.misses[namespace] += 1
+
+    def invalidated(self, key):
+        with self.lock:
+            self.invalidations[key] += 1
+
+    def snapshot(self):
+        with self.lock:
+            namespaces = {}
+            for namespace in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits[namespace], self.misses[namespace]
+                namespaces[namespace] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_ratio": hits / (hits + misses),
+                }
+            return {
+                "namespaces": namespaces,
+                "invalidations": dict(self.invalidations),
+            }
+
+
+stats = CacheStats()
+
+
+# Responses are cached under a version number that invalidation bumps,
+# so dropping every page of a list is a single incr()
+
+def version_key(namespace, pk=None):
+    if pk is None:
+        return f"store:{namespace}:version"
+    return f"store:{namespace}:{pk}:version"
+
+
+def get_version(namespace, pk=None):
+    key = version_key(namespace, pk)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a version evicted from the cache
+        # can't come back and match responses cached under it before
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(namespace, pk=None):
+    key = version_key(namespace, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Nothing was cached under this version yet
+        pass
+    stats.invalidated(namespace if pk is None else f"{namespace}:{pk}")
+
+
+def invalidate_on_commit(*keys):
+    # Invalidate once the write is visible, otherwise a concurrent
+    # request could cache the old rows again
+    transaction.on_commit(lambda: [invalidate(namespace, pk) for (namespace, pk) in keys])
+
+
+def response_key(namespace, pk, request, etag=None):
+    # Filters, search, ordering and pagination are all in the query string
+    url = hashlib.md5(f"{request.build_absolute_uri()}:{etag}".encode()).hexdigest()
+    return f"store:{namespace}:{'list' if pk is None else pk}:{get_version(namespace, pk)}:{url}"
+
+
+class CachedResponseMixin:
+    cache_namespace = None
+    # Set by ConditionalGetMixin. Keying responses on it means rows changed
+    # without a signal, or in another worker, never serve a stale response
+    validator_etag = None
+
+    def list(self, request, *args, **kwargs):
+        key = response_key(self.cache_namespace, None, request, self.validator_etag)
+        return self.get_cached_response(key, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        key = response_key(self.cache_namespace, pk, request, self.validator_etag)
+        return self.get_cached_response(key, super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, key, view, request, *args, **kwargs):
+        data = cache.get(key)
+        if data is not None:
+            stats.hit(self.cache_namespace)
+            return Response(data)
+
+        stats.miss(self.cache_namespace)
+        response = view(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data)
+        return response
+
+
+# HTTP validators: clients that send If-None-Match / If-Modified-Since
+# get a 304 before the detail or a list page is fetched and rendered
+
+class ConditionalGetMixin:
+    last_modified_field = "last_update"
+
+    def list(self, request, *args, **kwargs):
+        extra = self.get_extra_validators()
+        etag = self.get_etag(request, {**self.get_page_validators(), **extra})
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            self.validator_etag = etag
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        return self.add_validator_headers(response, etag, None, extra)
+
+    def get_page_validators(self):
+        # The rows of the requested page and the newest last_update among
+        # them, read in one query over a few columns. Nothing is serialized
+        # and MAX/COUNT never run over the whole filtered queryset
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = dict.fromkeys(["id", self.last_modified_field, *ordering_fields(queryset)])
+        rows = queryset.prefetch_related(None).values_list(*columns, named=True)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            page = list(rows)
+        return {
+            "pks": [row.id for row in page],
+            "last_modified": max((getattr(row, self.last_modified_field) for row in page), default=None),
+            # ?count= and the next/previous links depend on rows off the page
+            "count": getattr(self.paginator, "count", None),
+            "has_next": getattr(self.paginator, "has_next", None),
+            "has_previous": getattr(self.paginator, "has_previous", None),
+        }
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        last_modified = self.get_queryset()\
+            .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})\
+            .values_list(self.last_modified_field, flat=True)\
+            .first()
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        extra = self.get_extra_validators()
+        validators = {"pk": kwargs[lookup_url_kwarg], "last_modified": last_modified, **extra}
+        etag = self.get_etag(request, validators)
+        # A date can't tell that the user's likes changed, per-user
+        # content is validated by its ETag alone
+        last_modified = None if extra else int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            self.validator_etag = etag
+            response = super().retrieve(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        return self.add_validator_headers(response, etag, last_modified, extra)
+
+    def get_extra_validators(self):
+        # What else the representation depends on, e.g. the user's likes
+        return {}
+
+    def get_etag(self, request, validators):
+        # JSON and the browsable API are different representations
+        fingerprint = f"{request.accepted_media_type}:{sorted(validators.items())}"
+        return quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+
+    def add_validator_headers(self, response, etag, last_modified, extra):
+        response.headers["ETag"] = etag
+        if last_modified:
+            response.headers["Last-Modified"] = http_date(last_modified)
+        if extra:
+            # Per-user content, shared caches must not mix users up
+            patch_vary_headers(response, ["Authorization"])
+        return response
@@ -0,0 +1,83 @@
+import csv
+import json
+from decimal import Decimal
+from itertools import groupby
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from store.models import Order
+
+
+ORDER_FIELDS = {
+    "order_id": "id",
+    "placed_at": "placed_at",
+    "payment_status": "payment_status",
+    "customer_id": "customer_id",
+    "customer_first_name": "customer__user__first_name",
+    "customer_last_name": "customer__user__last_name",
+    "customer_email": "customer__user__email",
+}
+ITEM_FIELDS = {
+    "item_id": "orderitem__id",
+    "product_id": "orderitem__product_id",
+    "product_title": "orderitem__product__title",
+    "quantity": "orderitem__quantity",
+    "unit_price": "orderitem__unit_price",
+}
+# quantity * unit_price, computed here so it's exact on every backend
+COLUMNS = [*ORDER_FIELDS, *ITEM_FIELDS, "revenue"]
+
+
+def order_rows(orders=None, chunk_size=2000):
+    # One row per order item (orders without items get one row of
+    # empty item columns), ordered by order.
+    # Orders are read in keyset batches: mysqlclient buffers the whole
+    # result of a query client-side, so iterator() alone isn't enough to
+    # stay in constant memory there
+    orders = (orders if orders is not None else Order.objects.all()).order_by()
+    last_id = 0
+    while True:
+        ids = list(orders.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            return
+        last_id = ids[-1]
+        rows = Order.objects.filter(pk__in=ids)\
+            .order_by("pk", "orderitem__id")\
+            .values_list(*ORDER_FIELDS.values(), *ITEM_FIELDS.values())
+        for row in rows.iterator(chunk_size=chunk_size):
+            row = dict(zip([*ORDER_FIELDS, *ITEM_FIELDS], row))
+            row["revenue"] = row["quantity"] * row["unit_price"] if row["item_id"] is not None else None
+            yield row
+
+
+class Echo:
+    # csv.writer writes to a file, this hands each line back instead
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row.values())
+
+
+def jsonl_lines(rows):
+    # One order per line with its items nested
+    for (order_id, items) in groupby(rows, key=lambda row: row["order_id"]):
+        items = list(items)
+        order = {field: items[0][field] for field in ORDER_FIELDS}
+        order["items"] = [
+            {field: item[field] for field in [*ITEM_FIELDS, "revenue"]}
+            for item in items
+            if item["item_id"] is not None
+        ]
+        order["revenue"] = sum((item["revenue"] for item in order["items"]), Decimal("0.00"))
+        yield json.dumps(order, cls=DjangoJSONEncoder) + "\n"
+
+
+FORMATS = {
+    "csv": (csv_lines, "text/csv"),
+    "jsonl": (jsonl_lines, "application/x-ndjson"),
+}
@@ -1,7 +1,14 @@
+import operator
+import re
+from functools import lru_cache, reduce
 
+from django.db import connections
+from django.db.models import F, FloatField, Func, Q
+from django.db.models.expressions import RawSQL
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import SearchFilter
 
-from store.models import Collection, Product
+from store.models import Collection, Order, Product, ProductSearchIndex
 
 
 class ProductFilter(FilterSet):
@@ -17,4 +24,89 @@ class CollectionFilter(FilterSet):
         model = Collection
         fields = {
             "title":['iexact']
-        }
\ No newline at end of file
+        }
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            "placed_at":['gte','lt'],
+            "payment_status":['exact'],
+            "customer_id":['exact'],
+        }
+
+
+@lru_cache
+def has_table(alias, table):
+    return table in connections[alias].introspection.table_names()
+
+
+# Searches the full-text index created by store/migrations/0019 and orders by
+# relevance (search_rank, highest first) unless ?ordering= is given.
+# Other backends get the plain SearchFilter (icontains).
+class FullTextSearchFilter(SearchFilter):
+    rank_annotation = "search_rank"
+    # innodb_ft_min_token_size, shorter words are not indexed
+    mysql_min_token_size = 3
+
+    def filter_queryset(self, request, queryset, view):
+        terms = [
+            word
+            for term in self.get_search_terms(request)
+            for word in re.findall(r"\w+", term)
+        ]
+        if not terms:
+            return super().filter_queryset(request, queryset, view)
+
+        connection = connections[queryset.db]
+        if connection.vendor == "mysql":
+            return self.filter_mysql(connection, queryset, view, terms) \
+                or super().filter_queryset(request, queryset, view)
+        if connection.vendor == "sqlite" and queryset.model is Product \
+            and has_table(connection.alias, ProductSearchIndex._meta.db_table):
+            return self.filter_sqlite(queryset, terms)
+        return super().filter_queryset(request, queryset, view)
+
+    def filter_mysql(self, connection, queryset, view, terms):
+        qn = connection.ops.quote_name
+        table = qn(queryset.model._meta.db_table)
+        search_fields = self.get_search_fields(view, None)
+        # Must list exactly the columns of the FULLTEXT index
+        columns = ", ".join(f"{table}.{qn(field)}" for field in search_fields)
+        # Boolean mode operators (+ - < > ( ) ~ * " @) in a term would change
+        # the query or make it invalid, only word characters are kept
+        terms = [re.sub(r"\W", "", term) for term in terms]
+        # Every word is required and may be a prefix, like SearchFilter's AND
+        words = [f"+{term}*" for term in terms if len(term) >= self.mysql_min_token_size]
+        if not words:
+            return None
+        rank = RawSQL(
+            f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)",
+            [" ".join(words)],
+            output_field=FloatField(),
+        )
+        queryset = queryset.annotate(**{self.rank_annotation: rank})\
+            .filter(**{f"{self.rank_annotation}__gt": 0})
+        # Shorter words aren't in the index, they still have to match
+        for term in terms:
+            if term and len(term) < self.mysql_min_token_size:
+                queryset = queryset.filter(reduce(operator.or_, [
+                    Q(**{self.construct_search(str(field), queryset): term})
+                    for field in search_fields
+                ]))
+        return queryset.order_by(f"-{self.rank_annotation}")
+
+    def filter_sqlite(self, queryset, terms):
+        # Quoted prefix phrases, FTS5 ANDs them
+        match = " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        # Joined rather than a correlated subquery, which ran the MATCH
+        # again for every candidate row. bm25() is lower for better matches
+        rank = Func(
+            F("search_index__document"),
+            function="bm25",
+            template="-%(function)s(%(expressions)s)",
+            output_field=FloatField(),
+        )
+        return queryset.filter(search_index__document__match=match)\
+            .annotate(**{self.rank_annotation: rank})\
+            .order_by(f"-{self.rank_annotation}")
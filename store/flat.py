@@ -0,0 +1,165 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+from store.middleware import timed_serialization
+from store.optimizer import ordering_fields
+
+
+# Flat read mode for list endpoints: instead of building a model instance
+# per row and walking the serializer's fields for each of them, the page is
+# fetched as values_list() tuples of the declared sources and rendered with
+# one precomputed converter per column. The output is the same as the
+# serializer's, field order included.
+#
+# Only serializers made of columns can be compiled: plain fields, pks of
+# to-one relations, sources through non-null to-one relations, and fields
+# listed in Meta.computed_field_sources that the serializer fills in with
+# add_computed_values(rows, data). Anything else (nested serializers,
+# hyperlinks, SerializerMethodFields) keeps the regular serializer.
+
+# DRF's to_representation of these returns database values unchanged
+IDENTITY_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.ReadOnlyField,
+)
+
+
+class Unsupported(Exception):
+    pass
+
+
+class FlatSerializer:
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        serializer = serializer_class()
+        meta = getattr(serializer_class, "Meta", None)
+        model = getattr(meta, "model", None)
+        if model is None:
+            raise Unsupported("Meta.model") # plain Serializers, no queryset to read
+        computed_field_sources = getattr(meta, "computed_field_sources", {})
+
+        self.lookups = []
+        columns = [] # (field name, lookup or None, converter or None)
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            sources = computed_field_sources.get(field.field_name)
+            if sources is not None:
+                if not hasattr(serializer_class, "add_computed_values"):
+                    raise Unsupported(field.field_name)
+                for source in sources:
+                    self.add_lookup(resolve(model, source.split("."), None))
+                columns.append((field.field_name, None, None))
+                continue
+            convert = converter(field)
+            lookup = resolve(model, field.source_attrs, field)
+            self.add_lookup(lookup)
+            columns.append((field.field_name, lookup, convert))
+
+        # Positions in the values_list() rows
+        self.columns = [
+            (name, None if lookup is None else self.lookups.index(lookup), convert)
+            for (name, lookup, convert) in columns
+        ]
+        self.computed = any(lookup is None for (_, lookup, _) in columns)
+
+    def add_lookup(self, lookup):
+        if lookup not in self.lookups:
+            self.lookups.append(lookup)
+
+    def values(self, queryset, fields=()):
+        # fields are fetched as well, e.g. the ones keyset pagination reads
+        lookups = self.lookups + [name for name in fields if name not in self.lookups]
+        return queryset.prefetch_related(None).values_list(*lookups, named=True)
+
+    @timed_serialization()
+    def render(self, rows):
+        rows = list(rows)
+        data = []
+        for row in rows:
+            item = {}
+            for (name, index, convert) in self.columns:
+                if index is None:
+                    item[name] = None # computed below
+                    continue
+                value = row[index]
+                item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        if self.computed and rows:
+            self.serializer_class.add_computed_values(rows, data)
+        return data
+
+
+def resolve(model, attrs, field):
+    # The values() lookup of a dotted source
+    lookup = []
+    for (position, attr) in enumerate(attrs):
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise Unsupported(attr) # a property or method
+        lookup.append(model_field.name)
+        last = position == len(attrs) - 1
+        if not model_field.is_relation:
+            if not last:
+                raise Unsupported(attr)
+        elif not model_field.concrete or not (model_field.many_to_one or model_field.one_to_one):
+            raise Unsupported(attr) # to-many relations would repeat rows
+        elif last:
+            # The FK column, as a pk
+            if field is not None and not (isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None):
+                raise Unsupported(attr)
+        elif model_field.null and field is not None:
+            # DRF raises or renders None for a missing object, values() can't tell
+            raise Unsupported(attr)
+        else:
+            model = model_field.related_model
+    return LOOKUP_SEP.join(lookup)
+
+
+def converter(field):
+    if isinstance(field, serializers.BaseSerializer) or not isinstance(field, serializers.Field):
+        raise Unsupported(field.field_name)
+    if isinstance(field, serializers.SerializerMethodField) or field.source == "*":
+        raise Unsupported(field.field_name)
+    if isinstance(field, (PrimaryKeyRelatedField, *IDENTITY_FIELDS)):
+        return None
+    if isinstance(field, serializers.RelatedField):
+        raise Unsupported(field.field_name)
+    return field.to_representation
+
+
+@lru_cache
+def get_flat_serializer(serializer_class):
+    try:
+        return FlatSerializer(serializer_class)
+    except Unsupported:
+        return None
+
+
+class FlatListMixin:
+    # For viewsets: list() renders through FlatSerializer when the
+    # serializer compiles, the regular serializer otherwise
+    def get_flat_serializer(self):
+        return get_flat_serializer(self.get_serializer_class())
+
+    def get_flat_queryset(self, flat, queryset):
+        return flat.values(queryset, ordering_fields(queryset))
+
+    def list(self, request, *args, **kwargs):
+        flat = self.get_flat_serializer()
+        if flat is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.get_flat_queryset(flat, self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(flat.render(page))
+        return Response(flat.render(queryset))
@@ -0,0 +1,273 @@
+import json
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, QuerySet
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from store.management.commands.seed_store import WORDS
+from store.middleware import QueryRecorder
+from likes.counters import counters as like_counters
+from likes.models import LikedItem
+from store.models import Cart, CartItem, Collection, Customer, OrderItem, Product
+from tags.models import TaggedItem
+
+
+class Command(BaseCommand):
+    help = "Benchmark the store API hot paths against the data in the database (see seed_store)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument(
+            "--allocation-iterations",
+            type=int,
+            default=10,
+            help="Requests per scenario measured under tracemalloc, which is too slow for the timed run",
+        )
+        parser.add_argument("--scenario", action="append", dest="scenarios", help="Only run these scenarios")
+        parser.add_argument(
+            "--warm-cache",
+            action="store_true",
+            help="Keep the response cache between requests instead of measuring the views themselves",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--label", help="Stored in the results, e.g. the commit being measured")
+        parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+        parser.add_argument("--compare", help="Results of an earlier run, fail on regressions against it")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Allowed relative p99 slowdown when comparing",
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.collection_ids = list(Collection.objects.values_list("id", flat=True)[:1000])
+        self.product_ids = list(Product.objects.values_list("id", flat=True)[:10000])
+        if not self.product_ids or not self.collection_ids:
+            raise CommandError("There are no products to benchmark, run seed_store first")
+
+        # Users who like something, for lookups.liked
+        self.liker_ids = list(LikedItem.objects.values_list("user_id", flat=True).distinct()[:1000])
+
+        scenarios = {**self.get_scenarios(), **self.get_lookups()}
+        if not self.liker_ids:
+            del scenarios["lookups.liked"]
+        names = options["scenarios"] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        # Not INTERNAL_IPS, so the debug toolbar stays out of the measurements
+        self.client = APIClient(REMOTE_ADDR="192.0.2.1")
+        self.user_client = APIClient(REMOTE_ADDR="192.0.2.1")
+        # The scenarios that write do it as a user and in a cart of their own,
+        # deleted afterwards so runs don't change the data they're compared on.
+        # Not a rolled back transaction: on_commit callbacks and replica
+        # reads are part of what's measured
+        self.user = self.create_user()
+        # Skips JWT decoding, which isn't what's being measured here
+        self.user_client.force_authenticate(self.user)
+        self.cart = Cart.objects.create()
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, product_id=product_id, quantity=1)
+            for product_id in self.random.sample(self.product_ids, min(5, len(self.product_ids)))
+        )
+
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                for name in names:
+                    self.stderr.write(f"{name}...")
+                    results[name] = self.run_scenario(scenarios[name], options)
+        finally:
+            self.cart.delete()
+            # With its likes and customer. Deleted likes take their counts back
+            self.user.delete()
+            like_counters.flush(blocking=True)
+
+        report = {
+            "label": options["label"],
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "rows": {
+                model._meta.label: model._default_manager.count()
+                for model in (Collection, Product, Customer, OrderItem, Cart, TaggedItem, LikedItem)
+            },
+            "iterations": options["iterations"],
+            "warm_cache": options["warm_cache"],
+            "scenarios": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(output)
+        else:
+            self.stdout.write(output)
+
+        if options["compare"]:
+            baseline = json.loads(Path(options["compare"]).read_text())
+            regressions = self.compare(baseline["scenarios"], results, options["threshold"])
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+
+    def create_user(self):
+        name = f"benchmark-{uuid4().hex[:12]}"
+        return get_user_model().objects.create(username=name, email=f"{name}@example.com", password="!")
+
+    # Each scenario returns (client, method, path, data) for one request,
+    # randomized so the database can't answer every request from one cached page
+
+    def get_scenarios(self):
+        return {
+            "products.list": lambda: (self.client, "get", "/store/products/", None),
+            "products.search": lambda: (
+                self.client, "get", "/store/products/", {"search": self.random.choice(WORDS)}
+            ),
+            "products.tags": lambda: (self.client, "get", "/store/products/", {"include": "tags"}),
+            "products.retrieve_tags": lambda: (
+                self.client, "get", f"/store/products/{self.random.choice(self.product_ids)}/", {"include": "tags"}
+            ),
+            "products.filter": lambda: (
+                self.client, "get", "/store/products/", {
+                    "collection_id": self.random.choice(self.collection_ids),
+                    "unit_price__gt": self.random.randint(0, 500),
+                }
+            ),
+            "collections.list": lambda: (self.client, "get", "/store/collections/", None),
+            "carts.retrieve": lambda: (self.client, "get", f"/store/carts/{self.cart.id}/", None),
+            "carts.add": lambda: (
+                self.client, "post", f"/store/carts/{self.cart.id}/items/", {
+                    "product_id": self.random.choice(self.product_ids),
+                    "quantity": 1,
+                }
+            ),
+            "customers.me": lambda: (self.user_client, "get", "/store/customers/me/", None),
+            "products.like": lambda: (
+                self.user_client,
+                self.random.choice(["post", "delete"]),
+                f"/store/products/{self.random.choice(self.product_ids[:100])}/like/",
+                None,
+            ),
+        }
+
+    # Lookups return the queryset of one lookup instead, they measure the
+    # indexes of the generic relations directly and report its query plan
+
+    def get_lookups(self):
+        product_type = ContentType.objects.get_for_model(Product)
+        return {
+            # ?include=tags of a page and of one product
+            "lookups.tags_page": lambda: TaggedItem.objects._tagged_items(
+                product_type, self.random.sample(self.product_ids, min(10, len(self.product_ids)))
+            ),
+            "lookups.tags_one": lambda: TaggedItem.objects.get_tags_for(Product, self.random.choice(self.product_ids)),
+            # ?include=liked, on the (user, content_type, object_id) unique index
+            "lookups.liked": lambda: LikedItem.objects._liked(
+                self.random.choice(self.liker_ids),
+                product_type,
+                self.random.sample(self.product_ids, min(10, len(self.product_ids))),
+            ),
+            # What reconcile_like_counts counts, one object at a time
+            "lookups.like_count": lambda: (
+                LikedItem.objects.filter(content_type=product_type, object_id=self.random.choice(self.product_ids))
+                .values("object_id")
+                .annotate(count=Count("pk"))
+            ),
+        }
+
+    def request(self, scenario, options):
+        # Returns the status to report
+        request = scenario()
+        if isinstance(request, QuerySet):
+            list(request)
+            return "ok"
+        client, method, path, data = request
+        if not options["warm_cache"]:
+            cache.clear()
+        return getattr(client, method)(path, data, format="json" if method == "post" else None).status_code
+
+    def run_scenario(self, scenario, options):
+        for _ in range(options["warmup"]):
+            self.request(scenario, options)
+
+        durations = []
+        queries = []
+        statuses = Counter()
+        for _ in range(options["iterations"]):
+            recorder = QueryRecorder()
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(recorder))
+                start = time.perf_counter()
+                status = self.request(scenario, options)
+                durations.append(time.perf_counter() - start)
+            queries.append(recorder.count)
+            statuses[status] += 1
+
+        allocated = []
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(options["allocation_iterations"]):
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                self.request(scenario, options)
+                after, peak = tracemalloc.get_traced_memory()
+                allocated.append(after - before)
+                peaks.append(peak - before)
+        finally:
+            tracemalloc.stop()
+
+        result = {
+            "p50_ms": round(percentile(durations, 50) * 1000, 3),
+            "p99_ms": round(percentile(durations, 99) * 1000, 3),
+            "mean_ms": round(statistics.fmean(durations) * 1000, 3),
+            "max_ms": round(max(durations) * 1000, 3),
+            "queries_per_request": round(statistics.fmean(queries), 2),
+            "max_queries": max(queries),
+            "peak_kb_per_request": round(statistics.fmean(peaks) / 1024, 1) if peaks else None,
+            "retained_kb_per_request": round(statistics.fmean(allocated) / 1024, 1) if allocated else None,
+            "statuses": {str(status): count for (status, count) in sorted(statuses.items())},
+        }
+        request = scenario()
+        if isinstance(request, QuerySet):
+            # Which index the database picks, with the data it has now
+            result["plan"] = request.explain()
+            self.stderr.write(result["plan"])
+        return result
+
+    @staticmethod
+    def compare(baseline, results, threshold):
+        regressions = []
+        for (name, result) in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result["p99_ms"] > before["p99_ms"] * (1 + threshold):
+                regressions.append(f"{name}: p99 {before['p99_ms']}ms -> {result['p99_ms']}ms")
+            if result["max_queries"] > before["max_queries"]:
+                regressions.append(f"{name}: queries {before['max_queries']} -> {result['max_queries']}")
+        return regressions
+
+
+def percentile(values, percent):
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.exports import FORMATS, order_rows
+from store.filters import OrderFilter
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = "Stream orders with their items, customer and line revenue as CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(FORMATS), default="csv")
+        parser.add_argument("--output", help="File to write to, stdout by default")
+        parser.add_argument("--since", help="Orders placed at or after this date/time")
+        parser.add_argument("--until", help="Orders placed before this date/time")
+        parser.add_argument("--payment-status", choices=[choice for (choice, _) in Order.PAYMENT_STATUS_CHOICES])
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        filterset = OrderFilter({
+            "placed_at__gte": options["since"],
+            "placed_at__lt": options["until"],
+            "payment_status": options["payment_status"],
+        }, queryset=Order.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+
+        (lines, _) = FORMATS[options["format"]]
+        output = open(options["output"], "w", newline="") if options["output"] else sys.stdout
+        try:
+            for line in lines(order_rows(filterset.qs, options["chunk_size"])):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
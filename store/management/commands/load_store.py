@@ -0,0 +1,137 @@
+import csv
+import json
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import QuerySet
+
+from store.bulk import Progress, bulk_load, chunked, load_data_infile
+from store.models import Collection, Customer, Order, OrderItem, Product
+
+
+def get_models():
+    # In dependency order. Collection.featured_product is set once the
+    # products are in, LOAD DATA (MySQL) runs with foreign key checks off
+    return {
+        "users": get_user_model(),
+        "collections": Collection,
+        "products": Product,
+        "customers": Customer,
+        "orders": Order,
+        "order_items": OrderItem,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Import store data from CSV or JSONL files, e.g. "
+        "load_store collections=collections.csv products=products.jsonl. "
+        "Columns are field names (collection_id for foreign keys)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", metavar="name=path", help=f"name is one of {', '.join(get_models())}")
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--no-load-data",
+            action="store_true",
+            help="Use bulk_create for CSV files on MySQL instead of LOAD DATA LOCAL INFILE",
+        )
+
+    def handle(self, *args, **options):
+        models = get_models()
+        files = []
+        for argument in options["files"]:
+            name, _, path = argument.partition("=")
+            if name not in models or not path:
+                raise CommandError(f"Expected name=path with name one of {', '.join(models)}, got '{argument}'")
+            path = Path(path)
+            if not path.exists():
+                raise CommandError(f"{path} does not exist")
+            files.append((models[name], path))
+
+        using = options["database"]
+        connection = connections[using]
+        featured_products = {} # collection id -> product id
+        for (model, path) in sorted(files, key=lambda file: list(models.values()).index(file[0])):
+            progress = Progress(self.stdout, f"{model._meta.label} from {path.name}")
+            if path.suffix == ".csv" and connection.vendor == "mysql" and not options["no_load_data"]:
+                with path.open(newline="") as file:
+                    columns = [self.get_field(model, name).column for name in next(csv.reader(file))]
+                load_data_infile(model, path, columns, using, progress)
+            else:
+                rows = self.read(model, path)
+                if model is Collection:
+                    rows = self.defer_featured_products(rows, featured_products)
+                objs = (model(**row) for row in rows)
+                bulk_load(model, objs, options["batch_size"], using, progress)
+
+            # Explicit ids don't move PostgreSQL's sequences
+            statements = connection.ops.sequence_reset_sql(no_style(), [model])
+            if statements:
+                with connection.cursor() as cursor:
+                    for sql in statements:
+                        cursor.execute(sql)
+
+        if featured_products:
+            self.set_featured_products(featured_products, options["batch_size"], using)
+        if any(model in (Collection, Product) for (model, _) in files):
+            Collection.objects.using(using).refresh_products_count()
+
+    def defer_featured_products(self, rows, featured_products):
+        for row in rows:
+            product_id = row.pop("featured_product_id", None)
+            if product_id is not None:
+                if row.get("id") is None:
+                    raise CommandError("Collections with a featured_product_id need an id column")
+                featured_products[row["id"]] = product_id
+            yield row
+
+    def set_featured_products(self, featured_products, batch_size, using):
+        collections = [
+            Collection(pk=pk, featured_product_id=product_id)
+            for (pk, product_id) in featured_products.items()
+        ]
+        queryset = QuerySet(Collection, using=using)
+        for chunk in chunked(collections, batch_size):
+            with transaction.atomic(using=using):
+                queryset.bulk_update(chunk, ["featured_product"], batch_size=batch_size)
+
+    def get_field(self, model, name):
+        try:
+            return model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise CommandError(f"{model._meta.label} has no field '{name}'")
+
+    def read(self, model, path):
+        if path.suffix == ".csv":
+            with path.open(newline="") as file:
+                rows = csv.DictReader(file)
+                fields = [self.get_field(model, name) for name in rows.fieldnames]
+                for row in rows:
+                    yield {field.attname: self.to_python(field, value) for (field, value) in zip(fields, row.values())}
+        elif path.suffix in (".jsonl", ".ndjson"):
+            fields = {}
+            with path.open() as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    row = {}
+                    for (name, value) in json.loads(line).items():
+                        if name not in fields:
+                            fields[name] = self.get_field(model, name)
+                        row[fields[name].attname] = self.to_python(fields[name], value)
+                    yield row
+        else:
+            raise CommandError(f"Unsupported file type '{path.suffix}', use .csv or .jsonl")
+
+    @staticmethod
+    def to_python(field, value):
+        if value in ("", None) and field.null:
+            return None
+        return field.to_python(value)
@@ -0,0 +1,30 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.middleware import get_setting, merge, summarize
+
+
+class Command(BaseCommand):
+    help = "Dump the per-endpoint query statistics flushed by QueryStatsMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Delete the flushed statistics after dumping them",
+        )
+
+    def handle(self, *args, **options):
+        dump_dir = get_setting("DUMP_DIR")
+        if dump_dir is None:
+            raise CommandError("QUERY_STATS['DUMP_DIR'] is not set")
+
+        paths = sorted(Path(dump_dir).glob("querystats-*.json"))
+        snapshots = [json.loads(path.read_text()) for path in paths]
+        self.stdout.write(json.dumps(summarize(merge(snapshots)), indent=2))
+
+        if options["reset"]:
+            for path in paths:
+                path.unlink()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = "Recount Collection.products_count from the product table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report collections whose stored count has drifted",
+        )
+
+    def handle(self, *args, **options):
+        drifted = Collection.objects.annotate(actual=Count("products"))\
+            .exclude(products_count=F("actual"))\
+            .values_list("id", "title", "products_count", "actual")
+
+        drifted = list(drifted)
+        for (id, title, stored, actual) in drifted:
+            self.stdout.write(f"{id} {title}: stored {stored}, actual {actual}")
+
+        if options["dry_run"]:
+            self.stdout.write(f"{len(drifted)} collections have drifted")
+            return
+
+        if drifted:
+            Collection.objects.filter(pk__in=[row[0] for row in drifted])\
+                .refresh_products_count()
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} collections were reconciled"))
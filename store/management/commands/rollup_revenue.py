@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from store.analytics import backfill_revenue, rollup_revenue
+
+
+class Command(BaseCommand):
+    help = "Add new order items to the revenue rollups, run it from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="Rebuild the rollups from every order item",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            count = backfill_revenue(options["batch_size"])
+        else:
+            count = rollup_revenue(options["batch_size"])
+        self.stdout.write(f"Rolled up {count} order items")
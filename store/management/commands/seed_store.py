@@ -0,0 +1,136 @@
+import random
+from decimal import Decimal
+from uuid import UUID
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from likes.models import LikedItem
+from store.bulk import Progress, bulk_load
+from store.models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product
+from tags.models import Tag, TaggedItem
+
+
+WORDS = [
+    "coffee", "tea", "mug", "beans", "organic", "dark", "roast", "green", "premium", "classic",
+    "ceramic", "glass", "steel", "travel", "espresso", "filter", "grinder", "kettle", "press", "blend",
+]
+
+
+class Command(BaseCommand):
+    help = "Fill the store with generated data for benchmarks and perf environments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collections", type=int, default=100)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--customers", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=5000)
+        parser.add_argument("--order-items", type=int, default=20000)
+        parser.add_argument("--carts", type=int, default=1000)
+        parser.add_argument("--items-per-cart", type=int, default=5)
+        parser.add_argument("--tags", type=int, default=50)
+        parser.add_argument("--tags-per-product", type=int, default=3, help="At most, products get 0 to this many")
+        parser.add_argument("--likes", type=int, default=20000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=42, help="Random seed, the same seed generates the same data")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+
+        collection_ids = self.create(Collection, options["collections"], self.make_collection)
+        product_ids = self.create(Product, options["products"], lambda i: self.make_product(i, collection_ids))
+        # Maintained incrementally on normal writes, recounted once here
+        Collection.objects.refresh_products_count()
+
+        user_ids = self.create(get_user_model(), options["customers"], self.make_user)
+        customer_ids = self.create(Customer, options["customers"], lambda i: Customer(
+            user_id=user_ids[i], phone_number=f"555-{i:07}"
+        ))
+        order_ids = self.create(Order, options["orders"], lambda i: Order(
+            customer_id=self.random.choice(customer_ids)
+        ))
+        self.load(OrderItem, options["order_items"], (
+            OrderItem(
+                order_id=self.random.choice(order_ids),
+                product_id=self.random.choice(product_ids),
+                quantity=self.random.randint(1, 10),
+                unit_price=self.price(),
+            )
+            for _ in range(options["order_items"] if order_ids and product_ids else 0)
+        ))
+
+        # Carts have UUID keys, generated here instead of read back
+        cart_ids = [UUID(int=self.random.getrandbits(128)) for _ in range(options["carts"])]
+        self.load(Cart, len(cart_ids), (Cart(id=cart_id) for cart_id in cart_ids))
+        items_per_cart = min(options["items_per_cart"], len(product_ids))
+        self.load(CartItem, len(cart_ids) * items_per_cart, (
+            CartItem(cart_id=cart_id, product_id=product_id, quantity=self.random.randint(1, 5))
+            for cart_id in cart_ids
+            for product_id in self.random.sample(product_ids, items_per_cart)
+        ))
+
+        # Generic relations to products, what their indexes are measured with
+        product_type = ContentType.objects.get_for_model(Product)
+        tag_ids = self.create(Tag, options["tags"], lambda i: Tag(label=f"{self.random.choice(WORDS)}-{i}"))
+        self.load(TaggedItem, None, (
+            TaggedItem(tag_id=tag_id, content_type=product_type, object_id=product_id)
+            for product_id in (product_ids if tag_ids else [])
+            for tag_id in self.random.sample(
+                tag_ids, self.random.randint(0, min(options["tags_per_product"], len(tag_ids)))
+            )
+        ))
+        # Unique per user and product: each user likes distinct products
+        likes = options["likes"] if user_ids and product_ids else 0
+        self.load(LikedItem, likes, (
+            LikedItem(user_id=user_id, content_type=product_type, object_id=product_id)
+            for (i, user_id) in enumerate(user_ids)
+            for product_id in self.random.sample(
+                product_ids, min(likes // len(user_ids) + (i < likes % len(user_ids)), len(product_ids))
+            )
+        ))
+
+    def create(self, model, count, make):
+        # Rows that others point to: returns the range of their ids. MySQL
+        # doesn't return the ids of bulk inserted rows and reading them all
+        # back doesn't scale, in a database nothing else writes to at the
+        # same time a bulk load's ids are contiguous
+        before = self.max_pk(model)
+        self.load(model, count, (make(i) for i in range(count)))
+        return range(before + 1, self.max_pk(model) + 1)
+
+    def load(self, model, count, objs):
+        progress = Progress(self.stdout, model._meta.label, total=count)
+        bulk_load(model, objs, self.batch_size, progress=progress)
+
+    @staticmethod
+    def max_pk(model):
+        return model._default_manager.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+
+    def make_collection(self, i):
+        return Collection(title=f"{self.random.choice(WORDS).title()} collection {i}")
+
+    def make_product(self, i, collection_ids):
+        title = " ".join(self.random.sample(WORDS, 3)).capitalize()
+        return Product(
+            title=f"{title} {i}",
+            slug=f"{title.lower().replace(' ', '-')}-{i}",
+            description=" ".join(self.random.choices(WORDS, k=20)),
+            unit_price=self.price(),
+            inventory=self.random.randint(0, 500),
+            collection_id=self.random.choice(collection_ids),
+        )
+
+    def make_user(self, i):
+        return get_user_model()(
+            username=f"customer{i}-{self.random.getrandbits(32):08x}",
+            email=f"customer{i}-{self.random.getrandbits(32):08x}@example.com",
+            first_name=self.random.choice(WORDS).title(),
+            last_name=self.random.choice(WORDS).title(),
+            password="!", # unusable, hashing a million passwords takes hours
+        )
+
+    def price(self):
+        return Decimal(self.random.randint(100, 99999)) / 100
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Only requests under these paths are recorded
+    "PATH_PREFIXES": ["/store/"],
+    # "ViewSet.action" -> maximum number of queries per request
+    "BUDGETS": {},
+    # Raise QueryBudgetExceeded instead of logging, meant for tests
+    "RAISE_ON_BUDGET": False,
+    # A statement repeated this often in one request is reported as N+1
+    "DUPLICATE_THRESHOLD": 2,
+    # Seconds between writes of this process' stats to DUMP_DIR
+    "FLUSH_INTERVAL": 30,
+    "DUMP_DIR": None,
+}
+
+
+def get_setting(name):
+    return getattr(settings, "QUERY_STATS", {}).get(name, DEFAULTS[name])
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# IN (%s, %s, ...) differs in length per call but is the same statement
+PLACEHOLDER_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+
+
+def fingerprint(sql):
+    return PLACEHOLDER_LIST.sub("(...)", sql)[:500]
+
+
+class QueryRecorder:
+    # Installed with connection.execute_wrapper(), works without DEBUG
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.serialization_duration = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+class QueryStats:
+    # Sums per endpoint, averages are computed by summarize()
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.flushed_at = time.monotonic()
+
+    def record(self, endpoint, recorder:QueryRecorder, budget):
+        threshold = get_setting("DUPLICATE_THRESHOLD")
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                "requests": 0,
+                "queries": 0,
+                "max_queries": 0,
+                "db_seconds": 0.0,
+                "serialization_seconds": 0.0,
+                "over_budget": 0,
+                "duplicates": {},
+            })
+            stats["requests"] += 1
+            stats["queries"] += recorder.count
+            stats["max_queries"] = max(stats["max_queries"], recorder.count)
+            stats["db_seconds"] += recorder.duration
+            stats["serialization_seconds"] += recorder.serialization_duration
+            if budget is not None and recorder.count > budget:
+                stats["over_budget"] += 1
+            for (sql, count) in recorder.fingerprints.items():
+                if count >= threshold:
+                    stats["duplicates"][sql] = stats["duplicates"].get(sql, 0) + 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.endpoints))
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def maybe_flush(self):
+        dump_dir = get_setting("DUMP_DIR")
+        if dump_dir is None or time.monotonic() - self.flushed_at < get_setting("FLUSH_INTERVAL"):
+            return
+        self.flushed_at = time.monotonic()
+        self.flush(Path(dump_dir))
+
+    def flush(self, dump_dir:Path):
+        # One file per process, replaced atomically
+        dump_dir.mkdir(parents=True, exist_ok=True)
+        path = dump_dir / f"querystats-{os.getpid()}.json"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, path)
+
+
+stats = QueryStats()
+
+
+# The recorder of the current request. A ContextVar rather than an attribute
+# of the request: serializers don't always get one in their context, and
+# sync_to_async() copies the context into the async views' threads
+current_recorder = ContextVar("query_stats_recorder", default=None)
+
+
+@contextmanager
+def timed_serialization():
+    # Adds the time spent in the block to the request's serialization time,
+    # nested blocks (a nested serializer, a flat list's computed fields) count once
+    recorder = current_recorder.get()
+    if recorder is None or recorder.serializing:
+        yield
+        return
+    recorder.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.serialization_duration += time.perf_counter() - start
+        recorder.serializing = False
+
+
+def merge(snapshots):
+    # Combine the per-process files written by flush()
+    merged = {}
+    for snapshot in snapshots:
+        for (endpoint, endpoint_stats) in snapshot.items():
+            total = merged.get(endpoint)
+            if total is None:
+                merged[endpoint] = {**endpoint_stats, "duplicates": dict(endpoint_stats["duplicates"])}
+                continue
+            for key in ("requests", "queries", "db_seconds", "serialization_seconds", "over_budget"):
+                total[key] += endpoint_stats[key]
+            total["max_queries"] = max(total["max_queries"], endpoint_stats["max_queries"])
+            for (sql, count) in endpoint_stats["duplicates"].items():
+                total["duplicates"][sql] = total["duplicates"].get(sql, 0) + count
+    return merged
+
+
+def summarize(snapshot):
+    budgets = get_setting("BUDGETS")
+    summary = {}
+    for (endpoint, endpoint_stats) in sorted(snapshot.items()):
+        requests = endpoint_stats["requests"]
+        summary[endpoint] = {
+            "requests": requests,
+            "queries_per_request": round(endpoint_stats["queries"] / requests, 2),
+            "max_queries": endpoint_stats["max_queries"],
+            "db_ms_per_request": round(endpoint_stats["db_seconds"] * 1000 / requests, 3),
+            "serialization_ms_per_request": round(endpoint_stats["serialization_seconds"] * 1000 / requests, 3),
+            "budget": budgets.get(endpoint),
+            "over_budget": endpoint_stats["over_budget"],
+            "duplicate_queries": dict(
+                sorted(endpoint_stats["duplicates"].items(), key=lambda item: -item[1])
+            ),
+        }
+    return summary
+
+
+def get_endpoint(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+    view_class = getattr(match.func, "cls", None)
+    if view_class is None:
+        return match.view_name or match.func.__name__
+    # ViewSets map the HTTP method to an action, e.g. CartViewSet.retrieve
+    actions = getattr(match.func, "actions", None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f"{view_class.__name__}.{action}"
+
+
+class QueryStatsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not request.path.startswith(tuple(get_setting("PATH_PREFIXES"))):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            with self.install(recorder):
+                response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.record(request, recorder, response)
+
+    async def __acall__(self, request):
+        if not request.path.startswith(tuple(get_setting("PATH_PREFIXES"))):
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        # Connections are per thread and the async ORM (like sync views under
+        # ASGI) queries from the request's thread-sensitive thread, so the
+        # wrappers have to be installed there
+        stack = await sync_to_async(self.install)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            current_recorder.reset(token)
+        return self.record(request, recorder, response)
+
+    @staticmethod
+    def install(recorder):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        return stack
+
+    def record(self, request, recorder, response):
+        endpoint = get_endpoint(request)
+        if endpoint is None:
+            return response
+
+        budget = get_setting("BUDGETS").get(endpoint)
+        stats.record(endpoint, recorder, budget)
+        if budget is not None and recorder.count > budget:
+            message = f"{endpoint} ran {recorder.count} queries, its budget is {budget}"
+            if get_setting("RAISE_ON_BUDGET"):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
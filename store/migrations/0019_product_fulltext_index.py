@@ -0,0 +1,63 @@
+from django.db import migrations
+
+
+# Full-text index used by store.filters.FullTextSearchFilter.
+# MySQL gets a FULLTEXT index, SQLite (local tests) an FTS5 table kept in
+# sync by triggers. SQLite drops triggers when Django rebuilds a table,
+# so a later migration that alters store_product there has to recreate them.
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE store_product_fts USING fts5("
+    "title, description, content='store_product', content_rowid='id')",
+    "CREATE TRIGGER store_product_fts_insert AFTER INSERT ON store_product BEGIN "
+    "INSERT INTO store_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+    "END",
+    "CREATE TRIGGER store_product_fts_delete AFTER DELETE ON store_product BEGIN "
+    "INSERT INTO store_product_fts(store_product_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "END",
+    "CREATE TRIGGER store_product_fts_update AFTER UPDATE OF title, description ON store_product BEGIN "
+    "INSERT INTO store_product_fts(store_product_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO store_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+    "END",
+    "INSERT INTO store_product_fts(store_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS store_product_fts_update",
+    "DROP TRIGGER IF EXISTS store_product_fts_delete",
+    "DROP TRIGGER IF EXISTS store_product_fts_insert",
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            "ALTER TABLE store_product ADD FULLTEXT INDEX store_product_fulltext (title, description)"
+        )
+    elif vendor == 'sqlite':
+        for sql in SQLITE_FORWARDS:
+            schema_editor.execute(sql)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute("ALTER TABLE store_product DROP INDEX store_product_fulltext")
+    elif vendor == 'sqlite':
+        for sql in SQLITE_BACKWARDS:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:19
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_revenue_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='tax_rate',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=5, null=True, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
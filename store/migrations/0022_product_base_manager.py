@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:44
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_collection_tax_rate'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'base_manager_name': 'objects', 'ordering': ['title']},
+        ),
+    ]
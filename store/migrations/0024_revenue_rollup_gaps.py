@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revenuerollupstate',
+            name='gaps',
+            field=models.JSONField(default=list),
+        ),
+    ]
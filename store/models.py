@@ -1,11 +1,17 @@
+from collections import Counter
+from decimal import Decimal
 from uuid import uuid4
 
 from django.conf import settings
 from django.contrib import admin
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models.expressions import Combinable
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.core.validators import MinValueValidator, EmailValidator
 
 from store import permissions
+from store.cache import invalidate_on_commit
 
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
@@ -17,22 +23,176 @@ class Promotion(models.Model):
     # the product class it will be product_set 
 
 
+class CollectionQuerySet(models.QuerySet):
+    def adjust_products_count(self, deltas):
+        # deltas maps collection id -> change, applied with a single UPDATE
+        deltas = {pk: delta for pk, delta in deltas.items() if pk is not None and delta}
+        if not deltas:
+            return 0
+        return self.filter(pk__in=deltas).update(
+            products_count=models.F('products_count') + models.Case(
+                *[models.When(pk=pk, then=models.Value(delta)) for pk, delta in deltas.items()],
+                default=models.Value(0),
+            )
+        )
+        
+    def refresh_products_count(self):
+        # Recount from the product table, used to repair drift
+        counts = Product.objects.filter(collection=models.OuterRef('pk'))\
+            .order_by()\
+            .values('collection')\
+            .annotate(count=models.Count('pk'))\
+            .values('count')
+        return self.update(products_count=Coalesce(models.Subquery(counts), 0))
+
+
 class Collection(models.Model):
+    objects = CollectionQuerySet.as_manager()
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product',on_delete=models.SET_NULL, 
         null=True,
         related_name='collections'
     )
+    # Denormalized Count('products'), kept in sync by Product and ProductQuerySet
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+    # e.g. 0.15 for 15%, settings.STORE_TAX_RATE when not set
+    tax_rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=4,
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0)]
+    )
 
     def __str__(self) -> str:
         return self.title
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'tax_rate' in instance.__dict__:
+            instance._loaded_tax_rate = instance.tax_rate
+        return instance
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if hasattr(self, '_loaded_tax_rate') and self._loaded_tax_rate != self.tax_rate:
+            # Prices with tax changed: moves the products' ETags and cache keys
+            Product.objects.using(kwargs.get('using') or self._state.db)\
+                .filter(collection=self).update(last_update=timezone.now())
+        self._loaded_tax_rate = self.tax_rate
+    
     class Meta:
         ordering = ['title']
 
 
+def moved_products(previous, current):
+    # Counter of collection id -> change for products moving between collections
+    deltas = Counter()
+    for collection_id, count in previous.items():
+        deltas[collection_id] -= count
+    for collection_id, count in current.items():
+        deltas[collection_id] += count
+    return deltas
+
+
+# Every write path that can change how many products a collection holds
+# goes through here, since bulk_create/update/delete skip model signals
+def invalidate_lists():
+    # Bulk writes send no signals. Details are validated against last_update,
+    # which they stamp, cached lists have to be dropped
+    invalidate_on_commit(('products', None), ('collections', None))
+
+
+class ProductQuerySet(models.QuerySet):
+    def collection_counts(self):
+        return Counter(dict(
+            self.order_by()
+            .values_list('collection_id')
+            .annotate(count=models.Count('pk'))
+        ))
+        
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False,
+                    update_conflicts=False, update_fields=None, unique_fields=None):
+        objs = list(objs)
+        collections = Collection.objects.db_manager(self.db)
+        with transaction.atomic(using=self.db):
+            if ignore_conflicts or update_conflicts:
+                # We can't tell which rows were inserted, so recount what was touched
+                pks = [obj.pk for obj in objs if obj.pk is not None]
+                touched = set(self.filter(pk__in=pks).values_list('collection_id', flat=True))
+            objs = super().bulk_create(
+                objs,
+                batch_size=batch_size,
+                ignore_conflicts=ignore_conflicts,
+                update_conflicts=update_conflicts,
+                update_fields=update_fields,
+                unique_fields=unique_fields,
+            )
+            if ignore_conflicts or update_conflicts:
+                touched.update(obj.collection_id for obj in objs)
+                collections.filter(pk__in=touched).refresh_products_count()
+            else:
+                collections.adjust_products_count(Counter(obj.collection_id for obj in objs))
+            invalidate_lists()
+        return objs
+    
+    # auto_now isn't applied by bulk_update() and update(), but last_update
+    # drives the API's Last-Modified/ETag, so stamp it here
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        if 'last_update' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.last_update = now
+            fields = [*fields, 'last_update']
+        if 'collection' not in fields and 'collection_id' not in fields:
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        with transaction.atomic(using=self.db):
+            previous = self.filter(pk__in=[obj.pk for obj in objs]).collection_counts()
+            # super().bulk_update() goes through self.update(), which would
+            # recount every collection for its CASE expression
+            updated = models.QuerySet(self.model, using=self.db)\
+                .bulk_update(objs, fields, batch_size=batch_size)
+            current = Counter(obj.collection_id for obj in objs)
+            Collection.objects.db_manager(self.db)\
+                .adjust_products_count(moved_products(previous, current))
+            invalidate_lists()
+        return updated
+    
+    def update(self, **kwargs):
+        kwargs.setdefault('last_update', timezone.now())
+        if 'collection' not in kwargs and 'collection_id' not in kwargs:
+            updated = super().update(**kwargs)
+            invalidate_lists()
+            return updated
+        collection = kwargs.get('collection', kwargs.get('collection_id'))
+        collections = Collection.objects.db_manager(self.db)
+        with transaction.atomic(using=self.db):
+            previous = self.collection_counts()
+            updated = super().update(**kwargs)
+            if isinstance(collection, Combinable):
+                # The new collection is computed in SQL, recount everything
+                collections.refresh_products_count()
+            else:
+                collection_id = collection.pk if isinstance(collection, Collection) else collection
+                current = {collection_id: sum(previous.values())}
+                collections.adjust_products_count(moved_products(previous, current))
+            invalidate_lists()
+        return updated
+    
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            previous = self.collection_counts()
+            deleted = super().delete()
+            Collection.objects.db_manager(self.db)\
+                .adjust_products_count(moved_products(previous, {}))
+        return deleted
+
+
 class Product(models.Model):
+    objects = ProductQuerySet.as_manager()
     title = models.CharField(max_length=255)
     slug = models.SlugField()
     description = models.TextField(null=True,blank=True)
@@ -51,8 +211,86 @@ class Product(models.Model):
     def __str__(self) -> str:
         return self.title
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored collection so save() knows when a product moves
+        if 'collection_id' in instance.__dict__:
+            instance._loaded_collection_id = instance.collection_id
+        return instance
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'collection' not in update_fields \
+            and 'collection_id' not in update_fields:
+            return super().save(*args, **kwargs)
+        
+        using = kwargs.get('using') or router.db_for_write(Product, instance=self)
+        with transaction.atomic(using=using):
+            if hasattr(self, '_loaded_collection_id'):
+                previous = self._loaded_collection_id
+            elif self.pk is not None:
+                previous = Product.objects.using(using).filter(pk=self.pk)\
+                    .values_list('collection_id', flat=True).first()
+            else:
+                previous = None
+            super().save(*args, **kwargs)
+            Collection.objects.db_manager(using).adjust_products_count(
+                moved_products({previous: 1} if previous else {}, {self.collection_id: 1})
+            )
+        self._loaded_collection_id = self.collection_id
+        
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(Product, instance=self)
+        with transaction.atomic(using=using):
+            deleted = super().delete(*args, **kwargs)
+            Collection.objects.db_manager(using).adjust_products_count({self.collection_id: -1})
+        return deleted
+    
     class Meta:
         ordering = ['title']
+        # Related managers (collection.products.add()) write through the
+        # base manager, it has to keep products_count in sync too
+        base_manager_name = 'objects'
+        # Seek indexes for KeysetPagination, one per orderable column
+        indexes = [
+            models.Index(fields=['title','id']),
+            models.Index(fields=['unit_price','id']),
+            models.Index(fields=['last_update','id']),
+        ]
+
+
+# The SQLite FTS5 table of store/migrations/0019, joined by
+# store.filters.FullTextSearchFilter. Only exists on SQLite.
+
+class SearchDocumentField(models.TextField):
+    pass
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class ProductSearchIndex(models.Model):
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        related_name='search_index',
+    )
+    # FTS5's hidden column named after the table, what MATCH and bm25() take
+    document = SearchDocumentField(db_column='store_product_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'store_product_fts'
         
         
 class Customer(models.Model):
@@ -133,12 +371,129 @@ class OrderItem(models.Model):
         return self.product.title
 
 
+# quantity (up to 5 digits) * unit_price (6 digits)
+LINE_TOTAL = models.ExpressionWrapper(
+    models.F('quantity') * models.F('product__unit_price'),
+    output_field=models.DecimalField(max_digits=11, decimal_places=2)
+)
+
+
+class CartQuerySet(models.QuerySet):
+    def with_total_price(self):
+        totals = CartItem.objects.filter(cart=models.OuterRef('pk'))\
+            .order_by()\
+            .values('cart')\
+            .annotate(total=models.Sum(LINE_TOTAL))\
+            .values('total')
+        return self.annotate(total_price=Coalesce(
+            models.Subquery(totals),
+            models.Value(Decimal(0)),
+            output_field=models.DecimalField(max_digits=15, decimal_places=2)
+        ))
+
+
 class Cart(models.Model):
+    objects = CartQuerySet.as_manager()
     id = models.UUIDField(primary_key=True,default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
     
 
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=LINE_TOTAL)
+    
+    def add_product(self, cart_id, product_id, quantity):
+        # Insert the line or increment its quantity in a single statement.
+        # The row is selected from the product table, so nothing is written
+        # and None is returned when the product doesn't exist.
+        using = self._db or router.db_for_write(self.model)
+        connection = connections[using]
+        if connection.vendor == 'mysql':
+            return self._add_product_on_duplicate_key(connection, cart_id, product_id, quantity)
+        if connection.features.supports_update_conflicts_with_target \
+            and connection.features.can_return_columns_from_insert:
+            return self._add_product_on_conflict(connection, cart_id, product_id, quantity)
+        return self._add_product_fallback(using, cart_id, product_id, quantity)
+    
+    def _upsert_sql(self, connection, cart_id, product_id, quantity):
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        cart_field = opts.get_field('cart')
+        insert = "INSERT INTO {table} ({cart}, {product}, {quantity}) "\
+            "SELECT %s, {product_pk}, %s FROM {product_table} WHERE {product_pk} = %s".format(
+                table=qn(opts.db_table),
+                cart=qn(cart_field.column),
+                product=qn(opts.get_field('product').column),
+                quantity=qn(opts.get_field('quantity').column),
+                product_pk=qn(Product._meta.pk.column),
+                product_table=qn(Product._meta.db_table),
+            )
+        params = [cart_field.get_db_prep_value(cart_id, connection), quantity, product_id]
+        return insert, params
+    
+    def _add_product_on_duplicate_key(self, connection, cart_id, product_id, quantity):
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        table = qn(opts.db_table)
+        pk = f"{table}.{qn(opts.pk.column)}"
+        quantity_column = f"{table}.{qn(opts.get_field('quantity').column)}"
+        insert, params = self._upsert_sql(connection, cart_id, product_id, quantity)
+        # LAST_INSERT_ID(id) makes lastrowid the existing row's id on update
+        sql = f"{insert} ON DUPLICATE KEY UPDATE {pk} = LAST_INSERT_ID({pk}), "\
+            f"{quantity_column} = {quantity_column} + %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, quantity])
+            if cursor.rowcount == 0:
+                return None
+            inserted = cursor.rowcount == 1
+            pk_value = cursor.lastrowid
+        if not inserted:
+            quantity = self.using(connection.alias).filter(pk=pk_value)\
+                .values_list('quantity', flat=True).get()
+        return self._from_upsert(connection.alias, pk_value, cart_id, product_id, quantity)
+    
+    def _add_product_on_conflict(self, connection, cart_id, product_id, quantity):
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        table = qn(opts.db_table)
+        quantity_column = qn(opts.get_field('quantity').column)
+        insert, params = self._upsert_sql(connection, cart_id, product_id, quantity)
+        sql = f"{insert} ON CONFLICT ({qn(opts.get_field('cart').column)}, {qn(opts.get_field('product').column)}) "\
+            f"DO UPDATE SET {quantity_column} = {table}.{quantity_column} + excluded.{quantity_column} "\
+            f"RETURNING {qn(opts.pk.column)}, {quantity_column}"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._from_upsert(connection.alias, row[0], cart_id, product_id, row[1])
+    
+    def _add_product_fallback(self, using, cart_id, product_id, quantity):
+        queryset = self.using(using).filter(cart_id=cart_id, product_id=product_id)
+        with transaction.atomic(using=using):
+            if not Product.objects.using(using).filter(pk=product_id).exists():
+                return None
+            if not queryset.update(quantity=models.F('quantity') + quantity):
+                try:
+                    with transaction.atomic(using=using):
+                        return self.using(using).create(
+                            cart_id=cart_id, product_id=product_id, quantity=quantity
+                        )
+                except IntegrityError:
+                    # A concurrent request inserted the line first
+                    queryset.update(quantity=models.F('quantity') + quantity)
+            return queryset.get()
+    
+    def _from_upsert(self, using, pk, cart_id, product_id, quantity):
+        return self.model.from_db(
+            using,
+            ['id','cart_id','product_id','quantity'],
+            [pk, cart_id, product_id, quantity]
+        )
+
+
 class CartItem(models.Model):
+    objects = CartItemQuerySet.as_manager()
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE,related_name="items")
     product = models.ForeignKey(Product,on_delete=models.CASCADE)    
     quantity = models.PositiveSmallIntegerField(
@@ -153,4 +508,48 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
-    
\ No newline at end of file
+    
+
+# Revenue rollups, filled from OrderItem by store.analytics.rollup_revenue()
+# so dashboards read a few rows per day instead of scanning order items.
+# Rows are attributed to the order's date and the product's collection at
+# the time they're rolled up.
+
+class DailyRevenue(models.Model):
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+
+class CollectionDailyRevenue(models.Model):
+    date = models.DateField()
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+    items = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['date','collection']]
+
+
+class ProductDailyRevenue(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    items = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['date','product']]
+
+
+class RevenueRollupState(models.Model):
+    # A single row, order items up to this id are in the rollups
+    last_order_item_id = models.PositiveBigIntegerField(default=0)
+    # [first_id, last_id, seen_at] ranges of ids below last_order_item_id
+    # that weren't there when it moved past them: items of transactions
+    # still open then, re-scanned until store.analytics.GAP_TIMEOUT
+    gaps = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,203 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+# Builds the only()/select_related()/prefetch_related() a serializer needs
+# from its declared fields, so a page costs a fixed number of queries and
+# loads only the columns that are rendered:
+#
+# - plain fields load their column
+# - related fields that render the pk read the FK column, without a join
+# - nested serializers are joined (to-one) or prefetched (to-many), recursively
+# - computed fields read the sources listed in Meta.computed_field_sources,
+#   e.g. {"price_with_tax": ["unit_price", "collection.tax_rate"]}
+# - otherwise a SerializerMethodField reads the annotation of the same name
+#
+# Anything it can't see through (properties, source="*", generic relations)
+# loads the whole row of that model, never less than the serializer needs.
+
+ALL = None
+
+
+class Plan:
+    def __init__(self, model, annotations):
+        self.annotations = annotations
+        self.columns = {"": (model, set())} # prefix -> (model, fields or ALL)
+        self.select_related = set()
+        self.prefetch = {} # path -> (model field, serializer field)
+
+    def load(self, prefix, name):
+        model, fields = self.columns[prefix]
+        if fields is not ALL:
+            fields.add(name)
+
+    def load_all(self, prefix):
+        model, _ = self.columns[prefix]
+        self.columns[prefix] = (model, ALL)
+
+    def join(self, prefix, field):
+        path = prefix + field.name
+        self.select_related.add(path)
+        if field.concrete:
+            self.load(prefix, field.name)
+        self.columns.setdefault(path + LOOKUP_SEP, (field.related_model, set()))
+        return path + LOOKUP_SEP
+
+    def only(self):
+        if all(fields is ALL for (_, fields) in self.columns.values()):
+            return None
+        names = []
+        for (prefix, (model, fields)) in self.columns.items():
+            if fields is ALL:
+                fields = [field.name for field in model._meta.concrete_fields]
+            names.extend(prefix + name for name in fields)
+        return names
+
+
+def optimize_queryset(queryset, serializer, fields=()):
+    # serializer is an instance or class, many=True or not. fields are
+    # loaded as well, e.g. the columns the queryset is ordered by
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    query = queryset.query
+    plan = Plan(queryset.model, set(query.annotations) | set(query.extra_select))
+    add_serializer(plan, serializer, queryset.model, "")
+    for name in fields:
+        add_source(plan, queryset.model, "", name.split(LOOKUP_SEP), None)
+
+    only = plan.only()
+    if only is not None:
+        queryset = queryset.only(*only)
+    if plan.select_related:
+        queryset = queryset.select_related(*sorted(plan.select_related))
+    if plan.prefetch:
+        queryset = add_prefetches(queryset, plan.prefetch)
+    return queryset
+
+
+def add_serializer(plan, serializer, model, prefix):
+    computed_field_sources = getattr(getattr(serializer, "Meta", None), "computed_field_sources", {})
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        sources = computed_field_sources.get(field.field_name)
+        if sources is not None:
+            for source in sources:
+                add_source(plan, model, prefix, source.split("."), None)
+        elif isinstance(field, serializers.SerializerMethodField):
+            if not (prefix == "" and field.field_name in plan.annotations):
+                plan.load_all(prefix)
+        elif field.source == "*":
+            if isinstance(field, serializers.BaseSerializer):
+                add_serializer(plan, field, model, prefix)
+            else:
+                plan.load_all(prefix)
+        else:
+            add_source(plan, model, prefix, field.source_attrs, field)
+
+
+def add_source(plan, model, prefix, attrs, field):
+    # attrs is the dotted source, field the serializer field rendering it
+    name, rest = attrs[0], attrs[1:]
+    if prefix == "" and name in plan.annotations:
+        return
+    try:
+        model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # Also accept an FK's attname, e.g. source="user_id"
+        model_field = next((f for f in model._meta.concrete_fields if f.attname == name), None)
+        if model_field is None:
+            plan.load_all(prefix) # a property or method
+            return
+        plan.load(prefix, model_field.name)
+        return
+
+    if not model_field.is_relation:
+        plan.load(prefix, model_field.name)
+    elif model_field.concrete and (model_field.many_to_one or model_field.one_to_one):
+        if not rest and (field is None or pk_only(field)):
+            plan.load(prefix, model_field.name)
+            return
+        related_prefix = plan.join(prefix, model_field)
+        if rest:
+            add_source(plan, model_field.related_model, related_prefix, rest, field)
+        elif isinstance(field, serializers.BaseSerializer):
+            add_serializer(plan, field, model_field.related_model, related_prefix)
+        else:
+            plan.load_all(related_prefix)
+    elif (model_field.one_to_many or model_field.many_to_many) and not rest \
+            and getattr(model_field, "related_model", None) is not None:
+        plan.prefetch[prefix + model_field.name] = (model_field, field)
+    elif model_field.one_to_one and not rest and isinstance(field, serializers.BaseSerializer):
+        # Reverse one-to-one, e.g. customer.address
+        related_prefix = plan.join(prefix, model_field)
+        add_serializer(plan, field, model_field.related_model, related_prefix)
+    else:
+        # Generic relations and sources reaching through to-many relations
+        plan.load_all(prefix)
+
+
+def pk_only(field):
+    return isinstance(field, RelatedField) and field.use_pk_only_optimization() \
+        and field.source_attrs[-1] != "*"
+
+
+def add_prefetches(queryset, prefetch):
+    # Prefetches the queryset already has keep their queryset, e.g. one
+    # with annotations, and get optimized too
+    existing = {}
+    for lookup in queryset._prefetch_related_lookups:
+        if isinstance(lookup, str):
+            lookup = Prefetch(lookup)
+        existing[lookup.prefetch_to] = lookup
+
+    for (path, (model_field, field)) in prefetch.items():
+        lookup = existing.get(path)
+        related_queryset = lookup.queryset if lookup is not None and lookup.queryset is not None \
+            else model_field.related_model._default_manager.all()
+        existing[path] = Prefetch(
+            path,
+            queryset=optimize_related(related_queryset, model_field, field),
+            to_attr=lookup.to_attr if lookup is not None else None,
+        )
+    return queryset.prefetch_related(None).prefetch_related(*existing.values())
+
+
+def optimize_related(queryset, model_field, field):
+    # The prefetch matches rows back to their parents by the FK column
+    fields = [model_field.field.name] if model_field.one_to_many else []
+    if isinstance(field, serializers.ListSerializer):
+        return optimize_queryset(queryset, field.child, fields)
+    if isinstance(field, ManyRelatedField) and pk_only(field.child_relation):
+        return queryset.only("pk", *fields)
+    return queryset
+
+
+def ordering_fields(queryset):
+    # The columns a queryset is ordered by, keyset cursors read them from the rows
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    return [
+        name.lstrip("-")
+        for name in ordering
+        if isinstance(name, str) and name.lstrip("-") not in ("?", "pk")
+    ]
+
+
+class OptimizedQuerySetMixin:
+    # For generic views: reads load what get_serializer_class() renders.
+    # Applied after filtering so the ordering columns are known
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        return self.optimize_queryset(queryset)
+
+    def optimize_queryset(self, queryset):
+        return optimize_queryset(queryset, self.get_serializer_class(), ordering_fields(queryset))
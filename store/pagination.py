@@ -1,11 +1,289 @@
-from rest_framework.pagination import PageNumberPagination,LimitOffsetPagination
+from datetime import date, datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db import connections
+from django.db.models import Q, QuerySet
+from rest_framework import exceptions
+from rest_framework.pagination import BasePagination, PageNumberPagination,LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
-    
+
 
 class CustomLimitOffsetPagination(LimitOffsetPagination):
     default_limit = 20
     limit_query_param='page_limit'
     offset_query_param = "page_offset"
-    
\ No newline at end of file
+
+
+# Keyset (seek) pagination: instead of OFFSET n the next page is fetched with
+# WHERE (title, id) > (last_title, last_id) ORDER BY title, id LIMIT n,
+# so every page costs the same no matter how deep the client goes.
+class KeysetPagination(BasePagination):
+    page_size = 20
+    page_size_query_param = 'page_limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    # Columns a cursor may seek on. They must be non-nullable,
+    # otherwise the row comparison silently skips rows.
+    # search_rank is annotated by FullTextSearchFilter.
+    ordering_fields = ['title','unit_price','last_update','search_rank']
+    tiebreak_field = 'id'
+
+    # Backends without a planner estimate count at most this many rows
+    approximate_count_cap = 10000
+    cursor_salt = 'store.pagination.KeysetPagination'
+    invalid_cursor_message = 'Invalid cursor'
+    invalid_count_message = "Count must be 'exact' or 'approximate'"
+
+    display_page_controls = False
+
+    def paginate_queryset(self, queryset:QuerySet, request, view=None):
+        self.count = self.get_count(queryset, request)
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset:QuerySet, request, view=None):
+        # The same page through the async ORM, for store.async_views
+        self.count = await self.aget_count(queryset, request)
+        return self.set_page([obj async for obj in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset:QuerySet, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+
+        self.position, self.reverse = self.decode_cursor(request, queryset)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self.invert(name) for name in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.get_seek_filter(self.position, self.reverse))
+
+        # One extra row tells us whether there is another page
+        return queryset[:self.limit + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset:QuerySet):
+        # OrderingFilter has already applied ?ordering=, otherwise fall back
+        # to Meta.ordering (title for products)
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+
+        fields = []
+        for name in ordering:
+            if not isinstance(name, str):
+                raise ImproperlyConfigured("KeysetPagination only supports ordering by field names")
+            field_name = name.lstrip('-')
+            if field_name in ('pk', self.tiebreak_field):
+                break # the primary key is unique, anything after it is irrelevant
+            if field_name not in self.ordering_fields:
+                raise ImproperlyConfigured(
+                    f"Cannot paginate by '{field_name}', add it to {self.__class__.__name__}.ordering_fields"
+                )
+            fields.append(name)
+
+        # Tiebreak in the same direction as the last column so a
+        # composite (column, id) index can be scanned in one direction
+        descending = bool(fields) and fields[-1].startswith('-')
+        fields.append(f"{'-' if descending else ''}{self.tiebreak_field}")
+        return fields
+
+    def get_seek_filter(self, position, reverse:bool) -> Q:
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        seek = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, position):
+            field_name = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            seek |= equal & Q(**{f"{field_name}__{'lt' if descending else 'gt'}": value})
+            equal &= Q(**{field_name: value})
+        return seek
+
+    def get_count(self, queryset:QuerySet, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode is None:
+            return None
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'approximate':
+            return self.get_approximate_count(queryset)
+        raise exceptions.ValidationError({self.count_query_param: [self.invalid_count_message]})
+
+    async def aget_count(self, queryset:QuerySet, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return await queryset.acount()
+        if mode is None:
+            return None
+        # There's no async cursor for the EXPLAIN
+        return await sync_to_async(self.get_count)(queryset, request)
+
+    def get_approximate_count(self, queryset:QuerySet) -> int:
+        connection = connections[queryset.db]
+        if connection.vendor == 'mysql':
+            # Let the planner estimate instead of running COUNT(*)
+            sql, params = queryset.order_by().query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN {sql}", params)
+                columns = [column[0] for column in cursor.description]
+                row = cursor.fetchone()
+            if row is not None:
+                rows = row[columns.index('rows')] or 0
+                filtered = row[columns.index('filtered')] if 'filtered' in columns else 100
+                return int(rows * (filtered or 100) / 100)
+        return queryset.order_by()[:self.approximate_count_cap].count()
+
+    # Cursors
+
+    @staticmethod
+    def invert(name:str) -> str:
+        return name[1:] if name.startswith('-') else f"-{name}"
+
+    def get_position(self, instance):
+        position = []
+        for name in self.ordering:
+            value = getattr(instance, name.lstrip('-'))
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            position.append(value)
+        return position
+
+    def encode_cursor(self, position, reverse:bool) -> str:
+        payload = {'o': self.ordering, 'p': position}
+        if reverse:
+            payload['r'] = 1
+        return signing.dumps(payload, salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, request, queryset:QuerySet):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None, False
+
+        try:
+            payload = signing.loads(cursor, salt=self.cursor_salt)
+            # A cursor is only valid for the ordering it was issued for
+            if payload['o'] != self.ordering or len(payload['p']) != len(self.ordering):
+                raise ValueError(payload['o'])
+            position = [
+                self.to_python(queryset, name.lstrip('-'), value)
+                for name, value in zip(self.ordering, payload['p'])
+            ]
+        except (signing.BadSignature, KeyError, TypeError, ValueError, ValidationError):
+            # The client's input, not a missing page
+            raise exceptions.ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+
+        return position, bool(payload.get('r'))
+
+    @staticmethod
+    def to_python(queryset:QuerySet, name:str, value):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value # an annotation, e.g. search_rank
+        return field.to_python(value)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        cursor = self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        cursor = self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {
+                    'type': 'integer',
+                    'example': 123,
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': "Include a total count: 'exact' or 'approximate'.",
+                'schema': {'type': 'string', 'enum': ['exact', 'approximate']},
+            },
+        ]
@@ -1,20 +1,35 @@
 
+from collections import Counter
 from dataclasses import fields
 from decimal import Decimal
 from itertools import product
+from django.db import connections, router, transaction
 from rest_framework import serializers
 
+from likes.models import LikedItem
+from store.analytics import INTERVALS
+from store.middleware import timed_serialization
 from store.models import Cart, CartItem, Customer, Product, Collection, Review
+from store.tax import PriceWithTaxListSerializer, PriceWithTaxMixin
+from tags.models import Tag, TaggedItem
 
 
-class CollectionSerializer(serializers.Serializer):
+class SerializationTimingMixin:
+    # For the serialization time of QueryStatsMiddleware, nested
+    # serializers are counted once, in their parent's time
+    @timed_serialization()
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+class CollectionSerializer(SerializationTimingMixin, serializers.Serializer):
     id = serializers.IntegerField()
     title = serializers.CharField(max_length=255)
     
 
 # Instead of redefining all 
 # Use the following
-class CollectionModelSerializer(serializers.ModelSerializer):
+class CollectionModelSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     class Meta:
         model = Collection
         fields = ['id','title','products_count']
@@ -26,7 +41,7 @@ class CollectionModelSerializer(serializers.ModelSerializer):
         collection.save()
         return collection
 
-class ProductSerializer(serializers.Serializer):
+class ProductSerializer(SerializationTimingMixin, PriceWithTaxMixin, serializers.Serializer):
     id = serializers.IntegerField()
     title = serializers.CharField(max_length=255)
     price = serializers.DecimalField(
@@ -34,7 +49,8 @@ class ProductSerializer(serializers.Serializer):
         decimal_places=2,
         source='unit_price'
         )
-    price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
+    # Computed for the whole page by PriceWithTaxListSerializer
+    price_with_tax = serializers.ReadOnlyField()
     
     # Serializeing relationships
     # option 1
@@ -65,17 +81,45 @@ class ProductSerializer(serializers.Serializer):
     
     
     
-    def calculate_tax(self,product:Product):
-        return product.unit_price * Decimal(1.1)
+    class Meta:
+        list_serializer_class = PriceWithTaxListSerializer
+        computed_field_sources = {"price_with_tax": ["unit_price", "collection.tax_rate"]}
     
     
     # Instead of redefining all 
     # the fields inside ProductSerializer we can do the following
+
+class TagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ['id','label']
+
+
+class ProductListSerializer(PriceWithTaxListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, "all") else data)
+        if "tags" in self.child.fields:
+            # One query for the page's tags, unless already attached
+            TaggedItem.objects.prefetch_tags([product for product in products if not hasattr(product, "tags")])
+        if "liked" in self.child.fields:
+            # Likewise for which of them the user liked
+            LikedItem.objects.prefetch_liked(
+                self.context["liked_by"], [product for product in products if not hasattr(product, "liked")]
+            )
+        return super().to_representation(products)
+
     
-class ProductModelSerializer(serializers.ModelSerializer):
+class ProductModelSerializer(SerializationTimingMixin, PriceWithTaxMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id','title','description','slug','inventory','price','price_with_tax','collection']
+        fields = ['id','title','description','slug','inventory','price','price_with_tax','collection','tags','liked']
+        list_serializer_class = ProductListSerializer
+        # What the computed fields read, for store.optimizer
+        computed_field_sources = {
+            "price_with_tax": ["unit_price", "collection.tax_rate"],
+            "tags": [],
+            "liked": [],
+        }
         
         # You mustn't do the following because
         #  if tomorrow we add field that field 
@@ -95,11 +139,25 @@ class ProductModelSerializer(serializers.ModelSerializer):
     # collection = CollectionModelSerializer()
     
     price = serializers.DecimalField(max_digits=6,decimal_places=2,source='unit_price')
-    price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
-    
-    
-    def calculate_tax(self, product:Product) -> Decimal:
-        return product.unit_price * Decimal(1.1)
+    price_with_tax = serializers.ReadOnlyField()
+    # Only with context["include_tags"], see ProductViewSet
+    tags = TagSerializer(many=True, read_only=True)
+    # Whether context["liked_by"] liked the product, only when it's set
+    liked = serializers.BooleanField(read_only=True)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get("include_tags"):
+            self.fields.pop("tags")
+        if self.context.get("liked_by") is None:
+            self.fields.pop("liked")
+    
+    def to_representation(self, instance):
+        if "tags" in self.fields and not hasattr(instance, "tags"):
+            TaggedItem.objects.prefetch_tags([instance])
+        if "liked" in self.fields and not hasattr(instance, "liked"):
+            LikedItem.objects.prefetch_liked(self.context["liked_by"], [instance])
+        return super().to_representation(instance)
     
     # this validation do not make sense here 
     # but I wanna put here to make sure that
@@ -131,11 +189,14 @@ class CartItemProductSerializer(serializers.ModelSerializer):
         fields = ['id','title','unit_price']
         
         
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     product = CartItemProductSerializer()
     total_price = serializers.SerializerMethodField()
     
     def get_total_price(self,cartitem:CartItem):
+        # Annotated in SQL by CartItem.objects.with_total_price()
+        if hasattr(cartitem, 'total_price'):
+            return cartitem.total_price
         return cartitem.quantity * cartitem.product.unit_price
     
     class Meta:
@@ -143,12 +204,15 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id','product','quantity','total_price']
         
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True,read_only=True)
     total_price = serializers.SerializerMethodField()
     
     def get_total_price(self,cart:Cart):
+        # Annotated in SQL by Cart.objects.with_total_price()
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
         return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
     
         # or
@@ -162,7 +226,7 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id','created_at',"items","total_price"]
     
     
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ["id","name","description","date"]
@@ -173,26 +237,46 @@ class ReviewSerializer(serializers.ModelSerializer):
     
     
 
-class AddCartItemSerializer(serializers.ModelSerializer):
+# CartItem.quantity is a PositiveSmallIntegerField, this is what it holds
+# on every backend (SQLite has no limit, MySQL's unsigned column more)
+MAX_QUANTITY = 32767
+
+
+def too_many_in_cart(using, cart_id, quantities):
+    # Locks the lines already in the cart (inside a transaction) and returns
+    # the products that would go over MAX_QUANTITY once the quantities are added
+    existing = CartItem.objects.using(using).select_for_update()\
+        .filter(cart_id=cart_id, product_id__in=quantities)\
+        .values_list('product_id','quantity')
+    return sorted(
+        product_id for (product_id, quantity) in existing if quantity + quantities[product_id] > MAX_QUANTITY
+    )
+
+
+class AddCartItemSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     product_id = serializers.IntegerField()
-    
-    def validate_product_id(self,value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError("No product with the give id was found!")
-        return value
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_QUANTITY)
     
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
         
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity +=  quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(cart_id=cart_id,**self.validated_data)
+        # A single upsert that also checks the product exists and
+        # increments the quantity in the database, so concurrent adds
+        # of the same product can't overwrite each other. The line is
+        # locked first so the merged quantity can be bounded
+        using = router.db_for_write(CartItem)
+        with transaction.atomic(using=using):
+            if too_many_in_cart(using, cart_id, {product_id: quantity}):
+                raise serializers.ValidationError({
+                    "quantity": [f"At most {MAX_QUANTITY} of a product, the cart would hold more"]
+                })
+            self.instance = CartItem.objects.db_manager(using).add_product(cart_id, product_id, quantity)
+        if self.instance is None:
+            raise serializers.ValidationError({
+                "product_id": ["No product with the give id was found!"]
+            })
             
         return self.instance
     class Meta:
@@ -200,14 +284,86 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ['id','product_id','quantity']
 
 
-class UpdateCartItemSerializer(serializers.ModelSerializer):
+class BulkAddCartItemSerializer(serializers.Serializer):
+    items = AddCartItemSerializer(many=True, allow_empty=False)
+    # Set the quantities instead of adding to what is already in the cart
+    replace = serializers.BooleanField(default=False)
+    
+    def validate_items(self, items):
+        # Merge repeated products, then check them all with one IN query
+        quantities = Counter()
+        for item in items:
+            quantities[item['product_id']] += item['quantity']
+        
+        too_many = sorted(product_id for (product_id, quantity) in quantities.items() if quantity > MAX_QUANTITY)
+        if too_many:
+            raise serializers.ValidationError(f"At most {MAX_QUANTITY} of a product, more were given for: {too_many}")
+            
+        found = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        missing = sorted(set(quantities) - found)
+        if missing:
+            raise serializers.ValidationError(f"No products with the given ids were found: {missing}")
+        return quantities
+    
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = self.validated_data['items']
+        using = router.db_for_write(CartItem)
+        
+        with transaction.atomic(using=using):
+            if self.validated_data['replace']:
+                self.replace_items(using, cart_id, quantities)
+            else:
+                self.add_items(using, cart_id, quantities)
+            
+        # Upserted rows don't get their ids back on every backend
+        self.instance = list(CartItem.objects.filter(cart_id=cart_id, product_id__in=quantities))
+        return self.instance
+    
+    def add_items(self, using, cart_id, quantities):
+        # Each product is added with the same increment upsert as a single
+        # add: a line inserted concurrently after the check is incremented too
+        too_many = too_many_in_cart(using, cart_id, quantities)
+        if too_many:
+            raise serializers.ValidationError({
+                "items": [f"At most {MAX_QUANTITY} of a product, the cart would hold more of: {too_many}"]
+            })
+        # Sorted, so concurrent bulk adds lock the lines in the same order
+        for product_id in sorted(quantities):
+            CartItem.objects.db_manager(using).add_product(cart_id, product_id, quantities[product_id])
+    
+    def replace_items(self, using, cart_id, quantities):
+        # MySQL upserts on any unique key and doesn't accept unique_fields
+        unique_fields = None
+        if connections[using].features.supports_update_conflicts_with_target:
+            unique_fields = ['cart','product']
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                for (product_id, quantity) in quantities.items()
+            ],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['quantity'],
+        )
+
+
+class UpdateCartItemSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['quantity']
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(SerializationTimingMixin, serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
     class Meta:
         model = Customer
-        fields = ['id','user_id','phone_number','birth_date','membership']
\ No newline at end of file
+        fields = ['id','user_id','phone_number','birth_date','membership']
+
+
+class RevenueQuerySerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    interval = serializers.ChoiceField(choices=list(INTERVALS), default="day")
+    collection_id = serializers.IntegerField(required=False)
+    product_id = serializers.IntegerField(required=False)
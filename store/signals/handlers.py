@@ -0,0 +1,69 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from store.cache import invalidate_on_commit
+from store.models import Collection, Product, Promotion
+from tags.models import Tag, TaggedItem
+
+
+# Response cache invalidation
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance:Product, **kwargs):
+    # products_count of the old and the new collection changes as well.
+    # Product.save() only refreshes _loaded_collection_id after the signal.
+    collection_ids = {instance.collection_id, getattr(instance, '_loaded_collection_id', None)}
+    invalidate_on_commit(
+        ('products', None),
+        ('products', instance.pk),
+        ('collections', None),
+        *[('collections', pk) for pk in collection_ids if pk is not None]
+    )
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection(sender, instance:Collection, **kwargs):
+    invalidate_on_commit(('collections', None), ('collections', instance.pk))
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(pre_delete, sender=Promotion)
+def invalidate_promotion(sender, instance:Promotion, **kwargs):
+    # pre_delete: the products are gone from the through table by post_delete
+    product_ids = instance.products.values_list('pk', flat=True)
+    invalidate_on_commit(('products', None), *[('products', pk) for pk in product_ids])
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_product_promotions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        product_ids = [instance.pk]
+    elif pk_set is not None:
+        product_ids = pk_set
+    else:
+        product_ids = instance.products.values_list('pk', flat=True)
+    invalidate_on_commit(('products', None), *[('products', pk) for pk in product_ids])
+
+
+# Tags are rendered with ?include=tags. Touching last_update moves the
+# products' ETags and response cache keys
+
+@receiver([post_save, post_delete], sender=TaggedItem)
+def touch_tagged_product(sender, instance:TaggedItem, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+        Product.objects.filter(pk=instance.object_id).update(last_update=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+def touch_tag_products(sender, instance:Tag, created, **kwargs):
+    if created:
+        return
+    product_ids = TaggedItem.objects.filter(
+        tag=instance,
+        content_type=ContentType.objects.get_for_model(Product)
+    ).values('object_id')
+    Product.objects.filter(pk__in=product_ids).update(last_update=timezone.now())
@@ -0,0 +1,67 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from rest_framework import serializers
+
+from store.models import Collection, Product
+
+
+CENT = Decimal("0.01")
+
+
+def default_rate():
+    # A string in settings, a float would not be exact
+    return Decimal(str(getattr(settings, "STORE_TAX_RATE", "0.10")))
+
+
+def add_price_with_tax(products):
+    # Sets price_with_tax on a whole page, looking each collection's rate
+    # up once. The rates come from the joined collections (see
+    # Meta.computed_field_sources), otherwise from one query for the page
+    default = default_rate()
+    multipliers = {} # collection_id -> 1 + rate
+    missing = set()
+    for product in products:
+        collection_id = product.collection_id
+        if collection_id in multipliers or collection_id in missing:
+            continue
+        if Product.collection.is_cached(product):
+            rate = product.collection.tax_rate
+            multipliers[collection_id] = 1 + (default if rate is None else rate)
+        else:
+            missing.add(collection_id)
+    if missing:
+        for (collection_id, rate) in Collection.objects.filter(pk__in=missing).values_list("pk", "tax_rate"):
+            multipliers[collection_id] = 1 + (default if rate is None else rate)
+
+    for product in products:
+        multiplier = multipliers.get(product.collection_id, 1 + default)
+        product.price_with_tax = (product.unit_price * multiplier).quantize(CENT, rounding=ROUND_HALF_UP)
+    return products
+
+
+class PriceWithTaxListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, "all") else data)
+        return super().to_representation(add_price_with_tax(products))
+
+
+class PriceWithTaxMixin:
+    # For product serializers with a read-only price_with_tax field,
+    # lists compute it page by page in PriceWithTaxListSerializer
+    def to_representation(self, instance):
+        if not hasattr(instance, "price_with_tax"):
+            add_price_with_tax([instance])
+        return super().to_representation(instance)
+
+    @staticmethod
+    def add_computed_values(rows, data):
+        # Flat lists (store.flat), rows hold the computed_field_sources
+        default = default_rate()
+        multipliers = {} # tax_rate -> 1 + rate
+        for (row, item) in zip(rows, data):
+            rate = row.collection__tax_rate
+            multiplier = multipliers.get(rate)
+            if multiplier is None:
+                multiplier = multipliers[rate] = 1 + (default if rate is None else rate)
+            item["price_with_tax"] = (row.unit_price * multiplier).quantize(CENT, rounding=ROUND_HALF_UP)
@@ -1,3 +1,654 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import time
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from likes.models import LikedItem
+from store import analytics
+from store.analytics import backfill_revenue, rollup_revenue
+from store.exports import order_rows
+from store.filters import FullTextSearchFilter
+from store.flat import FlatListMixin, get_flat_serializer
+from store.middleware import QueryBudgetExceeded, QueryRecorder, fingerprint, stats as query_stats
+from store.models import (
+    Cart,
+    CartItem,
+    Collection,
+    CollectionDailyRevenue,
+    Customer,
+    DailyRevenue,
+    Order,
+    OrderItem,
+    Product,
+    ProductDailyRevenue,
+    RevenueRollupState,
+)
+from store.serializers import CollectionModelSerializer, ProductModelSerializer, ProductSerializer
+from store.views import ProductViewSet
+from tags.models import Tag, TaggedItem
+
+
+def make_products(collection, titles, unit_price=Decimal("10.00"), description=""):
+    return [
+        Product.objects.create(
+            title=title,
+            slug=title.lower().replace(" ", "-"),
+            description=description,
+            unit_price=unit_price,
+            inventory=10,
+            collection=collection,
+        )
+        for title in titles
+    ]
+
+
+class StoreTestCase(TestCase):
+    def setUp(self):
+        # Responses are cached per process, across tests too
+        cache.clear()
+        self.client = APIClient()
+        self.collection = Collection.objects.create(title="Coffee")
+
+
+class KeysetPaginationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        # Few distinct prices, pages have to break ties on id
+        for i in range(23):
+            make_products(self.collection, [f"Product {i:02}"], unit_price=Decimal(10 + i % 3))
+        self.expected = list(Product.objects.order_by("unit_price", "id").values_list("id", flat=True))
+
+    def test_pages_forward_and_back_without_duplicates(self):
+        url = "/store/products/?ordering=unit_price&page_limit=5"
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product["id"] for product in response.data["results"]])
+            url = response.data["next"]
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+
+        # And back from the last page through the previous links
+        url = response.data["previous"]
+        for page in reversed(pages[:-1]):
+            response = self.client.get(url)
+            self.assertEqual([product["id"] for product in response.data["results"]], page)
+            url = response.data["previous"]
+        self.assertIsNone(url)
+
+    def test_bad_cursor_and_count_are_400(self):
+        self.assertEqual(self.client.get("/store/products/?cursor=garbage").status_code, 400)
+        self.assertEqual(self.client.get("/store/products/?count=maybe").status_code, 400)
+
+
+class ProductsCountTests(StoreTestCase):
+    def assertNoDrift(self):
+        actual = dict(Collection.objects.annotate(actual=Count("products")).values_list("pk", "actual"))
+        stored = dict(Collection.objects.values_list("pk", "products_count"))
+        self.assertEqual(stored, actual)
+
+    def test_writes_keep_products_count(self):
+        other = Collection.objects.create(title="Tea")
+        products = make_products(self.collection, ["A", "B", "C"])
+        self.assertNoDrift()
+
+        Product.objects.bulk_create([
+            Product(title="D", slug="d", unit_price=1, inventory=1, collection=other),
+            Product(title="E", slug="e", unit_price=1, inventory=1, collection=other),
+        ])
+        self.assertNoDrift()
+
+        products[0].collection = other
+        products[0].save()
+        self.assertNoDrift()
+
+        Product.objects.filter(pk=products[1].pk).update(collection=other)
+        self.assertNoDrift()
+
+        self.collection.products.add(Product.objects.get(title="D"), bulk=False)
+        self.assertNoDrift()
+
+        Product.objects.filter(title__in=["E", "C"]).delete()
+        products[0].delete()
+        self.assertNoDrift()
+
+
+class CartTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product, self.other = make_products(self.collection, ["Beans", "Grinder"])
+        self.cart = Cart.objects.create()
+        self.items_url = f"/store/carts/{self.cart.pk}/items/"
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity"))
+
+    def test_adding_a_product_again_increments_it(self):
+        for quantity in (2, 3):
+            response = self.client.post(self.items_url, {"product_id": self.product.pk, "quantity": quantity})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantities(), {self.product.pk: 5})
+
+    def test_bulk_adds_merges_and_replaces(self):
+        bulk_url = f"{self.items_url}bulk/"
+        items = [
+            {"product_id": self.product.pk, "quantity": 1},
+            {"product_id": self.other.pk, "quantity": 2},
+            {"product_id": self.product.pk, "quantity": 3},
+        ]
+        self.assertEqual(self.client.post(bulk_url, {"items": items}, format="json").status_code, 200)
+        self.assertEqual(self.client.post(bulk_url, {"items": items}, format="json").status_code, 200)
+        self.assertEqual(self.quantities(), {self.product.pk: 8, self.other.pk: 4})
+
+        items = [{"product_id": self.product.pk, "quantity": 1}]
+        self.assertEqual(self.client.post(bulk_url, {"items": items, "replace": True}, format="json").status_code, 200)
+        self.assertEqual(self.quantities(), {self.product.pk: 1, self.other.pk: 4})
+
+    def test_quantities_are_bounded(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=32000)
+        items = [{"product_id": self.product.pk, "quantity": 1000}]
+        response = self.client.post(f"{self.items_url}bulk/", {"items": items}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), {self.product.pk: 32000})
+
+    def test_single_adds_are_bounded(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=32000)
+        response = self.client.post(self.items_url, {"product_id": self.product.pk, "quantity": 767})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(self.items_url, {"product_id": self.product.pk, "quantity": 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("quantity", response.data)
+        self.assertEqual(self.quantities(), {self.product.pk: 32767})
+
+
+class ConditionalGetTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        (self.product,) = make_products(self.collection, ["Beans"])
+
+    def test_list_etag(self):
+        url = "/store/products/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Bulk updates send no signals, the cached list has to go anyway
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(title="Whole beans")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["title"], "Whole beans")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_list_revalidates_without_fetching_the_page(self):
+        make_products(self.collection, ["Grinder", "Kettle"])
+        url = "/store/products/?page_limit=2"
+        etag = self.client.get(url)["ETag"]
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Only the ids and last_update of the page
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("unit_price", queries[0]["sql"])
+
+        # Rows off the page don't matter, unless they change the links
+        Product.objects.filter(title="Kettle").update(inventory=0)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Product.objects.filter(title="Kettle").delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_etag_and_last_modified(self):
+        url = f"/store/products/{self.product.pk}/"
+        response = self.client.get(url)
+        self.assertIn("Last-Modified", response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        Product.objects.filter(pk=self.product.pk).update(inventory=0)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_liked_detail_has_no_last_modified(self):
+        user = get_user_model().objects.create_user("liker", email="liker@example.com", password="secret")
+        self.client.force_authenticate(user)
+        url = f"/store/products/{self.product.pk}/?include=liked"
+        response = self.client.get(url)
+        self.assertNotIn("Last-Modified", response)
+
+        # The product didn't change, the user's likes did
+        LikedItem.objects.like(user, self.product)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["liked"])
+
+
+class FullTextSearchTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        make_products(self.collection, ["Espresso beans", "Dark roast"], description="whole coffee beans")
+        make_products(self.collection, ["Espresso machine"], description="steel boiler")
+        make_products(self.collection, ["Tea pot"], description="ceramic")
+
+    def search(self, term):
+        response = self.client.get("/store/products/", {"search": term, "page_limit": 100})
+        self.assertEqual(response.status_code, 200)
+        return {product["id"] for product in response.data["results"]}
+
+    def icontains(self, term):
+        products = Product.objects.all()
+        for word in term.split():
+            products = products.filter(title__icontains=word) | products.filter(description__icontains=word)
+        return set(products.values_list("pk", flat=True))
+
+    def test_matches_icontains_for_whole_words(self):
+        for term in ["espresso", "beans", "espresso beans", "coffee dark", "steel", "tea", "missing"]:
+            with self.subTest(term=term):
+                self.assertEqual(self.search(term), self.icontains(term))
+
+    def test_words_are_prefixes(self):
+        self.assertEqual(self.search("espr"), self.icontains("espresso"))
+
+    @skipUnless(connection.vendor == "sqlite", "the FTS5 table is SQLite's")
+    def test_searches_the_full_text_index(self):
+        # SQLite's FTS5 table from migration 0019, not the icontains fallback
+        with CaptureQueriesContext(connection) as queries:
+            self.search("espresso")
+        self.assertTrue(any("store_product_fts" in query["sql"] for query in queries))
+
+    def test_mysql_boolean_query(self):
+        # Only built here, the SQL runs on MySQL
+        queryset = FullTextSearchFilter().filter_mysql(
+            connection, Product.objects.all(), ProductViewSet(), ['lamp")@', "tv", "-(x"]
+        )
+        _, params = queryset.query.sql_with_params()
+        # Operators are stripped, short words aren't dropped
+        self.assertEqual(params[:2], ("+lamp*", "+lamp*"))
+        self.assertIn("%tv%", params)
+        self.assertIn("%x%", params)
+
+
+class QueryStatsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        make_products(self.collection, ["Beans"])
+        query_stats.reset()
+        self.addCleanup(query_stats.reset)
+
+    def test_records_queries_per_endpoint(self):
+        for _ in range(2):
+            cache.clear()
+            self.assertEqual(self.client.get("/store/collections/").status_code, 200)
+        self.client.get("/admin/login/")
+        snapshot = query_stats.snapshot()
+        self.assertEqual(list(snapshot), ["CollectionViewSet.list"])
+        endpoint_stats = snapshot["CollectionViewSet.list"]
+        self.assertEqual(endpoint_stats["requests"], 2)
+        self.assertGreater(endpoint_stats["queries"], 0)
+        self.assertEqual(endpoint_stats["over_budget"], 0)
+
+    @override_settings(QUERY_STATS={"BUDGETS": {"CollectionViewSet.list": 0}})
+    def test_exceeded_budget_is_logged(self):
+        with self.assertLogs("store.middleware", "WARNING") as logs:
+            self.assertEqual(self.client.get("/store/collections/").status_code, 200)
+        self.assertIn("CollectionViewSet.list ran", logs.output[0])
+        self.assertEqual(query_stats.snapshot()["CollectionViewSet.list"]["over_budget"], 1)
+
+    @override_settings(QUERY_STATS={"BUDGETS": {"CollectionViewSet.list": 0}, "RAISE_ON_BUDGET": True})
+    def test_exceeded_budget_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "its budget is 0"):
+            self.client.get("/store/collections/")
+
+    def test_repeated_statements_are_duplicates(self):
+        # Lists of placeholders of any length are the same statement
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s)"), fingerprint("SELECT * FROM t WHERE id IN (%s)")
+        )
+        make_products(self.collection, ["Grinder"])
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            # N+1: the collection of every product
+            for product in Product.objects.all():
+                product.collection
+        query_stats.record("test", recorder, None)
+        (duplicate,) = query_stats.snapshot()["test"]["duplicates"]
+        self.assertIn("store_collection", duplicate)
+        self.assertNotIn("store_product", duplicate)
+
+    def test_flushed_stats_are_merged(self):
+        with tempfile.TemporaryDirectory() as dump_dir:
+            with override_settings(QUERY_STATS={"DUMP_DIR": dump_dir, "FLUSH_INTERVAL": 0}):
+                self.client.get("/store/collections/")
+                output = StringIO()
+                call_command("query_stats", "--reset", stdout=output)
+            summary = json.loads(output.getvalue())
+            self.assertEqual(summary["CollectionViewSet.list"]["requests"], 1)
+            self.assertFalse(list(Path(dump_dir).iterdir()))
+
+
+class OrderExportTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        beans, grinder = make_products(self.collection, ["Beans", "Grinder"])
+        User = get_user_model()
+        user = User.objects.create_user("ada", email="ada@example.com", first_name="Ada", last_name="Lovelace")
+        customer = Customer.objects.create(user=user)
+        self.order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=self.order, product=beans, quantity=3, unit_price=Decimal("2.50"))
+        OrderItem.objects.create(order=self.order, product=grinder, quantity=1, unit_price=Decimal("40.00"))
+        self.empty = Order.objects.create(customer=customer, payment_status=Order.PAYMENT_STATUS_COMPLETED)
+        self.client.force_authenticate(User.objects.create_superuser("admin", email="admin@example.com"))
+
+    def export(self, **params):
+        response = self.client.get("/store/orders/export/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.DictReader(self.export().splitlines()))
+        self.assertEqual(
+            [(row["order_id"], row["product_title"], row["quantity"], row["revenue"]) for row in rows],
+            [
+                (str(self.order.pk), "Beans", "3", "7.50"),
+                (str(self.order.pk), "Grinder", "1", "40.00"),
+                # Orders without items get one row of empty item columns
+                (str(self.empty.pk), "", "", ""),
+            ],
+        )
+        self.assertEqual(rows[0]["customer_email"], "ada@example.com")
+
+    def test_jsonl(self):
+        orders = [json.loads(line) for line in self.export(export_format="jsonl").splitlines()]
+        self.assertEqual([order["order_id"] for order in orders], [self.order.pk, self.empty.pk])
+        self.assertEqual([item["revenue"] for item in orders[0]["items"]], ["7.50", "40.00"])
+        self.assertEqual(orders[0]["revenue"], "47.50")
+        self.assertEqual((orders[1]["items"], orders[1]["revenue"]), ([], "0.00"))
+
+    def test_filters_and_the_command_match_the_view(self):
+        self.assertEqual(len(self.export(payment_status="C").splitlines()), 2)
+        with tempfile.NamedTemporaryFile("r") as output:
+            call_command("export_orders", "--format", "jsonl", "--output", output.name)
+            self.assertEqual(output.read(), self.export(export_format="jsonl"))
+
+    def test_batches_end_on_order_boundaries(self):
+        self.assertEqual(list(order_rows(chunk_size=1)), list(order_rows()))
+
+    def test_admins_only_and_known_formats(self):
+        self.assertEqual(self.client.get("/store/orders/export/", {"export_format": "xml"}).status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get("/store/orders/export/").status_code, 401)
+
+
+class RevenueRollupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.beans, self.grinder = make_products(self.collection, ["Beans", "Grinder"])
+        user = get_user_model().objects.create_user("ada", email="ada@example.com")
+        self.customer = Customer.objects.create(user=user)
+        self.order = Order.objects.create(customer=self.customer)
+
+    def add(self, order, product, quantity, **kwargs):
+        return OrderItem.objects.create(
+            order=order, product=product, quantity=quantity, unit_price=product.unit_price, **kwargs
+        )
+
+    def rollups(self):
+        return [
+            sorted(model.objects.values_list(*fields))
+            for (model, fields) in [
+                (DailyRevenue, ["date", "orders", "items", "quantity", "revenue"]),
+                (CollectionDailyRevenue, ["date", "collection_id", "items", "quantity", "revenue"]),
+                (ProductDailyRevenue, ["date", "product_id", "items", "quantity", "revenue"]),
+            ]
+        ]
+
+    def assertMatchesBackfill(self):
+        rolled_up = self.rollups()
+        backfill_revenue()
+        self.assertEqual(rolled_up, self.rollups())
+
+    def test_incremental_rollups_match_a_backfill(self):
+        self.add(self.order, self.beans, 2)
+        self.assertEqual(rollup_revenue(batch_size=1), 1)
+        # More items of an order already counted, and a new order
+        self.add(self.order, self.grinder, 1)
+        self.add(Order.objects.create(customer=self.customer), self.beans, 3)
+        self.assertEqual(rollup_revenue(batch_size=1), 2)
+        self.assertEqual(rollup_revenue(), 0)
+        (daily,) = DailyRevenue.objects.all()
+        self.assertEqual((daily.orders, daily.items, daily.quantity, daily.revenue), (2, 3, 6, Decimal("60.00")))
+        self.assertMatchesBackfill()
+
+    def test_late_commits_are_rolled_up(self):
+        # Item 2's id was allocated first, its transaction commits after the rollup
+        self.add(self.order, self.beans, 1, pk=1)
+        self.add(self.order, self.beans, 1, pk=3)
+        rollup_revenue()
+        self.assertEqual(RevenueRollupState.objects.get().gaps[0][:2], [2, 2])
+
+        self.add(self.order, self.grinder, 4, pk=2)
+        self.assertEqual(rollup_revenue(), 1)
+        self.assertEqual(RevenueRollupState.objects.get().gaps, [])
+        # Still one order, it was counted with item 1
+        self.assertEqual(DailyRevenue.objects.get().orders, 1)
+        self.assertMatchesBackfill()
+
+    def test_gaps_expire(self):
+        self.add(self.order, self.beans, 1, pk=1)
+        self.add(self.order, self.beans, 1, pk=5)
+        rollup_revenue()
+        (gap,) = RevenueRollupState.objects.get().gaps
+        self.assertEqual(gap[:2], [2, 4])
+
+        # A rollback, its ids are never used
+        with mock.patch("store.analytics.time.time", return_value=gap[2] + analytics.GAP_TIMEOUT):
+            rollup_revenue()
+        self.assertEqual(RevenueRollupState.objects.get().gaps, [])
+
+    def test_report(self):
+        self.add(self.order, self.beans, 2)
+        self.add(self.order, self.grinder, 1)
+        call_command("rollup_revenue", stdout=StringIO())
+        admin = get_user_model().objects.create_superuser("admin", email="admin@example.com")
+        self.client.force_authenticate(admin)
+        response = self.client.get("/store/analytics/revenue/", {"interval": "month"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {field: response.data[field] for field in ("orders", "items", "quantity", "revenue")},
+            {"orders": 1, "items": 2, "quantity": 3, "revenue": Decimal("30.00")},
+        )
+        self.assertEqual(response.data["average_order_revenue"], Decimal("30.00"))
+        self.assertEqual(len(response.data["series"]), 1)
+
+        response = self.client.get("/store/analytics/revenue/", {"product_id": self.grinder.pk})
+        self.assertEqual(response.data["revenue"], Decimal("10.00"))
+        self.assertNotIn("orders", response.data)
+
+
+class AsyncViewTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.beans, self.grinder = make_products(self.collection, ["Beans", "Grinder"])
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.beans, quantity=2)
+
+    def assertSameAsSync(self, path, params=None):
+        response = self.client.get(f"/store/async{path}", params)
+        self.assertEqual(response.status_code, 200)
+        # Links point back at the route they came from
+        content = response.content.decode().replace("/store/async/", "/store/")
+        self.assertEqual(json.loads(content), self.client.get(f"/store{path}", params).json())
+        return response.json()
+
+    def test_same_responses_as_the_viewsets(self):
+        self.assertSameAsSync("/products/")
+        page = self.assertSameAsSync("/products/", {"page_limit": 1, "ordering": "title"})
+        self.assertEqual(self.client.get(page["next"]).json()["results"][0]["title"], "Grinder")
+        self.assertSameAsSync("/products/", {"search": "grind"})
+        self.assertSameAsSync("/products/", {"include": "tags"})
+        self.assertSameAsSync(f"/products/{self.beans.pk}/")
+        self.assertSameAsSync("/collections/")
+        self.assertSameAsSync(f"/collections/{self.collection.pk}/")
+        self.assertSameAsSync(f"/carts/{self.cart.pk}/")
+
+    def test_errors(self):
+        response = self.client.get("/store/async/products/0/")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("detail", response.json())
+        self.assertEqual(self.client.get("/store/async/products/", {"cursor": "garbage"}).status_code, 400)
+        self.assertEqual(self.client.post("/store/async/products/").status_code, 405)
+
+    def test_include_liked_authenticates(self):
+        user = get_user_model().objects.create_user("liker", email="liker@example.com", password="secret")
+        LikedItem.objects.like(user, self.grinder)
+        # A real token, through JWTAuthentication like the sync routes
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(user)}")
+        liked = {
+            product["title"]: product["liked"]
+            for product in self.assertSameAsSync("/products/", {"include": "liked"})["results"]
+        }
+        self.assertEqual(liked, {"Beans": False, "Grinder": True})
+        self.assertTrue(self.assertSameAsSync(f"/products/{self.grinder.pk}/", {"include": "liked"})["liked"])
+
+        self.client.credentials(HTTP_AUTHORIZATION="JWT garbage")
+        for path in ("/store/async/products/", "/store/products/"):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path, {"include": "liked"}).status_code, 401)
+
+
+class PriceWithTaxTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        # 0.15 * 1.10 = 0.165, rounded half up
+        make_products(self.collection, ["Default"], unit_price=Decimal("0.15"))
+        books = Collection.objects.create(title="Books", tax_rate=Decimal("0.2"))
+        make_products(books, ["Reduced"], unit_price=Decimal("0.15"))
+        self.free = Collection.objects.create(title="Food", tax_rate=Decimal("0"))
+        (self.exempt,) = make_products(self.free, ["Exempt"], unit_price=Decimal("0.15"))
+
+    def prices(self, **params):
+        response = self.client.get("/store/products/", params)
+        return {product["title"]: product["price_with_tax"] for product in response.data["results"]}
+
+    def test_rates_and_rounding(self):
+        expected = {"Default": Decimal("0.17"), "Reduced": Decimal("0.18"), "Exempt": Decimal("0.15")}
+        self.assertEqual(self.prices(), expected)
+        # The serializer list path rather than the flat one
+        self.assertEqual(self.prices(include="tags"), expected)
+        response = self.client.get(f"/store/products/{self.exempt.pk}/")
+        self.assertEqual(response.data["price_with_tax"], Decimal("0.15"))
+
+    @override_settings(STORE_TAX_RATE="0.0825")
+    def test_default_rate_setting(self):
+        # 0.15 * 1.0825 = 0.162375
+        self.assertEqual(self.prices()["Default"], Decimal("0.16"))
+
+    def test_rate_changes_update_cached_prices(self):
+        self.assertEqual(self.prices()["Exempt"], Decimal("0.15"))
+        self.free.tax_rate = Decimal("0.5")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.free.save()
+        self.assertEqual(self.prices()["Exempt"], Decimal("0.23"))
+
+
+class FlatListTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        make_products(self.collection, ["Café crème", "Beans"], unit_price=Decimal("10.50"), description="")
+        taxed = Collection.objects.create(title="Tea", tax_rate=Decimal("0.0825"))
+        make_products(taxed, ["Pot"], unit_price=Decimal("9999.99"), description='Says "hi"\n')
+        Collection.objects.create(title="Empty")
+
+    def assertSameBytes(self, url):
+        flat = self.client.get(url)
+        cache.clear()
+        with mock.patch.object(FlatListMixin, "get_flat_serializer", return_value=None):
+            regular = self.client.get(url)
+        self.assertEqual(flat.status_code, 200)
+        self.assertEqual(flat.content, regular.content)
+
+    def test_same_output_as_the_serializers(self):
+        for url in [
+            "/store/products/",
+            "/store/products/?ordering=-unit_price&page_limit=2",
+            "/store/products/?search=beans",
+            "/store/collections/",
+        ]:
+            with self.subTest(url=url):
+                self.assertSameBytes(url)
+
+    def test_only_columns_compile(self):
+        self.assertIsNotNone(get_flat_serializer(ProductModelSerializer))
+        self.assertIsNotNone(get_flat_serializer(CollectionModelSerializer))
+        # Not a ModelSerializer
+        self.assertIsNone(get_flat_serializer(ProductSerializer))
+
+        class MethodFieldSerializer(CollectionModelSerializer):
+            class Meta(CollectionModelSerializer.Meta):
+                fields = ["id", "title", "shouted"]
+
+            shouted = serializers.SerializerMethodField()
+
+            def get_shouted(self, collection):
+                return collection.title.upper()
+
+        self.assertIsNone(get_flat_serializer(MethodFieldSerializer))
+
+    def test_lists_skip_model_instances(self):
+        with mock.patch.object(Product, "from_db") as from_db:
+            self.client.get("/store/products/")
+        from_db.assert_not_called()
+
+
+class IncludeTagsTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = make_products(self.collection, [f"Product {i}" for i in range(5)])
+        self.dark, self.organic = Tag.objects.create(label="dark"), Tag.objects.create(label="Organic")
+        for tag in (self.organic, self.dark):
+            TaggedItem.objects.create(tag=tag, content_object=self.products[0])
+        TaggedItem.objects.create(tag=self.dark, content_object=self.products[1])
+
+    def tags(self, url):
+        response = self.client.get(url, {"include": "tags", "ordering": "title"})
+        self.assertEqual(response.status_code, 200)
+        products = response.data["results"] if "results" in response.data else [response.data]
+        return [[tag["label"] for tag in product["tags"]] for product in products]
+
+    def test_list_and_detail(self):
+        # Ordered by label
+        self.assertEqual(self.tags("/store/products/"), [["Organic", "dark"], ["dark"], [], [], []])
+        self.assertEqual(self.tags(f"/store/products/{self.products[0].pk}/"), [["Organic", "dark"]])
+        self.assertNotIn("tags", self.client.get("/store/products/").data["results"][0])
+
+    def test_one_query_per_page(self):
+        counts = []
+        for page_limit in (2, 5):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/store/products/", {"include": "tags", "page_limit": page_limit})
+            counts.append(len([query for query in queries if "tags_taggeditem" in query["sql"]]))
+        self.assertEqual(counts, [1, 1])
+
+    def test_tag_changes_are_served(self):
+        url = f"/store/products/{self.products[1].pk}/"
+        self.assertEqual(self.tags("/store/products/")[1], ["dark"])
+        self.assertEqual(self.tags(url), [["dark"]])
+
+        self.dark.label = "Dark roast"
+        self.dark.save()
+        TaggedItem.objects.create(tag=self.organic, content_object=self.products[1])
+        self.assertEqual(self.tags("/store/products/")[1], ["Dark roast", "Organic"])
+        self.assertEqual(self.tags(url), [["Dark roast", "Organic"]])
@@ -2,7 +2,7 @@
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter,DefaultRouter
 from rest_framework_nested.routers import NestedSimpleRouter,NestedDefaultRouter
-from . import views
+from . import async_views, views
 
 # Nested routers
 
@@ -23,6 +23,17 @@ urlpatterns = [
     path("",include(router.urls)),
     path("", include(cart_router.urls)),
     path("",include(review_router.urls)),
+    path("cache/stats/", views.cache_statistics),
+    path("query-stats/", views.query_statistics),
+    path("db/pool/stats/", views.pool_statistics),
+    path("orders/export/", views.export_orders),
+    path("analytics/revenue/", views.revenue_analytics),
+    # Async (ASGI) versions of the read endpoints
+    path("async/products/", async_views.product_list),
+    path("async/products/<int:pk>/", async_views.product_detail),
+    path("async/collections/", async_views.collection_list),
+    path("async/collections/<int:pk>/", async_views.collection_detail),
+    path("async/carts/<uuid:pk>/", async_views.cart_detail),
 ]
 
 
@@ -1,17 +1,20 @@
 
 from django.shortcuts import render,get_object_or_404
+from django.contrib.contenttypes.models import ContentType
 # from django.http import HttpResponse, HttpRequest
-from django.db.models import Count
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 
 from django_filters.rest_framework import DjangoFilterBackend
 
-from rest_framework.exceptions import NotFound
-from rest_framework.decorators import api_view,action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.decorators import api_view,action,permission_classes
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.views import APIView
 from rest_framework.permissions import (
     IsAuthenticated,
+    IsAuthenticatedOrReadOnly,
     AllowAny,IsAdminUser,
     DjangoModelPermissions,
     DjangoModelPermissionsOrAnonReadOnly
@@ -34,12 +37,23 @@ from rest_framework.filters import SearchFilter,OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 
 
-from store.filters import CollectionFilter, ProductFilter
-from store.pagination import CustomLimitOffsetPagination, DefaultPagination
+from core.db import pool as db_pool
+from core.db.replicas import ReplicaReadMixin
+from likes.counters import counters as like_counters
+from likes.models import LikedItem
+from store.analytics import revenue_report
+from store.cache import CachedResponseMixin, ConditionalGetMixin, stats as cache_stats
+from store.exports import FORMATS, order_rows
+from store.filters import CollectionFilter, FullTextSearchFilter, OrderFilter, ProductFilter
+from store.flat import FlatListMixin
+from store.middleware import stats as query_stats, summarize
+from store.optimizer import OptimizedQuerySetMixin, optimize_queryset
+from store.pagination import CustomLimitOffsetPagination, DefaultPagination, KeysetPagination
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from .models import Cart, CartItem, Collection, Customer, OrderItem, Product, Review
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Review
 from .serializers import (
     AddCartItemSerializer,
+    BulkAddCartItemSerializer,
     CartItemSerializer,
     CartSerializer,
     CollectionModelSerializer,
@@ -48,22 +62,26 @@ from .serializers import (
     ProductSerializer,
     ProductModelSerializer,
     ReviewSerializer,
+    RevenueQuerySerializer,
     UpdateCartItemSerializer
     )
 
 
 # ViewSets
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, OptimizedQuerySetMixin, ConditionalGetMixin, CachedResponseMixin, FlatListMixin, ModelViewSet):
+    cache_namespace = "products"
     queryset = Product.objects.all()
     serializer_class = ProductModelSerializer
     permission_classes = [IsAdminOrReadOnly]
-    filter_backends = [DjangoFilterBackend,SearchFilter,OrderingFilter]
+    # filter_backends = [DjangoFilterBackend,SearchFilter,OrderingFilter]
+    filter_backends = [DjangoFilterBackend,FullTextSearchFilter,OrderingFilter]
     # filterset_fields = ["collection_id"]
     filterset_class = ProductFilter
     # pagination_class = PageNumberPagination # don't need this line if there is global config
     # pagination_class = DefaultPagination
-    pagination_class = CustomLimitOffsetPagination
+    # pagination_class = CustomLimitOffsetPagination
+    pagination_class = KeysetPagination
     search_fields = ["title","description"]
     ordering_fields = ['unit_price','last_update']
     
@@ -76,16 +94,65 @@ class ProductViewSet(ModelViewSet):
     #     return queryset
     
     def get_serializer_context(self):
-        return { "request":self.request }
+        # ?include=tags adds each product's tags, ?include=liked whether the user liked it
+        include = self.request.query_params.get("include", "").split(",")
+        return {
+            "request":self.request,
+            "include_tags":"tags" in include,
+            "liked_by":self.request.user if "liked" in include else None,
+        }
+    
+    def get_flat_serializer(self):
+        # Tags are nested objects and likes per user, those lists take the regular serializer
+        context = self.get_serializer_context()
+        if context["include_tags"] or context["liked_by"] is not None:
+            return None
+        return super().get_flat_serializer()
+    
+    def get_extra_validators(self):
+        # ETags and cached responses with likes are per user
+        user = self.get_serializer_context()["liked_by"]
+        if user is None or not user.is_authenticated:
+            return {}
+        return {"user": user.pk, "likes": LikedItem.objects.version_for(user, Product)}
     
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
            return Response({'Error':"Product cannot be deleted because it has an association with order"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)     
         return super().destroy(request, *args, **kwargs)
     
+    @action(detail=True, methods=['GET','POST','DELETE'], permission_classes=[IsAuthenticatedOrReadOnly])
+    def like(self, request:Request, pk)->Response:
+        # Reads the primary (not in replica_actions), so a like is seen right away
+        product = get_object_or_404(Product.objects.only('pk'), pk=pk)
+        content_type = ContentType.objects.get_for_model(Product)
+        if request.method == "POST":
+            LikedItem.objects.like(request.user, product)
+            liked = True
+        elif request.method == "DELETE":
+            LikedItem.objects.unlike(request.user, product)
+            liked = False
+        else:
+            liked = product.pk in LikedItem.objects.liked_ids(request.user, Product, [product.pk])
+        likes = like_counters.counts(content_type, [product.pk])[product.pk]
+        return Response({"liked": liked, "likes": likes})
+    
+    @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
+    def liked(self, request:Request)->Response:
+        # ?ids=1,2,3 -> the ones the user liked, in one query
+        ids = request.query_params.get("ids", "")
+        try:
+            ids = {int(pk) for pk in ids.split(",") if pk}
+        except ValueError:
+            raise ValidationError({"ids": "A comma separated list of product ids."})
+        if len(ids) > 100:
+            raise ValidationError({"ids": "At most 100 product ids."})
+        return Response({"liked": sorted(LikedItem.objects.liked_ids(request.user, Product, ids))})
+    
     
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(products_count=Count("products"))
+class CollectionViewSet(ReplicaReadMixin, OptimizedQuerySetMixin, CachedResponseMixin, FlatListMixin, ModelViewSet):
+    cache_namespace = "collections"
+    queryset = Collection.objects.all()
     serializer_class = CollectionModelSerializer
     permission_classes = [IsAdminOrReadOnly]
     filter_backends = [DjangoFilterBackend]
@@ -93,27 +160,27 @@ class CollectionViewSet(ModelViewSet):
     
     
     def update(self, request, *args, **kwargs):
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")),pk=kwargs['pk'])
+        collection = get_object_or_404(Collection,pk=kwargs['pk'])
         collection_serializer = CollectionModelSerializer(collection,data=request.data)
         collection_serializer.is_valid(raise_exception=True)
         collection_serializer.save()
         return super().update(request, *args, **kwargs)
     
     # def put(self, request:Request, pk:int)->Response:
-    #     collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")),pk=pk)
+    #     collection = get_object_or_404(Collection,pk=pk)
     #     collection_serializer = CollectionModelSerializer(collection,data=request.data)
     #     collection_serializer.is_valid(raise_exception=True)
     #     collection_serializer.save()
     #     return Response(data=collection_serializer.data)
     
     def destroy(self, request, *args, **kwargs):
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")),pk=kwargs['pk'])
+        collection = get_object_or_404(Collection,pk=kwargs['pk'])
         if collection.products.count() > 0:
             return Response({"error":"Collection cannot be deleted because it has an association with products"},status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
     
     # def delete(self, request:Request,pk:int)->Response:
-    #     collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")),pk=pk)
+    #     collection = get_object_or_404(Collection,pk=pk)
     #     if collection.products.count() > 0:
     #         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
     #     collection.delete()
@@ -121,7 +188,7 @@ class CollectionViewSet(ModelViewSet):
     
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ReplicaReadMixin, OptimizedQuerySetMixin, ModelViewSet):
     serializer_class = ReviewSerializer
     
     def get_queryset(self):
@@ -132,11 +199,16 @@ class ReviewViewSet(ModelViewSet):
         return {"product_id":self.kwargs['product_pk']}
 
 
-class CartViewSet(CreateModelMixin,
+class CartViewSet(OptimizedQuerySetMixin,
+                  CreateModelMixin,
                   RetrieveModelMixin,
                   DestroyModelMixin,
                   GenericViewSet):
-    queryset = Cart.objects.prefetch_related("items__product").all()
+    # Line and cart totals are computed by the database, the optimizer
+    # joins the products and loads only the columns CartSerializer renders
+    queryset = Cart.objects.with_total_price().prefetch_related(
+        Prefetch("items", queryset=CartItem.objects.with_total_price())
+    )
     serializer_class = CartSerializer
     
     # def get_queryset(self):
@@ -144,11 +216,13 @@ class CartViewSet(CreateModelMixin,
         
     
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(OptimizedQuerySetMixin, ModelViewSet):
     http_method_names = ["get","post","patch","delete"]
     
     def get_serializer_class(self):
-        if self.request.method == "POST":
+        if self.action == "bulk":
+            return BulkAddCartItemSerializer
+        elif self.request.method == "POST":
             return AddCartItemSerializer
         elif self.request.method == "PATCH":
             return UpdateCartItemSerializer
@@ -156,13 +230,21 @@ class CartItemViewSet(ModelViewSet):
     
     def get_queryset(self):
         return CartItem.objects.filter(cart_id=self.kwargs['cart_pk'])\
-            .select_related("product")
+            .with_total_price()
             
     def get_serializer_context(self):
         return {"cart_id":self.kwargs['cart_pk']}
+    
+    # Add or update many products in one request
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request:Request, cart_pk)->Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart_items = serializer.save()
+        return Response(AddCartItemSerializer(cart_items, many=True).data)
 
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(OptimizedQuerySetMixin, ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     # permission_classes = [IsAdminUser]
@@ -198,9 +280,9 @@ class CustomerViewSet(ModelViewSet):
     
 # Generic views
 
-class ProductListCreateView(ListCreateAPIView):
+class ProductListCreateView(OptimizedQuerySetMixin, ListCreateAPIView):
     
-    queryset = Product.objects.select_related("collection").all()
+    queryset = Product.objects.all()
     serializer_class = ProductModelSerializer
     
     # if you don't have a logic(some calculation) 
@@ -236,12 +318,12 @@ class ProductRetrieveUpdateDestroyView(RetrieveUpdateDestroyAPIView):
         return { 'request':self.request }
     
     
-class CollectionListCreateView(ListCreateAPIView):
-    queryset = Collection.objects.annotate(products_count=Count("products")).all()
+class CollectionListCreateView(OptimizedQuerySetMixin, ListCreateAPIView):
+    queryset = Collection.objects.all()
     serializer_class = CollectionModelSerializer
     
     # def get_queryset(self):
-    #     return Collection.objects.annotate(products_count=Count("products")).all()
+    #     return Collection.objects.all()
     
     # def get_serializer_class(self):
     #     return CollectionModelSerializer
@@ -252,7 +334,7 @@ class CollectionListCreateView(ListCreateAPIView):
 class ProductList(APIView):
     
     def get(self,request:Request)->Response:
-        product_queryset = Product.objects.select_related("collection").all()
+        product_queryset = optimize_queryset(Product.objects.all(), ProductModelSerializer)
         product_serializer = ProductModelSerializer(product_queryset, many=True,context={"request":request})
         return Response(product_serializer.data)
 
@@ -263,7 +345,7 @@ class ProductList(APIView):
         return Response(product_serializer.data,status=status.HTTP_201_CREATED)    
 
 
-class ProductDetailRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
+class ProductDetailRetrieveUpdateDestroyAPIView(OptimizedQuerySetMixin, RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductModelSerializer
     lookup_field = "id"
@@ -300,7 +382,7 @@ class ProductDetail(APIView):
 class CollectionList(APIView):
     
     def get(self, request:Request)->Response:
-        collection_queryset = Collection.objects.annotate(products_count=Count("products")).all()
+        collection_queryset = Collection.objects.all()
         collection_serializer = CollectionModelSerializer(collection_queryset,many=True)
         return Response(collection_serializer.data)
         
@@ -311,19 +393,19 @@ class CollectionList(APIView):
         return Response(collection_serializer.data,status=status.HTTP_201_CREATED)
         
 
-class CollectionDetailRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
-    queryset = Collection.objects.annotate(products_count=Count('products'))
+class CollectionDetailRetrieveUpdateDestroyAPIView(OptimizedQuerySetMixin, RetrieveUpdateDestroyAPIView):
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
     
     def put(self, request:Request,pk:int)->Response:
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")), pk=pk)
+        collection = get_object_or_404(Collection,pk=pk)
         collection_serializer = CollectionModelSerializer(collection,data=request.data)
         collection_serializer.is_valid(raise_exception=True)
         collection_serializer.save()
         return Response(collection_serializer.data)
     
     def delete(self,request:Request, pk:int)->Response:
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")),pk=pk)
+        collection = get_object_or_404(Collection,pk=pk)
         if collection.products.count() > 0:
             return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
         collection.delete()
@@ -333,19 +415,19 @@ class CollectionDetailRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView)
 class CollectionDetail(APIView):
     
     def get(self, request:Request,pk:int)->Response:
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count('products')),pk=pk)
+        collection = get_object_or_404(Collection,pk=pk)
         collection_serializer = CollectionModelSerializer(collection)
         return Response(collection_serializer.data)
         
     def put(self, request:Request,pk:int)->Response:
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")), pk=pk)
+        collection = get_object_or_404(Collection,pk=pk)
         collection_serializer = CollectionModelSerializer(collection,data=request.data)
         collection_serializer.is_valid(raise_exception=True)
         collection_serializer.save()
         return Response(collection_serializer.data)
     
     def delete(self, request:Request,pk:int)->Response:
-        collection = get_object_or_404(Collection.objects.annotate(products_count=Count("products")),pk=pk)
+        collection = get_object_or_404(Collection,pk=pk)
         if collection.products.count() > 0:
             return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
         
@@ -358,7 +440,7 @@ class CollectionDetail(APIView):
 @api_view(['GET',"POST"])
 def product_list(request: Request) -> Response:
     if request.method == "GET":
-        product_queryset = Product.objects.select_related("collection").all()
+        product_queryset = optimize_queryset(Product.objects.all(), ProductSerializer)
         products_serializer = ProductSerializer(product_queryset, 
                                                 many=True,
                                                 context={'request':request}
@@ -417,7 +499,7 @@ def product_detail(request:Request,id:int) -> Response:
 @api_view(["GET","POST"])
 def collection_list(request:Request)->Response:
     if request.method == "GET":
-        collection_queryset = Collection.objects.annotate(products_count=Count('products')).all()
+        collection_queryset = Collection.objects.all()
         collection_serializer = CollectionModelSerializer(collection_queryset,many=True)
         return Response(collection_serializer.data)
     
@@ -430,7 +512,7 @@ def collection_list(request:Request)->Response:
 
 @api_view(["GET","DELETE","PUT"])
 def collection_detail(request:Request,pk:int)->Response:
-    collection = get_object_or_404(Collection.objects.annotate(products_count=Count('products')),pk=pk)
+    collection = get_object_or_404(Collection,pk=pk)
     if request.method == "GET":
         collection_serializer = CollectionModelSerializer(collection)
         return Response(collection_serializer.data)
@@ -447,3 +529,49 @@ def collection_detail(request:Request,pk:int)->Response:
  
         collection.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def cache_statistics(request:Request)->Response:
+    return Response(cache_stats.snapshot())
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def query_statistics(request:Request)->Response:
+    return Response(summarize(query_stats.snapshot()))
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def pool_statistics(request:Request)->Response:
+    # This worker process' connection pools
+    return Response(db_pool.snapshot())
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def export_orders(request:Request)->StreamingHttpResponse:
+    # ?format= is taken by DRF's content negotiation
+    export_format = request.query_params.get("export_format", "csv")
+    if export_format not in FORMATS:
+        raise ValidationError({"export_format": [f"Must be one of {', '.join(FORMATS)}"]})
+    filterset = OrderFilter(request.query_params, queryset=Order.objects.all())
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+
+    (lines, content_type) = FORMATS[export_format]
+    # Rows are fetched while the response is being sent
+    response = StreamingHttpResponse(lines(order_rows(filterset.qs)), content_type=content_type)
+    response.headers["Content-Disposition"] = f'attachment; filename="orders.{export_format}"'
+    return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def revenue_analytics(request:Request)->Response:
+    # Served from the rollup tables, see store.analytics
+    serializer = RevenueQuerySerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return Response(revenue_report(**serializer.validated_data))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -53,6 +54,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'store.middleware.QueryStatsMiddleware',
+    'core.db.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,9 +102,131 @@ DATABASES = {
         "USER":"root",
         "PASSWORD":"MyPassword",
         "PORT":"3306",
+        "OPTIONS": {},
+        # Persistent connections work for WSGI
+        # (not ASGI, where every request runs in a new thread):
+        # "CONN_MAX_AGE": 60,
+        # "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Opt-in connection pool, e.g. for ASGI: DB_POOL=1 runs default through
+# core.db.backends.mysql, Django's MySQL backend plus core/db/pool.py
+DB_POOL = os.environ.get("DB_POOL", "") == "1"
+
+if DB_POOL:
+    DATABASES['default'].update({
+        'ENGINE': 'core.db.backends.mysql',
+        # Connections go back to the pool at the end of each request
+        "CONN_MAX_AGE": 0,
+    })
+    # Per worker process, keep max_size * workers below max_connections
+    DATABASES['default']["OPTIONS"]["pool"] = {
+        "max_size": 10,
+        "timeout": 10,
+        "max_lifetime": 1800,
+        "max_idle": 300,
+        "check_interval": 30,
+    }
+
+
+# Read replicas
+# Catalog reads (ReplicaReadMixin on the product, collection and review
+# viewsets) go to DATABASE_REPLICAS["ALIASES"], everything else to default.
+# To try it locally with two SQLite files, copy db.sqlite3 to replica.sqlite3 and use
+# DATABASES = {
+#     'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.sqlite3'},
+#     'replica': {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': BASE_DIR / 'replica.sqlite3',
+#         'TEST': {'MIRROR': 'default'},
+#     },
+# }
+# with "ALIASES": ["replica"] below.
+
+DATABASE_ROUTERS = ['core.db.replicas.PrimaryReplicaRouter']
+
+DATABASE_REPLICAS = {
+    "ALIASES": [],
+    # "round_robin" or "least_lag"
+    "SELECTION": "round_robin",
+    "MAX_LAG": 10,
+    "LAG_CHECK_INTERVAL": 5,
+    "PIN_SECONDS": 10,
+    # Writers are pinned by cookie and, when authenticated, by user id in
+    # this cache. With the per-process LocMemCache below a pin only reaches
+    # the worker that made the write, use a shared backend with replicas
+    "PIN_CACHE": "default",
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# LocMemCache is per process: invalidation (a version incr() in
+# store.cache) only reaches the worker that made the write, the others
+# serve their cached collections until TIMEOUT. Product responses are
+# cached under their ETags, which every worker computes from the rows. Deploy with several workers on a
+# shared backend (Memcached, Redis) for immediate invalidation.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        # or share it between workers on one host:
+        # "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        # "LOCATION": BASE_DIR / "cache",
+        "LOCATION": "storefront",
+        # Bounds how stale other workers' responses can get
+        "TIMEOUT": 300,
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    }
+}
+
+
+# Per-request query statistics, see store.middleware.QueryStatsMiddleware
+# Dump them with: python manage.py query_stats
+
+QUERY_STATS = {
+    "PATH_PREFIXES": ["/store/"],
+    # Queries per request, including the authentication lookup.
+    # Products with ?include=tags,liked: user, ContentType (once per
+    # process), the user's like version, the page, tags and liked ids
+    "BUDGETS": {
+        "ProductViewSet.list": 6,
+        "ProductViewSet.retrieve": 6,
+        "CollectionViewSet.list": 2,
+        "CollectionViewSet.retrieve": 2,
+        "CartViewSet.retrieve": 3,
+        "CartItemViewSet.create": 4,
+        "CartItemViewSet.bulk": 8,
+    },
+    # Enable in tests to turn an exceeded budget into an error
+    "RAISE_ON_BUDGET": False,
+    "DUPLICATE_THRESHOLD": 2,
+    "FLUSH_INTERVAL": 30,
+    # Where each process writes its stats for the query_stats command,
+    # e.g. QUERY_STATS_DIR=/var/tmp/storefront-querystats. Not written if unset
+    "DUMP_DIR": os.environ.get("QUERY_STATS_DIR"),
+}
+
+# Tax added to product prices unless the collection sets its own
+# tax_rate. A string, so it stays an exact Decimal
+STORE_TAX_RATE = "0.10"
+
+# Like counts are summed per process and written every FLUSH_INTERVAL
+# seconds by a background thread, see likes.counters. Repair drift with: python manage.py reconcile_like_counts
+LIKE_COUNTERS = {
+    "FLUSH_INTERVAL": 2,
+    "MAX_PENDING": 1000,
+    "BATCH_SIZE": 500,
+}
+
+# Rows each poll choice's vote count is spread over, so voters on a busy
+# question don't queue on one row lock. Totals sum them, see polls.models
+POLL_VOTE_SHARDS = 16
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -25,6 +25,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('playground/', include('playground.urls')),
     path('store/', include('store.urls')),
+    path('polls/', include('polls.urls')),
     path('__debug__/',include(debug_toolbar.urls)),
     path("auth/",include('djoser.urls')),
     path("auth/",include('djoser.urls.jwt')),
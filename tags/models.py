@@ -1,3 +1,6 @@
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -14,6 +17,52 @@ class TaggedItemManager(models.Manager):
             content_type=content_type,
             object_id=obj_id
         )
+    
+    # Many objects at once: {object_id: [Tag, ...]} in one query,
+    # objects without tags are left out
+    def get_tags_for_objects(self, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return self._group(self._tagged_items(content_type, obj_ids))
+    
+    async def aget_tags_for_objects(self, obj_type, obj_ids):
+        # get_for_model() only queries the first time, but may
+        content_type = await sync_to_async(ContentType.objects.get_for_model)(obj_type)
+        return self._group([item async for item in self._tagged_items(content_type, obj_ids)])
+    
+    # Sets obj.tags = [Tag, ...] on a page of objects of one model
+    def prefetch_tags(self, objects, to_attr='tags'):
+        objects = list(objects)
+        if objects:
+            tags = self.get_tags_for_objects(type(objects[0]), [obj.pk for obj in objects])
+            self._attach(objects, tags, to_attr)
+        return objects
+    
+    async def aprefetch_tags(self, objects, to_attr='tags'):
+        objects = list(objects)
+        if objects:
+            tags = await self.aget_tags_for_objects(type(objects[0]), [obj.pk for obj in objects])
+            self._attach(objects, tags, to_attr)
+        return objects
+    
+    def _tagged_items(self, content_type, obj_ids):
+        # obj_ids may be a queryset, it becomes a subquery
+        return self.get_queryset()\
+            .select_related('tag')\
+            .filter(content_type=content_type, object_id__in=obj_ids)\
+            .order_by('tag__label', 'tag_id')
+    
+    @staticmethod
+    def _group(tagged_items):
+        tags = defaultdict(list)
+        for tagged_item in tagged_items:
+            tags[tagged_item.object_id].append(tagged_item.tag)
+        return dict(tags)
+    
+    @staticmethod
+    def _attach(objects, tags, to_attr):
+        for obj in objects:
+            setattr(obj, to_attr, tags.get(obj.pk, []))
+        
 class Tag(models.Model):
     label = models.CharField(max_length=255)
     
@@ -32,4 +81,11 @@ class TaggedItem(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
     
+    class Meta:
+        # Lookups filter on the generic key, the tag column makes the
+        # index covering so the rows themselves aren't read
+        indexes = [
+            models.Index(fields=['content_type','object_id','tag']),
+        ]
+    
   
\ No newline at end of file